@@ -21,12 +21,190 @@ if not SECRET_KEY:
 
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 
-try:
-    ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
-except ValueError:
-    raise ValueError("Invalid ACCESS_TOKEN_EXPIRE_MINUTES value in .env file.")
+
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        raise ValueError(f"Invalid {name} value in .env file.")
+
+
+def _bool_env(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    if value.strip().lower() in {"1", "true", "yes", "on"}:
+        return True
+    if value.strip().lower() in {"0", "false", "no", "off"}:
+        return False
+    raise ValueError(f"Invalid {name} value in .env file.")
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        raise ValueError(f"Invalid {name} value in .env file.")
+
+
+ACCESS_TOKEN_EXPIRE_MINUTES = _int_env("ACCESS_TOKEN_EXPIRE_MINUTES", 30)
 
 ADMIN_USER = os.getenv('ADMIN_USER')
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD')
 if not ADMIN_USER or not ADMIN_PASSWORD:
     raise ValueError("ADMIN_USER and ADMIN_PASSWORD must be set in the environment.")
+
+# Render engine: number of worker processes (0 renders on a background thread
+# instead), how many renders may wait for a free worker before new ones are
+# rejected with 503, and the Retry-After hint sent with that rejection.
+RENDER_WORKERS = _int_env("RENDER_WORKERS", os.cpu_count() or 1)
+RENDER_QUEUE_DEPTH = _int_env("RENDER_QUEUE_DEPTH", 64)
+RENDER_RETRY_AFTER = _int_env("RENDER_RETRY_AFTER", 1)
+
+# Admission control, applied before renders are queued. Each subject (user,
+# or client address on public endpoints) may start ADMISSION_RATE renders per
+# second with bursts of ADMISSION_BURST, and the renders in flight may cost
+# at most ADMISSION_CAPACITY units in total, a render costing its QR version
+# times its box size. Requests over a limit get 429 or 503 with Retry-After.
+# A rate or capacity of 0 disables that limit. ADMISSION_MAX_SUBJECTS bounds
+# the number of rate limit buckets kept in memory.
+ADMISSION_RATE = _float_env("ADMISSION_RATE", 20.0)
+ADMISSION_BURST = _int_env("ADMISSION_BURST", 40)
+ADMISSION_CAPACITY = _int_env("ADMISSION_CAPACITY", 400 * max(RENDER_WORKERS, 1))
+ADMISSION_MAX_SUBJECTS = _int_env("ADMISSION_MAX_SUBJECTS", 10000)
+
+# zlib compression level (0-9) used when encoding QR code PNG images.
+PNG_COMPRESSION_LEVEL = _int_env("PNG_COMPRESSION_LEVEL", 6)
+
+# Error correction level (L, M, Q or H) used for generated QR codes.
+QR_ERROR_CORRECTION = os.getenv("QR_ERROR_CORRECTION", "M").upper()
+if QR_ERROR_CORRECTION not in {"L", "M", "Q", "H"}:
+    raise ValueError("QR_ERROR_CORRECTION must be one of L, M, Q or H.")
+
+# Upper bound in bytes for rendered images kept in memory (0 disables the cache).
+RENDER_CACHE_MAX_BYTES = _int_env("RENDER_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+
+# Whether created QR codes are written to QR_DIRECTORY. When disabled, images
+# are only rendered on demand by GET /qr-codes/{id}.png.
+QR_PERSIST = _bool_env("QR_PERSIST", True)
+
+# Stored QR codes are kept as their packed module matrix (a few hundred bytes)
+# and images of any size and colors are drawn from it on demand. Enable to
+# also store the PNG image at the requested size, for download from
+# /SERVER_DOWNLOAD_FOLDER/ with a bearer token or a signed URL.
+QR_STORE_IMAGES = _bool_env("QR_STORE_IMAGES", False)
+
+# nginx internal location serving QR_DIRECTORY (see nginx/nginx.conf). When
+# set, authorized downloads from the filesystem backend are answered with an
+# X-Accel-Redirect to it and nginx sends the file; otherwise the API sends it.
+DOWNLOAD_ACCEL_REDIRECT = os.getenv("DOWNLOAD_ACCEL_REDIRECT", "")
+
+# Seconds a signed download URL (GET /qr-codes/{id}/download-url) stays valid.
+DOWNLOAD_URL_TTL = _int_env("DOWNLOAD_URL_TTL", 300)
+
+# Whether stored QR codes are flushed to disk (fsync) before being moved into
+# place, so that a crash cannot leave a truncated image behind. Only worth
+# disabling where durability does not matter, such as a tmpfs.
+QR_FSYNC = _bool_env("QR_FSYNC", True)
+
+# Maximum number of QR codes of one batch request rendered at the same time.
+BATCH_CONCURRENCY = _int_env("BATCH_CONCURRENCY", 8)
+
+# Largest page the listing endpoint returns. Listings are streamed, reading
+# LIST_CHUNK_SIZE entries from the index at a time, so memory use does not
+# grow with the page size.
+LIST_MAX_LIMIT = _int_env("LIST_MAX_LIMIT", 100000)
+LIST_CHUNK_SIZE = _int_env("LIST_CHUNK_SIZE", 500)
+
+# Expiry sweeper: QR codes created with a ttl are deleted once expired, found
+# through the index's expiry order rather than by scanning the directory.
+# The sweeper checks every QR_SWEEP_INTERVAL seconds (0 disables it) and
+# deletes QR_SWEEP_BATCH_SIZE codes at a time, at most QR_SWEEP_RATE per
+# second, so a backlog of expired codes is worked off in the background.
+QR_SWEEP_INTERVAL = _float_env("QR_SWEEP_INTERVAL", 60.0)
+QR_SWEEP_BATCH_SIZE = _int_env("QR_SWEEP_BATCH_SIZE", 100)
+QR_SWEEP_RATE = _float_env("QR_SWEEP_RATE", 200.0)
+
+# Where QR codes are stored: "filesystem" keeps one file per QR code under
+# QR_DIRECTORY, "sqlite" packs them into the WAL-mode SQLite database at
+# QR_BLOB_PATH, read through a pool of QR_BLOB_POOL_SIZE connections and
+# written by one thread committing up to QR_BLOB_BATCH_SIZE writes at a time.
+# Copy an existing directory into the database with
+# ``python -m app.services.storage``.
+QR_STORAGE_BACKEND = os.getenv("QR_STORAGE_BACKEND", "filesystem").lower()
+if QR_STORAGE_BACKEND not in {"filesystem", "sqlite"}:
+    raise ValueError("QR_STORAGE_BACKEND must be 'filesystem' or 'sqlite'.")
+QR_BLOB_PATH = Path(os.getenv("QR_BLOB_PATH", QR_DIRECTORY.with_name(f"{QR_DIRECTORY.name}.blobs.sqlite"))).resolve()
+QR_BLOB_POOL_SIZE = _int_env("QR_BLOB_POOL_SIZE", 4)
+QR_BLOB_BATCH_SIZE = _int_env("QR_BLOB_BATCH_SIZE", 64)
+
+# Layout of QR_DIRECTORY: "flat" stores base64-named files directly in it,
+# "sharded" uses content-hash names in nested prefix directories (ab/cd/abcd....png)
+# with a .url sidecar holding the original URL.
+QR_STORAGE_LAYOUT = os.getenv("QR_STORAGE_LAYOUT", "flat").lower()
+if QR_STORAGE_LAYOUT not in {"flat", "sharded"}:
+    raise ValueError("QR_STORAGE_LAYOUT must be 'flat' or 'sharded'.")
+
+# Log output format: "text" uses the formatter from logging.conf, "json" writes
+# one compact JSON object per record.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+if LOG_FORMAT not in {"text", "json"}:
+    raise ValueError("LOG_FORMAT must be 'text' or 'json'.")
+
+# Fraction of requests (0.0-1.0) whose INFO-level messages are logged.
+# Warnings and errors are always logged.
+LOG_INFO_SAMPLE_RATE = _float_env("LOG_INFO_SAMPLE_RATE", 1.0)
+if not 0.0 <= LOG_INFO_SAMPLE_RATE <= 1.0:
+    raise ValueError("LOG_INFO_SAMPLE_RATE must be between 0 and 1.")
+
+# Verified access tokens kept in memory so repeated requests skip JWT
+# signature checks: maximum number of tokens, and how long (in seconds) a
+# token is trusted before being verified again (0 disables the cache).
+# Cached tokens never outlive their own expiry.
+TOKEN_CACHE_MAX_ENTRIES = _int_env("TOKEN_CACHE_MAX_ENTRIES", 10000)
+TOKEN_CACHE_TTL = _int_env("TOKEN_CACHE_TTL", 300)
+
+# Minimum number of seconds between counts of the stored QR codes, summed
+# from the QR index, for the file count and size reported by /metrics.
+METRICS_DIRECTORY_SCAN_INTERVAL = _int_env("METRICS_DIRECTORY_SCAN_INTERVAL", 60)
+
+# SQLite database indexing the stored QR codes for listing; defaults to a file
+# next to QR_DIRECTORY so that it is not served along with the images.
+QR_INDEX_PATH = Path(os.getenv("QR_INDEX_PATH", QR_DIRECTORY.with_name(f"{QR_DIRECTORY.name}.index.sqlite"))).resolve()
+
+# Render jobs (POST /qr-codes/jobs) are queued in the SQLite database at
+# QR_JOB_PATH, so that they survive restarts, and rendered highest priority
+# first by QR_JOB_WORKERS workers in every process (0 leaves them to other
+# processes), which check for new jobs at least every QR_JOB_POLL_INTERVAL
+# seconds. A job not finished QR_JOB_LEASE seconds after a worker took it,
+# because that process died, is taken again, up to QR_JOB_MAX_ATTEMPTS times.
+# Finished jobs are kept for QR_JOB_RETENTION seconds; status requests wait
+# at most QR_JOB_MAX_WAIT seconds for a job to finish.
+QR_JOB_PATH = Path(os.getenv("QR_JOB_PATH", QR_DIRECTORY.with_name(f"{QR_DIRECTORY.name}.jobs.sqlite"))).resolve()
+QR_JOB_WORKERS = _int_env("QR_JOB_WORKERS", 2)
+QR_JOB_POLL_INTERVAL = _float_env("QR_JOB_POLL_INTERVAL", 1.0)
+QR_JOB_LEASE = _float_env("QR_JOB_LEASE", 300.0)
+QR_JOB_MAX_ATTEMPTS = _int_env("QR_JOB_MAX_ATTEMPTS", 3)
+QR_JOB_RETENTION = _float_env("QR_JOB_RETENTION", 86400.0)
+QR_JOB_MAX_WAIT = _float_env("QR_JOB_MAX_WAIT", 30.0)
+
+# Production server (serve.py): address to bind, number of worker processes
+# (each with its own render engine), requests a worker handles before it is
+# replaced, plus a random jitter so workers do not restart together, and seconds
+# a stopping worker gets to finish in-flight requests and renders.
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = _int_env("SERVER_PORT", 8000)
+SERVER_WORKERS = _int_env("SERVER_WORKERS", os.cpu_count() or 1)
+SERVER_MAX_REQUESTS = _int_env("SERVER_MAX_REQUESTS", 10000)
+SERVER_MAX_REQUESTS_JITTER = _int_env("SERVER_MAX_REQUESTS_JITTER", 1000)
+SERVER_GRACEFUL_TIMEOUT = _int_env("SERVER_GRACEFUL_TIMEOUT", 30)
+
+# Comma-separated addresses of the reverse proxies whose X-Forwarded-For and
+# X-Forwarded-Proto headers serve.py trusts, so that public endpoints see (and
+# rate limit) the client address instead of the proxy's; "*" trusts any peer,
+# for when only the proxy can reach the server.
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+# Whether serve.py renders one QR code of every version before forking its
+# workers, so that the first requests do not pay for building lookup tables.
+SERVER_WARMUP = _bool_env("SERVER_WARMUP", True)
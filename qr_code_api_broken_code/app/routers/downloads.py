@@ -0,0 +1,78 @@
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, status
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+import logging
+import re
+from app.config import DOWNLOAD_ACCEL_REDIRECT
+from app.services.downloads import (UNVERSIONED_CACHE_CONTROL, VERSIONED_CACHE_CONTROL, download_response,
+                                    verify_download)
+from app.services.qr_formats import MEDIA_TYPES
+from app.services.qr_index import QRIndex, get_qr_index
+from app.services.storage import Storage, get_storage
+from app.utils.common import etag_matches, get_current_user, optional_oauth2_scheme, qr_relative_path
+from app.utils.token_cache import TokenCache, get_token_cache
+
+router = APIRouter()
+
+_IMAGE_FILENAME = re.compile(r"^[A-Za-z0-9_-]+\.png$")
+
+DOWNLOAD_RESPONSES = {200: {"content": {MEDIA_TYPES["png"]: {}}}, 304: {}, 401: {}, 403: {}, 404: {}}
+
+
+async def _authorize(key: str, expires: Optional[int], signature: Optional[str], token: Optional[str],
+                     token_cache: TokenCache):
+    """
+    Checks that the request carries a valid download signature for ``key``
+    or a valid bearer token.
+
+    Raises:
+    - HTTPException: 403 for an invalid or expired signature, 401 for a
+      missing or invalid token.
+    """
+    if signature is not None:
+        if expires is None or not verify_download(key, expires, signature):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired download URL.")
+        return
+    if token is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    await get_current_user(token, token_cache)
+
+
+@router.get("/{key:path}", response_class=Response, responses=DOWNLOAD_RESPONSES)
+async def download_qr_code(
+    request: Request,
+    key: str,
+    v: Optional[str] = Query(None, description="Image version; versioned URLs are cacheable forever."),
+    expires: Optional[int] = Query(None, description="Expiry time of a signed URL, in seconds since the epoch."),
+    signature: Optional[str] = Query(None, description="Signature of a signed URL."),
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    token_cache: TokenCache = Depends(get_token_cache),
+    index: QRIndex = Depends(get_qr_index),
+    storage: Storage = Depends(get_storage),
+):
+    """
+    Download a stored QR code image (stored with QR_STORE_IMAGES) with a
+    bearer token or a signed URL from GET /qr-codes/{id}/download-url.
+    Behind nginx the file is sent by nginx through an internal redirect.
+    """
+    await _authorize(key, expires, signature, token, token_cache)
+    qr_filename = key.rsplit("/", 1)[-1]
+    if not _IMAGE_FILENAME.match(qr_filename) or qr_relative_path(qr_filename) != key:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="QR code not found.")
+
+    entry = await run_in_threadpool(index.get, qr_filename)
+    stored = await run_in_threadpool(storage.stat, key) if entry is not None else None
+    if stored is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="QR code not found.")
+
+    headers = {"Cache-Control": VERSIONED_CACHE_CONTROL if v and v == entry.version else UNVERSIONED_CACHE_CONTROL}
+    if entry.version:
+        headers["ETag"] = f'"{entry.version}"'
+        if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    logging.debug("Sending QR code image %s", key)
+    return download_response(storage, stored, MEDIA_TYPES["png"], headers, DOWNLOAD_ACCEL_REDIRECT)
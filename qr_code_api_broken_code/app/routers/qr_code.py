@@ -1,45 +1,192 @@
-from fastapi import APIRouter, HTTPException, Depends, Response, status
-from fastapi.responses import JSONResponse
-from fastapi.security import OAuth2PasswordBearer
-from typing import List
-from app.schema import QRCodeRequest, QRCodeResponse
-from app.services.qr_service import generate_qr_code, list_qr_codes, delete_qr_code
-from app.utils.common import encode_url_to_filename, get_current_user
-from app.config import QR_DIRECTORY, SERVER_BASE_URL, FILL_COLOR, BACK_COLOR, SERVER_DOWNLOAD_FOLDER
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+from typing import Any, AsyncIterator, List, Literal, Optional, Tuple
+from urllib.parse import urlencode
+from app.schema import (OutputFormat, QRCodeBulkDeleteRequest, QRCodeBulkDeleteResponse, QRCodeDownloadURLResponse,
+                        QRCodeJobRequest, QRCodeJobResponse, QRCodeRequest, QRCodeResponse)
+from app.services.admission import (AdmissionController, AdmissionRejected, RateLimited, estimate_cost,
+                                    get_admission_controller)
+from app.services.downloads import content_version, sign_download
+from app.services.expiry import purge, purge_prefix
+from app.services.jobs import Job, JobDeferred, JobFailed, JobHandler, JobRunner, get_job_runner
+from app.services.qr_formats import MATRIX_FORMATS, MEDIA_TYPES, negotiate_format
+from app.services.qr_index import QRIndex, get_qr_index
+from app.services.qr_service import (render_qr_code_cached, render_key_cached, qr_code_stored_async, store_qr_code_async,
+                                     delete_stored_qr_code_async)
+from app.services.render_cache import RenderCache, get_render_cache, render_key
+from app.services.render_engine import RenderEngine, RenderQueueFull, get_render_engine
+from app.services.storage import Storage, get_storage, qr_keys, stored_url
+from app.utils.metrics import stage
+from app.utils.streaming import NDJSON_CONTENT_TYPES, NDJSONStreamingResponse, iter_json_array, iter_ndjson
+from app.utils.common import (etag_matches, generate_links, get_current_user, get_optional_user, is_hashed_qr_id,
+                              qr_relative_path, url_to_qr_id, validate_and_sanitize_url)
+from app.config import (SERVER_BASE_URL, FILL_COLOR, BACK_COLOR, SERVER_DOWNLOAD_FOLDER, RENDER_RETRY_AFTER,
+                        DOWNLOAD_URL_TTL, QR_ERROR_CORRECTION, QR_JOB_MAX_WAIT, QR_PERSIST, QR_STORAGE_LAYOUT, QR_STORE_IMAGES,
+                        BATCH_CONCURRENCY, LIST_CHUNK_SIZE, LIST_MAX_LIMIT)
+from datetime import datetime, timezone
+import asyncio
+import json
 import logging
-
-# OAuth2 setup with token URL
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
+import time
 
 # APIRouter instance
 router = APIRouter()
 
-@router.post("/", response_model=QRCodeResponse, status_code=status.HTTP_201_CREATED)
-async def create_qr_code(request: QRCodeRequest, token: str = Depends(oauth2_scheme)):
+# Rendered images are a pure function of their parameters, so they never change.
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Stored QR codes need credentials and expire or are deleted, so only private
+# caches keep them, revalidating them (by ETag) instead of serving them after
+# they are gone.
+STORED_IMAGE_CACHE_CONTROL = "private, no-cache"
+
+IMAGE_RESPONSES = {200: {"content": {media_type: {} for media_type in MEDIA_TYPES.values()}}, 304: {}, 406: {}}
+
+FORMAT_DESCRIPTION = "Representation to return; defaults to negotiation on the Accept header."
+
+
+def _render_busy() -> HTTPException:
+    logging.warning("Render queue is full, rejecting QR code request")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy rendering QR codes, please retry later.",
+        headers={"Retry-After": str(RENDER_RETRY_AFTER)}
+    )
+
+
+def _admission_rejected(e: AdmissionRejected) -> HTTPException:
+    if isinstance(e, RateLimited):
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many QR code requests, please retry later.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    logging.warning("Render capacity exhausted, rejecting QR code request")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy rendering QR codes, please retry later.",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+def _user_subject(current_user: dict) -> str:
+    return f"user:{current_user['username']}"
+
+
+def _client_subject(request: Request) -> str:
+    # Public endpoints have no user to limit; limit the client address instead.
+    return f"client:{request.client.host if request.client else 'unknown'}"
+
+
+def _download_url(qr_filename: str, version: Optional[str] = None, **params: str) -> str:
+    url = f"{SERVER_BASE_URL}/{SERVER_DOWNLOAD_FOLDER}/{qr_relative_path(qr_filename)}"
+    if version:
+        params = {"v": version, **params}
+    return f"{url}?{urlencode(params)}" if params else url
+
+def _representation_url(qr_filename: str, output_format: str, size: int) -> str:
+    url = f"{SERVER_BASE_URL}/qr-codes/{qr_filename[:-len('.png')]}.{output_format}"
+    return url if output_format in MATRIX_FORMATS else f"{url}?size={size}"
+
+def _qr_code_url(qr_filename: str, output_format: str, size: Optional[int], version: Optional[str] = None) -> str:
     """
-    Create a new QR code for a given URL.
+    URL of a stored QR code: its download URL for a stored PNG image, versioned
+    by the image's content hash when known, otherwise the API URL rendering it
+    from the stored matrix.
     """
-    logging.info(f"Creating QR code for: {request.url}")
-    current_user = get_current_user(token)
+    if QR_STORE_IMAGES and output_format == "png":
+        return _download_url(qr_filename, version)
+    return _representation_url(qr_filename, output_format, size or 10)
 
-    encoded_url = encode_url_to_filename(request.url)
-    qr_filename = f"{encoded_url}.png"
-    qr_code_full_path = QR_DIRECTORY / qr_filename
+def _qr_filename(request: QRCodeRequest) -> str:
+    # Without persistence the ID must be decodable back to the URL on read.
+    return f"{url_to_qr_id(request.url, QR_STORAGE_LAYOUT if QR_PERSIST else 'flat')}.png"
 
-    if qr_code_full_path.exists():
-        return JSONResponse(
-            status_code=status.HTTP_409_CONFLICT,
-            content={"message": "QR code already exists."}
-        )
+def _stored(storage: Storage, qr_id: str) -> Tuple[Optional[Storage], Optional[str]]:
+    """
+    Where the packed matrix of a stored QR code would be, if QR codes are stored.
+    """
+    return (storage, f"{qr_id}.png") if QR_PERSIST else (None, None)
+
+
+async def _create_one(request: QRCodeRequest, engine: RenderEngine, cache: RenderCache,
+                      index: QRIndex, storage: Storage) -> Tuple[str, str]:
+    """
+    Renders the QR code for a request, stores it when persistence is enabled
+    and returns its filename and the URL it can be fetched from.
+
+    What is stored is the packed module matrix, plus the PNG image with
+    QR_STORE_IMAGES; every other size and color is drawn from the matrix on
+    request.
+
+    Raises:
+    - FileExistsError: If the QR code has already been stored, including by a
+      concurrent request for the same URL that stored it first.
+    - RenderQueueFull: If the render engine is at capacity.
+    """
+    with stage("encode"):
+        qr_filename = _qr_filename(request)
+
+    if not QR_PERSIST:
+        # Nothing to store; warm the cache for the requested format.
+        await render_qr_code_cached(str(request.url), engine=engine, cache=cache, fill_color=FILL_COLOR,
+                                    back_color=BACK_COLOR, size=request.size, output_format=request.format)
+        return qr_filename, _representation_url(qr_filename, request.format, request.size)
+
+    # Saves a render in the common case; store_qr_code_async decides races.
+    with stage("filesystem"):
+        exists = await qr_code_stored_async(storage, qr_filename)
+    if exists:
+        raise FileExistsError(f"QR code {qr_filename} already exists.")
+
+    matrix = await render_qr_code_cached(str(request.url), engine=engine, cache=cache, output_format="bin")
+    sidecar_url = str(request.url) if QR_STORAGE_LAYOUT == "sharded" else None
+    image = version = None
+    if QR_STORE_IMAGES:
+        image = await render_qr_code_cached(str(request.url), engine=engine, cache=cache, fill_color=FILL_COLOR,
+                                            back_color=BACK_COLOR, size=request.size)
+        version = content_version(image)
+    with stage("filesystem"):
+        await store_qr_code_async(storage, qr_filename, matrix, url=sidecar_url, image=image)
+    with stage("index"):
+        expires_at = time.time() + request.ttl if request.ttl else None
+        await run_in_threadpool(index.add, qr_filename, str(request.url), request.size, expires_at=expires_at,
+                                version=version, stored_files=1 if image is None else 2,
+                                stored_bytes=len(matrix) + len(image or b""))
+    return qr_filename, _qr_code_url(qr_filename, request.format, request.size, version)
+
+@router.post("/", response_model=QRCodeResponse, status_code=status.HTTP_201_CREATED)
+async def create_qr_code(
+    request: QRCodeRequest,
+    current_user: dict = Depends(get_current_user),
+    engine: RenderEngine = Depends(get_render_engine),
+    cache: RenderCache = Depends(get_render_cache),
+    index: QRIndex = Depends(get_qr_index),
+    storage: Storage = Depends(get_storage),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """
+    Create a new QR code for a given URL. With a ttl, the QR code is deleted
+    once that many seconds have passed.
+    """
+    logging.info("Creating QR code for: %s", request.url)
 
     try:
-        generate_qr_code(
-            data=request.url,
-            path=qr_code_full_path,
-            fill_color=FILL_COLOR,
-            back_color=BACK_COLOR,
-            size=request.size
+        with admission.admit(_user_subject(current_user), estimate_cost(str(request.url), request.size, request.format)):
+            qr_filename, qr_code_url = await _create_one(request, engine, cache, index, storage)
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    except FileExistsError:
+        # Other sizes of an existing QR code need no new one: point to the requested variant.
+        return JSONResponse(
+            status_code=status.HTTP_409_CONFLICT,
+            content={"message": "QR code already exists.",
+                     "qr_code_url": _qr_code_url(_qr_filename(request), request.format, request.size)}
         )
+    except RenderQueueFull:
+        raise _render_busy()
     except Exception as e:
         logging.exception("Error generating QR code")
         raise HTTPException(
@@ -47,21 +194,270 @@ async def create_qr_code(request: QRCodeRequest, token: str = Depends(oauth2_sch
             detail=f"Error generating QR code: {str(e)}"
         )
 
-    qr_code_url = f"{SERVER_BASE_URL}/{SERVER_DOWNLOAD_FOLDER}/{qr_filename}"
     return QRCodeResponse(
         message="QR code created successfully.",
-        qr_code_url=qr_code_url
+        qr_code_url=qr_code_url,
+        links=generate_links("create", qr_filename, SERVER_BASE_URL, qr_code_url)
     )
 
-@router.get("/", response_model=List[QRCodeResponse])
-async def list_qr_codes_endpoint(token: str = Depends(oauth2_scheme)):
+async def _batch_item_result(position: int, request: QRCodeRequest, engine: RenderEngine, cache: RenderCache,
+                             index: QRIndex, storage: Storage, admission: AdmissionController) -> dict:
+    result = {"index": position, "url": str(request.url), "status": status.HTTP_201_CREATED, "qr_code_url": None, "error": None}
+    try:
+        with admission.reserve(estimate_cost(str(request.url), request.size, request.format)):
+            _, result["qr_code_url"] = await _create_one(request, engine, cache, index, storage)
+    except FileExistsError:
+        result.update(status=status.HTTP_409_CONFLICT, error="QR code already exists.",
+                      qr_code_url=_qr_code_url(_qr_filename(request), request.format, request.size))
+    except (RenderQueueFull, AdmissionRejected):
+        result.update(status=status.HTTP_503_SERVICE_UNAVAILABLE, error="Server is busy rendering QR codes, please retry later.")
+    except Exception as e:
+        logging.exception("Error generating QR code in batch")
+        result.update(status=status.HTTP_500_INTERNAL_SERVER_ERROR, error=f"Error generating QR code: {str(e)}")
+    return result
+
+async def _run_batch(items: AsyncIterator[Any], engine: RenderEngine, cache: RenderCache,
+                     index: QRIndex, storage: Storage, admission: AdmissionController) -> AsyncIterator[bytes]:
+    """
+    Validates and creates the QR codes of a batch with at most BATCH_CONCURRENCY
+    renders in flight, yielding one NDJSON result line per item in completion
+    order. Both queues are bounded, so neither a large batch nor a slow reader
+    makes memory grow.
+    """
+    work: asyncio.Queue = asyncio.Queue(maxsize=BATCH_CONCURRENCY)
+    results: asyncio.Queue = asyncio.Queue(maxsize=BATCH_CONCURRENCY)
+
+    async def produce():
+        position = 0
+        try:
+            async for item in items:
+                try:
+                    request = QRCodeRequest.model_validate(item)
+                except ValidationError as e:
+                    url = item.get("url") if isinstance(item, dict) else None
+                    await results.put({"index": position, "url": url, "status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                       "qr_code_url": None, "error": e.errors(include_url=False, include_context=False)})
+                else:
+                    await work.put((position, request))
+                position += 1
+        except (ValueError, ClientDisconnect) as e:
+            await results.put({"index": position, "url": None, "status": status.HTTP_400_BAD_REQUEST,
+                               "qr_code_url": None, "error": f"Malformed batch body: {str(e)}"})
+        finally:
+            for _ in range(BATCH_CONCURRENCY):
+                await work.put(None)
+
+    async def consume():
+        while (entry := await work.get()) is not None:
+            await results.put(await _batch_item_result(*entry, engine, cache, index, storage, admission))
+
+    async def run():
+        try:
+            await asyncio.gather(produce(), *(consume() for _ in range(BATCH_CONCURRENCY)))
+        except Exception:
+            logging.exception("Batch processing failed")
+        await results.put(None)
+
+    runner = asyncio.ensure_future(run())
+    try:
+        while (result := await results.get()) is not None:
+            yield (json.dumps(result) + "\n").encode("utf-8")
+    finally:
+        runner.cancel()
+
+@router.post(
+    "/batch",
+    response_class=NDJSONStreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}, "description": "One JSON result per line, in completion order."}},
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/QRCodeRequest"}}},
+        "application/x-ndjson": {"schema": {"$ref": "#/components/schemas/QRCodeRequest"}},
+    }}},
+)
+async def create_qr_codes_batch(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    engine: RenderEngine = Depends(get_render_engine),
+    cache: RenderCache = Depends(get_render_cache),
+    index: QRIndex = Depends(get_qr_index),
+    storage: Storage = Depends(get_storage),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """
+    Create many QR codes in one request. The body is a JSON array, or NDJSON
+    (one QRCodeRequest per line) with Content-Type application/x-ndjson.
+    Items are read, validated and rendered while the body is still streaming
+    in, and each item's result ({index, url, status, qr_code_url, error}) is
+    streamed back as one NDJSON line as soon as it completes. The batch counts
+    as one request against the rate limit; each item needs render capacity.
+    """
+    try:
+        admission.check_rate(_user_subject(current_user))
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    parse = iter_ndjson if content_type in NDJSON_CONTENT_TYPES else iter_json_array
+    return NDJSONStreamingResponse(_run_batch(parse(request.stream()), engine, cache, index, storage, admission))
+
+def job_handler(engine: RenderEngine, cache: RenderCache, index: QRIndex, storage: Storage,
+                admission: AdmissionController) -> JobHandler:
     """
-    List all available QR codes.
+    Returns the handler creating the QR code of a render job, as POST /qr-codes/
+    does. Jobs yield to requests: while the render capacity or the render
+    queue is full, they go back to the job queue. A job fails if its QR code
+    was stored before it was submitted; one stored since, such as by an
+    earlier attempt whose lease lapsed or that was cancelled, is its result.
     """
-    current_user = get_current_user(token)
+    async def handle(job: Job) -> dict:
+        request = QRCodeRequest.model_validate(job.request)
+        try:
+            with admission.reserve(estimate_cost(str(request.url), request.size, request.format)):
+                _, qr_code_url = await _create_one(request, engine, cache, index, storage)
+        except FileExistsError:
+            qr_filename = _qr_filename(request)
+            entry = await run_in_threadpool(index.get, qr_filename)
+            result = {"qr_code_url": _qr_code_url(qr_filename, request.format, request.size,
+                                                  entry.version if entry else None)}
+            if job.attempts > 1 or (entry is not None and entry.url == str(request.url)
+                                    and entry.created_at >= job.created_at):
+                return result
+            raise JobFailed("QR code already exists.", result)
+        except AdmissionRejected as e:
+            raise JobDeferred(e.retry_after)
+        except RenderQueueFull:
+            raise JobDeferred(RENDER_RETRY_AFTER)
+        return {"qr_code_url": qr_code_url}
+    return handle
 
+def _job_response(job: Job) -> QRCodeJobResponse:
+    status_url = f"{SERVER_BASE_URL}/qr-codes/jobs/{job.id}"
+    links = [{"rel": "self", "href": status_url, "action": "GET", "type": "application/json"}]
+    qr_code_url = (job.result or {}).get("qr_code_url")
+    if qr_code_url:
+        media_type = MEDIA_TYPES[job.request.get("format", "png")]
+        links.append({"rel": "result", "href": qr_code_url, "action": "GET", "type": media_type})
+    return QRCodeJobResponse(
+        job_id=job.id,
+        status=job.status,
+        priority=job.priority,
+        created_at=datetime.fromtimestamp(job.created_at, timezone.utc),
+        finished_at=datetime.fromtimestamp(job.finished_at, timezone.utc) if job.finished_at else None,
+        qr_code_url=qr_code_url,
+        error=job.error,
+        links=links,
+    )
+
+@router.post("/jobs", response_model=QRCodeJobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_render_job(
+    request: QRCodeJobRequest,
+    response: Response,
+    current_user: dict = Depends(get_current_user),
+    runner: JobRunner = Depends(get_job_runner),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """
+    Queue a QR code to be created in the background, for large sizes or long
+    URLs that need not be ready at once. Jobs are kept across restarts and
+    rendered highest priority first; follow the self link (Location header)
+    for the status and, once created, the QR code URL.
+    """
     try:
-        qr_files = list_qr_codes(QR_DIRECTORY)
+        admission.check_rate(_user_subject(current_user))
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    job = await run_in_threadpool(runner.queue.submit, current_user["username"],
+                                  request.model_dump(mode="json", exclude={"priority"}), request.priority)
+    runner.notify()
+    logging.info("Queued render job %s for: %s", job.id, request.url)
+    job_response = _job_response(job)
+    response.headers["Location"] = str(job_response.links[0].href)
+    return job_response
+
+@router.get("/jobs/{job_id}", response_model=QRCodeJobResponse)
+async def get_render_job(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=QR_JOB_MAX_WAIT,
+                        description="Seconds to wait for the job to finish before answering."),
+    current_user: dict = Depends(get_current_user),
+    runner: JobRunner = Depends(get_job_runner),
+):
+    """
+    Return the status of a render job. With wait, the response is held until
+    the job succeeds or fails, or the wait is over.
+    """
+    job = await run_in_threadpool(runner.queue.get, job_id)
+    if job is None or job.owner != current_user["username"]:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found.")
+    if wait and not job.finished:
+        job = await runner.wait(job_id, wait) or job
+    return _job_response(job)
+
+def _listing_item(entry) -> dict:
+    qr_code_url = _qr_code_url(entry.filename, "png", entry.size, entry.version)
+    return {
+        "message": "QR code available.",
+        "qr_code_url": qr_code_url,
+        "links": generate_links("list", entry.filename, SERVER_BASE_URL, qr_code_url),
+    }
+
+async def _iter_listing(index: QRIndex, limit: int, cursor: Optional[str], descending: bool,
+                        prefix: Optional[str], next_cursor: Optional[str], ndjson: bool) -> AsyncIterator[bytes]:
+    """
+    Serializes a listing page one index chunk at a time, as NDJSON or as the
+    elements of a JSON array. Items are built as plain dicts and dumped
+    directly: they are produced here, so validating them as models is wasted work.
+
+    The next page's cursor is sent in the headers, before the page is read,
+    so the page runs up to that cursor rather than to ``limit`` entries:
+    entries added or removed meanwhile are neither skipped nor repeated.
+    """
+    pages = index.iter_pages(limit, cursor, descending, prefix, page_size=LIST_CHUNK_SIZE, until=next_cursor)
+    separator = "\n" if ndjson else ","
+    first = True
+    if not ndjson:
+        yield b"["
+    while True:
+        with stage("index"):
+            entries = await run_in_threadpool(next, pages, None)
+        if entries is None:
+            break
+        with stage("serialize"):
+            chunk = separator.join(json.dumps(_listing_item(entry), separators=(",", ":")) for entry in entries)
+        if ndjson:
+            chunk += "\n"
+        elif not first:
+            chunk = "," + chunk
+        first = False
+        yield chunk.encode("utf-8")
+    if not ndjson:
+        yield b"]"
+
+@router.get("/", response_model=List[QRCodeResponse],
+            responses={200: {"content": {"application/x-ndjson": {}}}})
+async def list_qr_codes_endpoint(
+    request: Request,
+    limit: int = Query(100, ge=1, le=LIST_MAX_LIMIT, description="Maximum number of QR codes to return."),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the previous page's X-Next-Cursor header."),
+    order: Literal["asc", "desc"] = Query("asc", description="Sort by creation time, oldest or newest first."),
+    prefix: Optional[str] = Query(None, description="Only list QR codes whose URL starts with this prefix."),
+    current_user: dict = Depends(get_current_user),
+    index: QRIndex = Depends(get_qr_index),
+):
+    """
+    List available QR codes, one page at a time. When more results exist, the
+    cursor for the next page is returned in the X-Next-Cursor header and as a
+    Link header with rel="next".
+
+    The page is streamed as a JSON array while it is read from the index, or
+    as NDJSON (one QR code per line) when the Accept header asks for
+    application/x-ndjson, so large pages start arriving immediately.
+    """
+    descending = order == "desc"
+    try:
+        with stage("index"):
+            next_cursor = await run_in_threadpool(index.next_cursor, limit, cursor, descending, prefix)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logging.exception("Error listing QR codes")
         raise HTTPException(
@@ -69,31 +465,286 @@ async def list_qr_codes_endpoint(token: str = Depends(oauth2_scheme)):
             detail=f"Error listing QR codes: {str(e)}"
         )
 
-    return [
-        QRCodeResponse(
-            message="QR code available.",
-            qr_code_url=f"{SERVER_BASE_URL}/{SERVER_DOWNLOAD_FOLDER}/{qr_file}"
+    headers = {}
+    if next_cursor:
+        params = {"limit": limit, "cursor": next_cursor, "order": order}
+        if prefix:
+            params["prefix"] = prefix
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{SERVER_BASE_URL}/qr-codes/?{urlencode(params)}>; rel="next"'
+
+    accept = request.headers.get("accept", "")
+    ndjson = any(media_type.split(";")[0].strip().lower() in NDJSON_CONTENT_TYPES for media_type in accept.split(","))
+    return StreamingResponse(
+        _iter_listing(index, limit, cursor, descending, prefix, next_cursor, ndjson),
+        media_type="application/x-ndjson" if ndjson else "application/json",
+        headers=headers
+    )
+
+def _negotiated_format(request: Request, output_format: Optional[str]) -> str:
+    """
+    Returns the explicitly requested output format, or the one negotiated from
+    the Accept header.
+    """
+    if output_format is not None:
+        return output_format
+    negotiated = negotiate_format(request.headers.get("accept"))
+    if negotiated is None:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=f"Available representations: {', '.join(MEDIA_TYPES.values())}."
+        )
+    return negotiated
+
+def _extension_format(extension: str) -> str:
+    if extension not in MEDIA_TYPES:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="QR code not found.")
+    return extension
+
+def _not_authenticated() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+async def _url_for_qr_id(qr_id: str, storage: Storage, index: QRIndex,
+                         current_user: Optional[dict]) -> Tuple[str, bool]:
+    """
+    Returns the URL of a QR code ID and whether the ID names a stored QR code.
+    Stored QR codes need ``current_user``, and those that expired are not
+    found, even before they are swept; other base64 IDs are decoded and
+    rendered like ``/render``, for anyone.
+    """
+    url, stored = None, False
+    if QR_PERSIST:
+        if current_user is None and is_hashed_qr_id(qr_id):
+            raise _not_authenticated()
+        with stage("index"):
+            entry = await run_in_threadpool(index.get, f"{qr_id}.png")
+            if entry is None and await run_in_threadpool(index.is_expired, f"{qr_id}.png"):
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="QR code not found.")
+        url, stored = entry.url if entry else None, entry is not None or is_hashed_qr_id(qr_id)
+        if stored and current_user is None:
+            raise _not_authenticated()
+    try:
+        url = url or await run_in_threadpool(stored_url, storage, qr_id)
+    except ValueError:
+        url = None
+    if url is None or validate_and_sanitize_url(url) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="QR code not found.")
+    return url, stored
+
+async def _image_response(request: Request, url: str, size: int, fill_color: str, back_color: str,
+                          engine: RenderEngine, cache: RenderCache, admission: AdmissionController,
+                          output_format: str = "png", negotiated: bool = False,
+                          storage: Optional[Storage] = None, qr_filename: Optional[str] = None,
+                          cache_control: str = IMAGE_CACHE_CONTROL, subject: Optional[str] = None) -> Response:
+    try:
+        key = render_key(url, size, fill_color, back_color, QR_ERROR_CORRECTION, output_format)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+    headers = {"ETag": key.etag, "Cache-Control": cache_control}
+    if negotiated:
+        headers["Vary"] = "Accept"
+    if etag_matches(request.headers.get("if-none-match"), key.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        with admission.admit(subject or _client_subject(request), estimate_cost(url, size, output_format)):
+            image = await render_key_cached(key, engine, cache, storage, qr_filename)
+    except AdmissionRejected as e:
+        raise _admission_rejected(e)
+    except RenderQueueFull:
+        raise _render_busy()
+    except Exception as e:
+        logging.exception("Error rendering QR code")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error rendering QR code: {str(e)}"
+        )
+    return Response(content=image, media_type=MEDIA_TYPES[output_format], headers=headers)
+
+@router.get("/render", response_class=Response, responses=IMAGE_RESPONSES)
+async def render_qr_code_negotiated(
+    request: Request,
+    url: str = Query(..., description="The URL to encode into the QR code."),
+    size: int = Query(10, ge=1, le=40, description="Size of each box in the QR code grid."),
+    fill_color: str = Query(FILL_COLOR, description="Color of the QR code."),
+    back_color: str = Query(BACK_COLOR, description="Background color of the QR code."),
+    output_format: Optional[OutputFormat] = Query(None, alias="format", description=FORMAT_DESCRIPTION),
+    engine: RenderEngine = Depends(get_render_engine),
+    cache: RenderCache = Depends(get_render_cache),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """
+    Render the QR code for a URL given as a query parameter, without storing it,
+    in the representation chosen by the format parameter or the Accept header.
+    Responses carry a strong ETag and are cacheable forever.
+    """
+    output_format = _negotiated_format(request, output_format)
+    return await _image_response(request, url, size, fill_color, back_color, engine, cache, admission, output_format,
+                                 True)
+
+@router.get("/render.{extension}", response_class=Response, responses=IMAGE_RESPONSES)
+async def render_qr_code_endpoint(
+    request: Request,
+    extension: str,
+    url: str = Query(..., description="The URL to encode into the QR code."),
+    size: int = Query(10, ge=1, le=40, description="Size of each box in the QR code grid."),
+    fill_color: str = Query(FILL_COLOR, description="Color of the QR code."),
+    back_color: str = Query(BACK_COLOR, description="Background color of the QR code."),
+    engine: RenderEngine = Depends(get_render_engine),
+    cache: RenderCache = Depends(get_render_cache),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """
+    Render the QR code for a URL given as a query parameter, without storing it.
+    The extension selects the representation: png, svg, bin (packed module
+    matrix) or json (packed matrix in base64 with its metadata).
+    Responses carry a strong ETag and are cacheable forever.
+    """
+    output_format = _extension_format(extension)
+    return await _image_response(request, url, size, fill_color, back_color, engine, cache, admission, output_format)
+
+@router.get("/{qr_id}.{extension}", response_class=Response, responses=IMAGE_RESPONSES)
+async def get_qr_code_image(
+    request: Request,
+    qr_id: str,
+    extension: str,
+    size: int = Query(10, ge=1, le=40, description="Size of each box in the QR code grid."),
+    fill_color: str = Query(FILL_COLOR, description="Color of the QR code."),
+    back_color: str = Query(BACK_COLOR, description="Background color of the QR code."),
+    current_user: Optional[dict] = Depends(get_optional_user),
+    engine: RenderEngine = Depends(get_render_engine),
+    cache: RenderCache = Depends(get_render_cache),
+    index: QRIndex = Depends(get_qr_index),
+    storage: Storage = Depends(get_storage),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """
+    Render a QR code by its ID (the QR code filename without extension) on demand,
+    in the representation selected by the extension (png, svg, bin or json).
+    Stored QR codes need a bearer token, are drawn from their stored matrix
+    and are revalidated by their strong ETag, as they may expire or be
+    deleted; others are public, encoded from the URL in the ID and cacheable
+    forever.
+    """
+    output_format = _extension_format(extension)
+    url, stored = await _url_for_qr_id(qr_id, storage, index, current_user)
+    return await _image_response(request, url, size, fill_color, back_color, engine, cache, admission, output_format,
+                                 False, *_stored(storage, qr_id),
+                                 STORED_IMAGE_CACHE_CONTROL if stored else IMAGE_CACHE_CONTROL,
+                                 _user_subject(current_user) if current_user else None)
+
+@router.get("/{qr_id}", response_class=Response, responses=IMAGE_RESPONSES)
+async def get_qr_code_negotiated(
+    request: Request,
+    qr_id: str,
+    size: int = Query(10, ge=1, le=40, description="Size of each box in the QR code grid."),
+    fill_color: str = Query(FILL_COLOR, description="Color of the QR code."),
+    back_color: str = Query(BACK_COLOR, description="Background color of the QR code."),
+    output_format: Optional[OutputFormat] = Query(None, alias="format", description=FORMAT_DESCRIPTION),
+    current_user: Optional[dict] = Depends(get_optional_user),
+    engine: RenderEngine = Depends(get_render_engine),
+    cache: RenderCache = Depends(get_render_cache),
+    index: QRIndex = Depends(get_qr_index),
+    storage: Storage = Depends(get_storage),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    """
+    Render a QR code by its ID in the representation chosen by the format
+    parameter or the Accept header. Stored QR codes need a bearer token.
+    """
+    output_format = _negotiated_format(request, output_format)
+    url, stored = await _url_for_qr_id(qr_id, storage, index, current_user)
+    return await _image_response(request, url, size, fill_color, back_color, engine, cache, admission, output_format,
+                                 True, *_stored(storage, qr_id),
+                                 STORED_IMAGE_CACHE_CONTROL if stored else IMAGE_CACHE_CONTROL,
+                                 _user_subject(current_user) if current_user else None)
+
+@router.get("/{qr_id}/download-url", response_model=QRCodeDownloadURLResponse)
+async def get_download_url(
+    qr_id: str,
+    current_user: dict = Depends(get_current_user),
+    index: QRIndex = Depends(get_qr_index),
+    storage: Storage = Depends(get_storage),
+):
+    """
+    Issue a signed URL downloading a stored QR code image (stored with
+    QR_STORE_IMAGES) without a bearer token, valid for DOWNLOAD_URL_TTL seconds.
+    """
+    qr_filename = f"{qr_id}.png"
+    entry = await run_in_threadpool(index.get, qr_filename)
+    image_key = qr_keys(qr_filename)[1]
+    if entry is None or not await run_in_threadpool(storage.exists, image_key):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No stored image for this QR code.")
+    params = sign_download(image_key, DOWNLOAD_URL_TTL)
+    expires_at = datetime.fromtimestamp(int(params["expires"]), timezone.utc)
+    return QRCodeDownloadURLResponse(url=_download_url(qr_filename, entry.version, **params), expires_at=expires_at)
+
+@router.post("/bulk-delete", response_model=QRCodeBulkDeleteResponse)
+async def delete_qr_codes_endpoint(
+    request: QRCodeBulkDeleteRequest,
+    current_user: dict = Depends(get_current_user),
+    index: QRIndex = Depends(get_qr_index),
+    storage: Storage = Depends(get_storage),
+):
+    """
+    Delete many QR codes at once: those listed in filenames, or every QR code
+    whose URL starts with prefix. Filenames that are not stored are returned
+    in not_found.
+    """
+    try:
+        with stage("filesystem"):
+            if request.filenames is not None:
+                not_found = await run_in_threadpool(purge, index, storage, request.filenames)
+                deleted = len(request.filenames) - len(not_found)
+            else:
+                not_found = []
+                deleted = await run_in_threadpool(purge_prefix, index, storage, request.prefix)
+    except Exception as e:
+        logging.exception("Error deleting QR codes")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error deleting QR codes: {str(e)}"
         )
-        for qr_file in qr_files
-    ]
+    logging.info("Deleted %s QR codes", deleted)
+    return QRCodeBulkDeleteResponse(deleted=deleted, not_found=not_found)
 
 @router.delete("/{qr_filename}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_qr_code_endpoint(qr_filename: str, token: str = Depends(oauth2_scheme)):
+async def delete_qr_code_endpoint(
+    qr_filename: str,
+    current_user: dict = Depends(get_current_user),
+    index: QRIndex = Depends(get_qr_index),
+    storage: Storage = Depends(get_storage),
+):
     """
     Delete a specific QR code.
     """
-    current_user = get_current_user(token)
-
-    qr_code_path = QR_DIRECTORY / qr_filename
-    if not qr_code_path.exists():
-        logging.error(f"QR code {qr_filename} not found for deletion")
+    with stage("filesystem"):
+        exists = await qr_code_stored_async(storage, qr_filename)
+    if not exists:
+        with stage("index"):
+            await run_in_threadpool(index.remove, qr_filename)
+        logging.error("QR code %s not found for deletion", qr_filename)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="QR code not found."
         )
 
     try:
-        delete_qr_code(qr_code_path)
+        with stage("filesystem"):
+            await delete_stored_qr_code_async(storage, qr_filename)
+        with stage("index"):
+            await run_in_threadpool(index.remove, qr_filename)
+    except FileNotFoundError:
+        # Deleted by a concurrent request since the check above.
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="QR code not found."
+        )
     except Exception as e:
         logging.exception("Error deleting QR code")
         raise HTTPException(
@@ -1,5 +1,12 @@
-from pydantic import BaseModel, HttpUrl, Field, ConfigDict, conint, field_validator
-from typing import List, Optional
+from pydantic import BaseModel, HttpUrl, Field, ConfigDict, conint, constr, field_validator, model_validator
+from datetime import datetime
+from typing import List, Literal, Optional
+
+# Representations a QR code can be returned in, named by file extension:
+# PNG image, single-path SVG, bit-packed module matrix (binary or base64 JSON).
+OutputFormat = Literal["png", "svg", "bin", "json"]
+
+JobStatus = Literal["queued", "running", "succeeded", "failed"]
 
 
 class QRCodeRequest(BaseModel):
@@ -10,6 +17,10 @@ class QRCodeRequest(BaseModel):
     fill_color: str = Field(default="red", description="Color of the QR code.")
     back_color: str = Field(default="white", description="Background color of the QR code.")
     size: conint(ge=1, le=40) = Field(default=10, description="Size of the QR code grid, must be between 1 and 40.")
+    format: OutputFormat = Field(default="png", description="Representation the returned qr_code_url points to: "
+                                                          "png, svg, bin (packed module matrix) or json.")
+    ttl: Optional[conint(ge=1)] = Field(default=None, description="Seconds after which the QR code expires and is "
+                                                                  "deleted; kept until deleted when omitted.")
 
     @field_validator("fill_color", "back_color")
     def validate_color(cls, value: str) -> str:
@@ -40,7 +51,7 @@ class Link(BaseModel):
     rel: str = Field(..., description="Relation type of the link (e.g., 'self', 'next').")
     href: HttpUrl = Field(..., description="The URL of the link.")
     action: str = Field(..., description="HTTP method for the action this link represents.")
-    type: str = Field(default="application/json", description="Content type of the response for this link.")
+    type: str = Field(default="application/json", description="Media type of the representation this link returns.")
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -60,7 +71,8 @@ class QRCodeResponse(BaseModel):
     """
     message: str = Field(..., description="A message related to the QR code request.")
     qr_code_url: HttpUrl = Field(..., description="The URL to the generated QR code image.")
-    links: List[Link] = Field(default=[], description="HATEOAS links related to the QR code resource.")
+    links: List[Link] = Field(default=[], description="HATEOAS links related to the QR code resource, including "
+                                                      "one rel=alternate link per available representation.")
 
     model_config = ConfigDict(
         json_schema_extra={
@@ -80,6 +92,109 @@ class QRCodeResponse(BaseModel):
     )
 
 
+class QRCodeJobRequest(QRCodeRequest):
+    """
+    Schema for render jobs: QR code requests created in the background.
+    """
+    priority: conint(ge=0, le=9) = Field(default=0, description="Jobs with a higher priority are rendered first.")
+
+
+class QRCodeJobResponse(BaseModel):
+    """
+    Schema for the status of render jobs.
+    """
+    job_id: str = Field(..., description="ID of the job.")
+    status: JobStatus = Field(..., description="queued, running, succeeded or failed.")
+    priority: int = Field(..., description="Priority the job was submitted with.")
+    created_at: datetime = Field(..., description="When the job was submitted.")
+    finished_at: Optional[datetime] = Field(default=None, description="When the job succeeded or failed.")
+    qr_code_url: Optional[HttpUrl] = Field(default=None, description="The URL to the QR code, once created.")
+    error: Optional[str] = Field(default=None, description="Why the job failed.")
+    links: List[Link] = Field(default=[], description="HATEOAS links: the job status and, once created, the QR code.")
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "job_id": "3f0c4a2e9b8d4c6f8a1e2d3c4b5a6978",
+                "status": "queued",
+                "priority": 0,
+                "created_at": "2024-01-01T12:00:00Z",
+                "links": [
+                    {
+                        "rel": "self",
+                        "href": "https://api.example.com/qr-codes/jobs/3f0c4a2e9b8d4c6f8a1e2d3c4b5a6978",
+                        "action": "GET",
+                        "type": "application/json",
+                    }
+                ],
+            }
+        }
+    )
+
+
+class QRCodeBulkDeleteRequest(BaseModel):
+    """
+    Schema for deleting many QR codes at once, either by filename or by the
+    prefix of their original URL.
+    """
+    filenames: Optional[List[constr(pattern=r"^[A-Za-z0-9_-]+\.png$")]] = Field(
+        default=None, max_length=1000, description="Filenames of the QR codes to delete.")
+    prefix: Optional[constr(min_length=1)] = Field(
+        default=None, description="Delete every QR code whose URL starts with this prefix.")
+
+    @model_validator(mode="after")
+    def validate_selection(self) -> "QRCodeBulkDeleteRequest":
+        """
+        Validates that exactly one of filenames and prefix is given.
+        """
+        if (self.filenames is None) == (self.prefix is None):
+            raise ValueError("Provide either filenames or prefix.")
+        return self
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "prefix": "https://example.com/campaigns/spring/",
+            }
+        }
+    )
+
+
+class QRCodeBulkDeleteResponse(BaseModel):
+    """
+    Schema for bulk deletion results.
+    """
+    deleted: int = Field(..., description="Number of QR codes deleted.")
+    not_found: List[str] = Field(default=[], description="Requested filenames that were not stored.")
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "deleted": 42,
+                "not_found": [],
+            }
+        }
+    )
+
+
+class QRCodeDownloadURLResponse(BaseModel):
+    """
+    Schema for signed download URLs of stored QR code images.
+    """
+    url: HttpUrl = Field(..., description="URL downloading the image without a bearer token until it expires.")
+    expires_at: datetime = Field(..., description="When the URL stops working.")
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "url": "https://api.example.com/downloads/ab/cd/abcd.png?v=0123456789abcdef&expires=1700000000&"
+                       "signature=...",
+                "expires_at": "2023-11-14T22:13:20Z",
+            }
+        }
+    )
+
+
 class Token(BaseModel):
     """
     Schema for authentication tokens.
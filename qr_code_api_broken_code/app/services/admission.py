@@ -0,0 +1,202 @@
+import abc
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple
+from qrcode import exceptions, util
+from app.config import (ADMISSION_BURST, ADMISSION_CAPACITY, ADMISSION_MAX_SUBJECTS, ADMISSION_RATE,
+                        QR_ERROR_CORRECTION, RENDER_RETRY_AFTER)
+from app.services.matrix_engine import fit_version
+from app.services.qr_formats import MATRIX_FORMATS
+from app.services.qr_service import ERROR_CORRECTION_LEVELS
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a render is not admitted; ``retry_after`` is the number of
+    seconds after which it is worth retrying.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class RateLimited(AdmissionRejected):
+    """
+    Raised when a subject has used up its request rate.
+    """
+
+
+class OverCapacity(AdmissionRejected):
+    """
+    Raised when admitting a render would exceed the global render capacity.
+    """
+
+
+def estimate_cost(url: str, size: int, output_format: str = "png") -> int:
+    """
+    Estimates the cost of rendering a QR code as its version times its box
+    size; matrix formats do not depend on the box size. The version is the one
+    the URL needs when encoded as bytes, an upper bound of the actual one.
+    """
+    try:
+        version = fit_version(ERROR_CORRECTION_LEVELS[QR_ERROR_CORRECTION],
+                              ((util.MODE_8BIT_BYTE, len(url.encode("utf-8"))),))
+    except exceptions.DataOverflowError:
+        version = 40
+    return version * (1 if output_format in MATRIX_FORMATS else size)
+
+
+class AdmissionBackend(abc.ABC):
+    """
+    Holds the admission state: the token bucket of every subject and the
+    render cost in flight. Subclasses may keep it in a shared store so that
+    limits apply across processes.
+    """
+
+    @abc.abstractmethod
+    def take_token(self, subject: str, rate: float, burst: int) -> float:
+        """
+        Takes one token from the subject's bucket, which refills at ``rate``
+        tokens per second up to ``burst``. Returns 0 if a token was taken,
+        otherwise the seconds until one will be available.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def acquire(self, cost: int, capacity: int) -> bool:
+        """
+        Reserves ``cost`` units of the render capacity. Returns whether they
+        fit; a render is always admitted when nothing else is in flight, so
+        that one costlier than the whole capacity can still run.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def release(self, cost: int):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def in_flight(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryAdmissionBackend(AdmissionBackend):
+    """
+    Admission state of this process only. Limits therefore apply per worker
+    process. At most ``max_subjects`` buckets are kept; the least recently
+    used ones are forgotten first.
+    """
+
+    def __init__(self, max_subjects: int = ADMISSION_MAX_SUBJECTS):
+        self.max_subjects = max_subjects
+        self._lock = threading.Lock()
+        # Per subject: tokens left and when they were counted.
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._in_flight = 0
+
+    def take_token(self, subject: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(subject, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            taken = tokens >= 1
+            self._buckets[subject] = (tokens - 1 if taken else tokens, now)
+            self._buckets.move_to_end(subject)
+            while len(self._buckets) > self.max_subjects:
+                self._buckets.popitem(last=False)
+            return 0.0 if taken else (1 - tokens) / rate
+
+    def acquire(self, cost: int, capacity: int) -> bool:
+        with self._lock:
+            if self._in_flight and self._in_flight + cost > capacity:
+                return False
+            self._in_flight += cost
+            return True
+
+    def release(self, cost: int):
+        with self._lock:
+            self._in_flight -= cost
+
+    def in_flight(self) -> int:
+        return self._in_flight
+
+
+class AdmissionController:
+    """
+    Admits renders before they are queued: each subject (an authenticated
+    user or, for public endpoints, a client address) may start ``rate``
+    renders per second with bursts of up to ``burst``, and the renders in
+    flight may cost at most ``capacity`` units in total (see
+    ``estimate_cost``). Requests over either limit are rejected at once
+    instead of waiting for a worker. A rate or capacity of 0 disables that limit.
+    """
+
+    def __init__(self, rate: float = ADMISSION_RATE, burst: int = ADMISSION_BURST,
+                 capacity: int = ADMISSION_CAPACITY, backend: Optional[AdmissionBackend] = None):
+        if rate < 0 or burst < 1 or capacity < 0:
+            raise ValueError("Admission rate and capacity must not be negative, burst must be positive.")
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self.backend = backend or InMemoryAdmissionBackend()
+        self.rate_limited = 0
+        self.over_capacity = 0
+
+    def check_rate(self, subject: str):
+        """
+        Counts one request of ``subject`` against its rate.
+
+        Raises:
+        - RateLimited: If the subject has used up its rate.
+        """
+        if not self.rate:
+            return
+        wait = self.backend.take_token(subject, self.rate, self.burst)
+        if wait:
+            self.rate_limited += 1
+            raise RateLimited(math.ceil(wait))
+
+    @contextmanager
+    def reserve(self, cost: int) -> Iterator[None]:
+        """
+        Context manager holding ``cost`` units of the render capacity for its block.
+
+        Raises:
+        - OverCapacity: If the render does not fit in the remaining capacity.
+        """
+        if not self.capacity:
+            yield
+            return
+        if not self.backend.acquire(cost, self.capacity):
+            self.over_capacity += 1
+            raise OverCapacity(RENDER_RETRY_AFTER)
+        try:
+            yield
+        finally:
+            self.backend.release(cost)
+
+    @contextmanager
+    def admit(self, subject: str, cost: int) -> Iterator[None]:
+        """
+        ``check_rate`` followed by ``reserve``.
+        """
+        self.check_rate(subject)
+        with self.reserve(cost):
+            yield
+
+
+_admission: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """
+    Returns the process-wide admission controller. Usable as a FastAPI dependency.
+    """
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController()
+    return _admission
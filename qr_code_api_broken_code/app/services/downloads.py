@@ -0,0 +1,65 @@
+import base64
+import hashlib
+import hmac
+import time
+from typing import Dict, Optional
+from fastapi import Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+from app.config import DOWNLOAD_URL_TTL, SECRET_KEY
+from app.services.storage import FileSystemStorage, Storage, StoredObject
+
+# Versioned download URLs name one image for good; unversioned ones are
+# revalidated, as the QR code may be deleted and created again differently.
+# Downloads need credentials, so shared caches must not keep them.
+VERSIONED_CACHE_CONTROL = "private, max-age=31536000, immutable"
+UNVERSIONED_CACHE_CONTROL = "private, no-cache"
+
+
+def content_version(image: bytes) -> str:
+    """
+    Returns the version of a stored image: a hash of its content.
+    """
+    return hashlib.sha256(image).hexdigest()[:16]
+
+
+def _signature(key: str, expires: int) -> str:
+    digest = hmac.new(SECRET_KEY.encode("utf-8"), f"{key}\n{expires}".encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii").rstrip("=")
+
+
+def sign_download(key: str, ttl: int = DOWNLOAD_URL_TTL, now: Optional[float] = None) -> Dict[str, str]:
+    """
+    Returns the query parameters granting access to the stored object ``key``
+    for ``ttl`` seconds without a bearer token.
+    """
+    expires = int(time.time() if now is None else now) + ttl
+    return {"expires": str(expires), "signature": _signature(key, expires)}
+
+
+def verify_download(key: str, expires: int, signature: str, now: Optional[float] = None) -> bool:
+    """
+    Returns whether ``signature`` was issued by ``sign_download`` for ``key``
+    and has not expired.
+    """
+    if expires < (time.time() if now is None else now):
+        return False
+    # Compared as bytes: compare_digest rejects non-ASCII strings.
+    return hmac.compare_digest(signature.encode("utf-8"), _signature(key, expires).encode("ascii"))
+
+
+def download_response(storage: Storage, stored: StoredObject, media_type: str,
+                      headers: Dict[str, str], accel_redirect: str = "") -> Response:
+    """
+    Returns the response sending a stored object, without reading it in
+    Python where possible: an X-Accel-Redirect for nginx to send the file
+    (with ``accel_redirect`` and the filesystem backend), a file response, or
+    the object streamed from storage for the other backends.
+    """
+    if isinstance(storage, FileSystemStorage):
+        if accel_redirect:
+            headers = {**headers, "X-Accel-Redirect": f"{accel_redirect.rstrip('/')}/{stored.key}"}
+            return Response(media_type=media_type, headers=headers)
+        return FileResponse(storage.path(stored.key), media_type=media_type, headers=headers)
+    headers = {**headers, "Content-Length": str(stored.size)}
+    return StreamingResponse(iterate_in_threadpool(storage.stream(stored.key)), media_type=media_type, headers=headers)
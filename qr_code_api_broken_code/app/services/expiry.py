@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import time
+from typing import List, Optional
+from starlette.concurrency import run_in_threadpool
+from app.config import QR_SWEEP_BATCH_SIZE, QR_SWEEP_INTERVAL, QR_SWEEP_RATE
+from app.services.qr_index import QRIndex
+from app.services.qr_service import delete_qr_codes
+from app.services.storage import Storage
+
+
+def purge(index: QRIndex, storage: Storage, qr_filenames: List[str]) -> List[str]:
+    """
+    Deletes QR codes and their index entries. Entries whose QR codes are
+    already gone are removed from the index as well.
+
+    Returns:
+    - Filenames of the QR codes that were not found in storage.
+    """
+    not_found = delete_qr_codes(storage, qr_filenames)
+    index.remove_many(qr_filenames)
+    return not_found
+
+
+def purge_prefix(index: QRIndex, storage: Storage, prefix: str, batch_size: int = QR_SWEEP_BATCH_SIZE) -> int:
+    """
+    Deletes every QR code whose URL starts with ``prefix``, ``batch_size`` at a
+    time as found in the index.
+
+    Returns:
+    - Number of QR codes deleted.
+    """
+    deleted = 0
+    while True:
+        entries, _ = index.page(batch_size, prefix=prefix)
+        if not entries:
+            return deleted
+        filenames = [entry.filename for entry in entries]
+        deleted += len(filenames) - len(purge(index, storage, filenames))
+
+
+class ExpirySweeper:
+    """
+    Background task deleting expired QR codes in the order they expire, taken
+    from the index's expiry index. Deletions run on a worker thread, one batch
+    at a time, paced to at most ``rate`` per second so that working off a
+    backlog does not compete with requests; once caught up it waits
+    ``interval`` seconds before checking again.
+    """
+
+    def __init__(self, index: QRIndex, storage: Storage, interval: float = QR_SWEEP_INTERVAL,
+                 batch_size: int = QR_SWEEP_BATCH_SIZE, rate: float = QR_SWEEP_RATE):
+        if interval < 0 or batch_size < 1 or rate <= 0:
+            raise ValueError("Sweep interval must not be negative, batch size and rate must be positive.")
+        self.index = index
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.rate = rate
+        self.deleted = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sweep_batch(self, now: Optional[float] = None) -> int:
+        """
+        Deletes one batch of QR codes expired by ``now``. Returns the batch size.
+        """
+        filenames = self.index.expired(self.batch_size, now)
+        if filenames:
+            purge(self.index, self.storage, filenames)
+            self.deleted += len(filenames)
+            logging.info("Deleted %s expired QR codes", len(filenames))
+        return len(filenames)
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            try:
+                swept = await run_in_threadpool(self.sweep_batch)
+            except Exception:
+                logging.exception("Error deleting expired QR codes")
+                swept = 0
+            if swept < self.batch_size:
+                await asyncio.sleep(self.interval)
+            else:
+                await asyncio.sleep(max(swept / self.rate - (time.perf_counter() - start), 0))
+
+    def start(self):
+        """
+        Starts sweeping on the running event loop, unless disabled (interval 0).
+        """
+        if self.interval and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,336 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+from starlette.concurrency import run_in_threadpool
+from app.config import (QR_JOB_LEASE, QR_JOB_MAX_ATTEMPTS, QR_JOB_PATH, QR_JOB_POLL_INTERVAL, QR_JOB_RETENTION,
+                        QR_JOB_WORKERS)
+
+FINISHED_STATUSES = ("succeeded", "failed")
+
+# Minimum seconds between deletions of old finished jobs.
+_PRUNE_INTERVAL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (priority DESC, created_at) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS jobs_running ON jobs (started_at) WHERE status = 'running';
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at) WHERE finished_at IS NOT NULL;
+"""
+
+_COLUMNS = "id, owner, priority, request, status, attempts, created_at, started_at, finished_at, result, error"
+
+
+class Job(NamedTuple):
+    id: str
+    owner: str
+    priority: int
+    # The QR code request, as JSON-compatible data.
+    request: dict
+    status: str  # queued, running, succeeded or failed
+    attempts: int
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    result: Optional[dict]
+    error: Optional[str]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+
+def _job(row: tuple) -> Job:
+    return Job(*row[:3], json.loads(row[3]), *row[4:9], json.loads(row[9]) if row[9] else None, row[10])
+
+
+class JobFailed(Exception):
+    """
+    Raised by a job handler for a job that cannot succeed; ``result`` is
+    recorded with the error.
+    """
+
+    def __init__(self, message: str, result: Optional[dict] = None):
+        super().__init__(message)
+        self.result = result
+
+
+class JobDeferred(Exception):
+    """
+    Raised by a job handler to put a job back in the queue without counting
+    the attempt, such as when the renderers are busy; the worker pauses for
+    ``retry_after`` seconds before taking another job.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """
+    Render jobs kept in a SQLite database in WAL mode, so that they survive
+    restarts and are shared by every process using the database. Jobs are
+    taken highest priority first, oldest first within a priority. A taken job
+    is leased to its worker for ``lease`` seconds; a job still running after
+    that, its process having died, is taken again, or fails once it has been
+    taken ``max_attempts`` times.
+    """
+
+    def __init__(self, path: Path, lease: float = QR_JOB_LEASE, max_attempts: int = QR_JOB_MAX_ATTEMPTS):
+        if lease <= 0 or max_attempts < 1:
+            raise ValueError("Job lease and maximum attempts must be positive.")
+        self.path = Path(path)
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def submit(self, owner: str, request: dict, priority: int = 0) -> Job:
+        """
+        Queues a job and returns it.
+        """
+        job = Job(uuid.uuid4().hex, owner, priority, request, "queued", 0, time.time(), None, None, None, None)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, owner, priority, request, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job.id, owner, priority, json.dumps(request), job.status, job.created_at))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            row = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _job(row) if row else None
+
+    def take(self, now: Optional[float] = None) -> Optional[Job]:
+        """
+        Marks the next queued job as running and returns it, or None if no job is queued.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Jobs whose lease has lapsed: fail those out of attempts, queue the others again.
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Rendering did not finish.' "
+                    "WHERE status = 'running' AND started_at <= ? AND attempts >= ?",
+                    (now, now - self.lease, self.max_attempts))
+                self._conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND started_at <= ?",
+                                   (now - self.lease,))
+                # Selected, claimed and read back in three statements: UPDATE ... RETURNING
+                # needs SQLite 3.35, newer than that of Debian bullseye.
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY priority DESC, created_at LIMIT 1").fetchone()
+                if row:
+                    self._conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? "
+                                       "WHERE id = ?", (now, row[0]))
+                    row = self._conn.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (row[0],)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return _job(row) if row else None
+
+    def finish(self, job_id: str, attempt: int, result: Optional[dict] = None, error: Optional[str] = None) -> bool:
+        """
+        Records the outcome of ``attempt`` of a running job: failed if
+        ``error`` is given, succeeded otherwise. Returns whether that attempt
+        was running; a worker whose lease lapsed and whose job was taken again
+        changes nothing.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? "
+                "WHERE id = ? AND status = 'running' AND attempts = ?",
+                ("failed" if error else "succeeded", time.time(), json.dumps(result) if result else None, error,
+                 job_id, attempt)).rowcount > 0
+
+    def release(self, job_id: str, attempt: int) -> bool:
+        """
+        Puts ``attempt`` of a running job back in the queue without counting
+        it. Returns whether that attempt was running.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = attempts - 1, started_at = NULL "
+                "WHERE id = ? AND status = 'running' AND attempts = ?", (job_id, attempt)).rowcount > 0
+
+    def prune(self, before: float) -> int:
+        """
+        Deletes jobs finished before ``before``. Returns how many.
+        """
+        with self._lock:
+            return self._conn.execute("DELETE FROM jobs WHERE finished_at < ?", (before,)).rowcount
+
+
+JobHandler = Callable[[Job], Awaitable[dict]]
+
+
+class JobRunner:
+    """
+    Renders queued jobs with ``workers`` tasks on the running event loop and
+    lets requests wait for jobs to finish. Workers wait for new jobs for up
+    to ``poll_interval`` seconds, or until a job is submitted in this process
+    (``notify``); finished jobs are deleted after ``retention`` seconds.
+    """
+
+    def __init__(self, queue: JobQueue, workers: int = QR_JOB_WORKERS, poll_interval: float = QR_JOB_POLL_INTERVAL,
+                 retention: float = QR_JOB_RETENTION):
+        if workers < 0 or poll_interval <= 0 or retention < 0:
+            raise ValueError("Job workers and retention must not be negative, poll interval must be positive.")
+        self.queue = queue
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._tasks: List[asyncio.Task] = []
+        self._submitted: Optional[asyncio.Event] = None
+        self._finished: Optional[asyncio.Event] = None
+        self._pruned = 0.0
+
+    def start(self, handler: JobHandler):
+        """
+        Starts the workers on the running event loop, unless disabled (0 workers).
+        """
+        if self.workers and not self._tasks:
+            self._submitted, self._finished = asyncio.Event(), asyncio.Event()
+            loop = asyncio.get_running_loop()
+            self._tasks = [loop.create_task(self._work(handler)) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Stops the workers. Jobs they were rendering go back to the queue.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._submitted = self._finished = None
+
+    def notify(self):
+        """
+        Wakes the idle workers of this process, after a job was submitted.
+        """
+        if self._submitted is not None:
+            self._submitted.set()
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """
+        Returns the job once finished, or as it is after ``timeout`` seconds
+        (None if it does not exist). Jobs finished by this process are seen at
+        once, those of other processes within ``poll_interval`` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            finished = self._finished
+            job = await run_in_threadpool(self.queue.get, job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job.finished or remaining <= 0:
+                return job
+            try:
+                if finished is None:
+                    await asyncio.sleep(min(self.poll_interval, remaining))
+                else:
+                    await asyncio.wait_for(finished.wait(), min(self.poll_interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self, handler: JobHandler):
+        while True:
+            self._submitted.clear()
+            try:
+                job = await run_in_threadpool(self.queue.take)
+            except Exception:
+                logging.exception("Error taking a render job")
+                job = None
+            if job is None:
+                await self._idle()
+                continue
+            retry_after = await self._run(handler, job)
+            if retry_after:
+                await asyncio.sleep(retry_after)
+
+    async def _idle(self):
+        now = time.time()
+        if self.retention and now - self._pruned > _PRUNE_INTERVAL:
+            self._pruned = now
+            try:
+                pruned = await run_in_threadpool(self.queue.prune, now - self.retention)
+                if pruned:
+                    logging.info("Deleted %s finished render jobs", pruned)
+            except Exception:
+                logging.exception("Error deleting finished render jobs")
+        try:
+            await asyncio.wait_for(self._submitted.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self, handler: JobHandler, job: Job) -> float:
+        """
+        Runs one job and records its outcome. Returns the seconds to wait
+        before taking another job.
+        """
+        logging.info("Rendering job %s (priority %s, attempt %s)", job.id, job.priority, job.attempts)
+        result = error = None
+        try:
+            result = await handler(job)
+        except asyncio.CancelledError:
+            # Shielded so that the job goes back to the queue even if the worker is cancelled again.
+            await asyncio.shield(run_in_threadpool(self.queue.release, job.id, job.attempts))
+            raise
+        except JobDeferred as e:
+            await run_in_threadpool(self.queue.release, job.id, job.attempts)
+            return e.retry_after
+        except JobFailed as e:
+            result, error = e.result, str(e)
+        except Exception as e:
+            logging.exception("Error rendering job %s", job.id)
+            error = f"Error generating QR code: {e}"
+        try:
+            await run_in_threadpool(self.queue.finish, job.id, job.attempts, result, error)
+        except Exception:
+            logging.exception("Error recording the outcome of job %s", job.id)
+        finished, self._finished = self._finished, asyncio.Event()
+        finished.set()
+        return 0
+
+
+_runner: Optional[JobRunner] = None
+_jobs_lock = threading.Lock()
+
+
+def get_job_runner() -> JobRunner:
+    """
+    Returns the process-wide job runner, over the queue at QR_JOB_PATH. Its
+    workers are started by the application lifespan. Usable as a FastAPI dependency.
+    """
+    global _runner
+    with _jobs_lock:
+        if _runner is None:
+            _runner = JobRunner(JobQueue(QR_JOB_PATH))
+        return _runner
@@ -0,0 +1,270 @@
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+import qrcode
+from qrcode import exceptions, util
+from qrcode.main import precomputed_qr_blanks
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; QRCode's pure-Python mask search is used instead.
+    np = None
+
+# Penalty patterns for rule 3 (1:1:3:1:1 finder-like runs next to 4 light modules).
+_FINDER_PATTERNS = (
+    (1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0),
+    (0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1),
+)
+
+# Per-version arrays: modules open for data, and the eight mask patterns.
+_layouts: Dict[int, Tuple["np.ndarray", "np.ndarray"]] = {}
+
+# Per-version data placement: module coordinates in the order map_data fills
+# them, and each mask pattern over those modules as an integer, first module
+# in the most significant bit.
+_placements: Dict[int, Tuple[List[Tuple[int, int]], Tuple[int, ...]]] = {}
+
+# Module matrices before data placement, by (version, error correction, mask
+# pattern); mask pattern None is the test layout with light format areas.
+_templates: Dict[Tuple[int, int, Optional[int]], List[List[Optional[bool]]]] = {}
+
+# Bits taken by the characters of a segment, by mode (see qrcode.util.QRData.write).
+_SEGMENT_BITS = {
+    util.MODE_NUMBER: lambda length: length // 3 * 10 + (0, 4, 7)[length % 3],
+    util.MODE_ALPHA_NUM: lambda length: length // 2 * 11 + length % 2 * 6,
+    util.MODE_8BIT_BYTE: lambda length: length * 8,
+}
+
+
+def numpy_available() -> bool:
+    """
+    Returns whether the vectorized mask search can be used.
+    """
+    return np is not None
+
+
+def _mask_patterns(modules_count: int) -> "np.ndarray":
+    # Same formulas as qrcode.util.mask_func, evaluated over the whole grid.
+    i, j = np.indices((modules_count, modules_count))
+    return np.stack([
+        (i + j) % 2 == 0,
+        i % 2 == 0,
+        j % 3 == 0,
+        (i + j) % 3 == 0,
+        (i // 2 + j // 3) % 2 == 0,
+        (i * j) % 2 + (i * j) % 3 == 0,
+        ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+        ((i * j) % 3 + (i + j) % 2) % 2 == 0,
+    ])
+
+
+def _run_penalty(lines: "np.ndarray", groups: int) -> "np.ndarray":
+    """
+    Rule 1: every run of 5 or more same-colored modules in a line costs
+    (length - 2). ``lines`` holds the lines of ``groups`` matrices back to back.
+    """
+    count, length = lines.shape
+    boundaries = np.ones((count, length + 1), dtype=bool)
+    np.not_equal(lines[:, 1:], lines[:, :-1], out=boundaries[:, 1:length])
+    starts = np.flatnonzero(boundaries)
+    runs = np.diff(starts)
+    long_runs = runs >= 5
+    group = starts[:-1][long_runs] // (length + 1) // (count // groups)
+    return np.bincount(group, weights=runs[long_runs] - 2, minlength=groups).astype(np.int64)
+
+
+def _finder_penalty(matrices: "np.ndarray", axis: int) -> "np.ndarray":
+    """
+    Rule 3: 40 points for every finder-like pattern along rows (axis 2) or
+    columns (axis 1).
+    """
+    windows = matrices.shape[axis] - 10
+    total = 0
+    for pattern in _FINDER_PATTERNS:
+        found = None
+        for offset, dark in enumerate(pattern):
+            cells = matrices[:, :, offset:offset + windows] if axis == 2 else matrices[:, offset:offset + windows, :]
+            matched = cells if dark else ~cells
+            found = matched if found is None else found & matched
+        total = total + found.sum(axis=(1, 2))
+    return total * 40
+
+
+def lost_points(matrices: "np.ndarray") -> "np.ndarray":
+    """
+    Scores a stack of boolean module matrices with the four penalty rules of
+    ``qrcode.util.lost_point`` and returns one score per matrix.
+    """
+    groups, modules_count, _ = matrices.shape
+
+    points = _run_penalty(matrices.reshape(-1, modules_count), groups)
+    points += _run_penalty(matrices.transpose(0, 2, 1).reshape(-1, modules_count), groups)
+
+    top_left = matrices[:, :-1, :-1]
+    blocks = (top_left == matrices[:, 1:, :-1]) & (top_left == matrices[:, :-1, 1:]) & (top_left == matrices[:, 1:, 1:])
+    points += blocks.sum(axis=(1, 2)) * 3
+
+    points += _finder_penalty(matrices, axis=2) + _finder_penalty(matrices, axis=1)
+
+    # Dark ratio, computed with the same float arithmetic as qrcode.
+    for index, dark_count in enumerate(matrices.sum(axis=(1, 2)).tolist()):
+        percent = float(dark_count) / (modules_count ** 2)
+        points[index] += int(abs(percent * 100 - 50) / 5) * 10
+    return points
+
+
+@lru_cache(maxsize=4096)
+def fit_version(error_correction: int, segments: Tuple[Tuple[int, int], ...], start: int = 1) -> int:
+    """
+    Smallest version from ``start`` up holding data segments of the given
+    (mode, length) pairs, as found by ``QRCode.best_fit``. The answer depends
+    only on the segment modes and lengths, so it is memoized on them.
+
+    Raises:
+    - DataOverflowError: If the data does not fit in version 40.
+    """
+    util.check_version(start)
+    version = start
+    while True:
+        mode_sizes = util.mode_sizes_for_version(version)
+        needed_bits = sum(4 + mode_sizes[mode] + _SEGMENT_BITS[mode](length) for mode, length in segments)
+        version = bisect_left(util.BIT_LIMIT_TABLE[error_correction], needed_bits, version)
+        if version == 41:
+            raise exceptions.DataOverflowError()
+        # A larger version may widen the length fields; try again from there.
+        if util.mode_sizes_for_version(version) is mode_sizes:
+            return version
+
+
+def _blank(version: int) -> List[List[Optional[bool]]]:
+    blank = precomputed_qr_blanks.get(version)
+    if blank is None:
+        qr = qrcode.QRCode(version=version)
+        qr.modules_count = version * 4 + 17
+        qr.modules = [[None] * qr.modules_count for _ in range(qr.modules_count)]
+        qr.setup_position_probe_pattern(0, 0)
+        qr.setup_position_probe_pattern(qr.modules_count - 7, 0)
+        qr.setup_position_probe_pattern(0, qr.modules_count - 7)
+        qr.setup_position_adjust_pattern()
+        qr.setup_timing_pattern()
+        blank = precomputed_qr_blanks[version] = qr.modules
+    return blank
+
+
+def template(version: int, error_correction: int, mask_pattern: Optional[int]) -> List[List[Optional[bool]]]:
+    """
+    Module matrix with the function patterns, format and version information
+    in place and None where data goes, as ``makeImpl`` lays it out before
+    calling ``map_data``. Built once per (version, error correction, mask
+    pattern) and shared, so callers must copy it before filling in data.
+    """
+    key = (version, error_correction, mask_pattern)
+    modules = _templates.get(key)
+    if modules is None:
+        qr = qrcode.QRCode(version=version, error_correction=error_correction)
+        qr.modules_count = version * 4 + 17
+        qr.modules = [row[:] for row in _blank(version)]
+        test = mask_pattern is None
+        qr.setup_type_info(test, mask_pattern or 0)
+        if version >= 7:
+            qr.setup_type_number(test)
+        modules = _templates[key] = qr.modules
+    return modules
+
+
+def placement(version: int) -> Tuple[List[Tuple[int, int]], Tuple[int, ...]]:
+    """
+    Coordinates of the data modules in the zigzag order ``map_data`` fills
+    them, and the eight mask patterns as integers over that sequence.
+    """
+    layout = _placements.get(version)
+    if layout is None:
+        modules = template(version, qrcode.constants.ERROR_CORRECT_M, None)
+        modules_count = len(modules)
+        order = []
+        # Two-module wide columns from the right, alternately upward and downward,
+        # skipping the vertical timing pattern.
+        rows = range(modules_count - 1, -1, -1)
+        for col in range(modules_count - 1, 0, -2):
+            if col <= 6:
+                col -= 1
+            for row in rows:
+                order += [(row, c) for c in (col, col - 1) if modules[row][c] is None]
+            rows = rows[::-1]
+        masks = []
+        for mask_pattern in range(8):
+            mask = util.mask_func(mask_pattern)
+            masks.append(int("".join("1" if mask(row, col) else "0" for row, col in order), 2))
+        layout = _placements[version] = (order, tuple(masks))
+    return layout
+
+
+def prepare(error_correction: int, versions: Sequence[int]):
+    """
+    Builds the templates and data placement of ``versions`` ahead of time, for
+    worker start-up, instead of on the first render of each version.
+    """
+    for version in versions:
+        placement(version)
+        for mask_pattern in (None, *range(8)):
+            template(version, error_correction, mask_pattern)
+
+
+class FastMaskQRCode(qrcode.QRCode):
+    """
+    ``qrcode.QRCode`` rendering from precomputed plans: the version comes from
+    the memoized ``fit_version`` and ``makeImpl`` fills a copy of the cached
+    template along the cached placement order, so only the data encoding and
+    Reed-Solomon codewords are computed per code.
+
+    The mask search builds the module matrix once and applies and scores all
+    eight masks as NumPy array operations, instead of calling ``makeImpl`` and
+    ``util.lost_point`` eight times. Picks the same mask as ``qrcode``; falls
+    back to its search when NumPy is not installed.
+    """
+
+    def best_fit(self, start=None):
+        segments = tuple((data.mode, len(data)) for data in self.data_list)
+        self.version = fit_version(self.error_correction, segments, 1 if start is None else start)
+        return self.version
+
+    # Mask pattern of the final matrix, once made.
+    applied_mask_pattern: Optional[int] = None
+
+    def makeImpl(self, test, mask_pattern):
+        if not test:
+            self.applied_mask_pattern = mask_pattern
+        self.modules_count = self.version * 4 + 17
+        self.modules = [row[:] for row in template(self.version, self.error_correction, None if test else mask_pattern)]
+        if self.data_cache is None:
+            self.data_cache = util.create_data(self.version, self.error_correction, self.data_list)
+
+        order, masks = placement(self.version)
+        # Data bits in placement order; modules past the last codeword stay light.
+        bits = int.from_bytes(bytes(self.data_cache), "big") << (len(order) - len(self.data_cache) * 8)
+        modules = self.modules
+        for (row, col), bit in zip(order, format(bits ^ masks[mask_pattern], f"0{len(order)}b")):
+            modules[row][col] = bit == "1"
+
+    def best_mask_pattern(self):
+        if np is None:
+            return super().best_mask_pattern()
+
+        # Test layout with mask 0: format and version areas are all light.
+        self.makeImpl(True, 0)
+        matrix = np.array(self.modules, dtype=bool)
+        data_modules, masks = self._layout()
+
+        unmasked = matrix ^ (masks[0] & data_modules)
+        candidates = unmasked[np.newaxis] ^ (masks & data_modules)
+        return int(np.argmin(lost_points(candidates)))
+
+    def _layout(self) -> Tuple["np.ndarray", "np.ndarray"]:
+        layout = _layouts.get(self.version)
+        if layout is None:
+            # Modules left open by the function patterns and the format/version
+            # areas, which is where makeImpl places (and masks) data bits.
+            modules = template(self.version, self.error_correction, None)
+            data_modules = np.array([[module is None for module in row] for row in modules])
+            layout = _layouts[self.version] = (data_modules, _mask_patterns(self.modules_count))
+        return layout
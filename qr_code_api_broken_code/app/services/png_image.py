@@ -0,0 +1,94 @@
+import struct
+import zlib
+from typing import Iterator, List, Optional
+import qrcode.image.base
+from app.config import PNG_COMPRESSION_LEVEL
+from app.utils.colors import parse_color
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# IHDR color type 3 is an indexed (palette) image.
+_COLOR_TYPE_PALETTE = 3
+
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """
+    Frames ``data`` as a PNG chunk: length, type, payload and CRC-32.
+    """
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+class PackedPNGImage(qrcode.image.base.BaseImage):
+    """
+    Pure-Python PNG image builder writing a 1-bit, two-entry palette image.
+
+    Each module row is packed into a single scanline once and that bytes object
+    is reused for all ``box_size`` pixel rows it covers, instead of building a
+    Python list per pixel row like ``qrcode.image.pure.PyPNGImage``.
+    Palette index 0 is the background color and index 1 the fill color.
+    """
+
+    kind = "PNG"
+    allowed_kinds = ("PNG",)
+    needs_drawrect = False
+
+    def new_image(self, fill_color="black", back_color="white", compress_level: Optional[int] = None, **kwargs):
+        self.fill_color = parse_color(fill_color)
+        self.back_color = parse_color(back_color)
+        self.compress_level = PNG_COMPRESSION_LEVEL if compress_level is None else compress_level
+        return self
+
+    def drawrect(self, row, col):
+        """
+        Not used.
+        """
+
+    def save(self, stream, kind=None):
+        self.check_kind(kind)
+        if isinstance(stream, str):
+            with open(stream, "wb") as f:
+                self._write(f)
+        else:
+            self._write(stream)
+
+    def _write(self, stream):
+        for chunk in self.iter_chunks():
+            stream.write(chunk)
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """
+        Yields the encoded PNG file piece by piece.
+        """
+        yield PNG_SIGNATURE
+        yield png_chunk(b"IHDR", struct.pack(">IIBBBBB", self.pixel_size, self.pixel_size, 1, _COLOR_TYPE_PALETTE, 0, 0, 0))
+        yield png_chunk(b"PLTE", bytes(self.back_color) + bytes(self.fill_color))
+
+        compressor = zlib.compressobj(self.compress_level)
+        idat = [compressor.compress(block) for block in self.scanline_blocks()]
+        idat.append(compressor.flush())
+        yield png_chunk(b"IDAT", b"".join(idat))
+        yield png_chunk(b"IEND", b"")
+
+    def scanline_blocks(self) -> Iterator[bytes]:
+        """
+        Yields the filtered scanlines of the image (filter type 0 prefix byte
+        plus packed pixels), one block per module row including the border.
+        """
+        row_bytes = (self.pixel_size + 7) // 8
+        border_block = (b"\x00" + bytes(row_bytes)) * (self.border * self.box_size)
+
+        yield border_block
+        for module_row in self.modules:
+            yield (b"\x00" + self.pack_row(module_row)) * self.box_size
+        yield border_block
+
+    def pack_row(self, module_row: List[bool]) -> bytes:
+        """
+        Packs one row of modules into a 1-bit scanline, most significant bit first.
+        """
+        # One character per module (chr(0) or chr(1)), widened to box_size bits each.
+        widen = {0: "0" * self.box_size, 1: "1" * self.box_size}
+        border = "0" * (self.border * self.box_size)
+        bits = border + bytes(module_row).decode("latin-1").translate(widen) + border
+        bits += "0" * (-len(bits) % 8)
+        return int(bits, 2).to_bytes(len(bits) // 8, "big")
@@ -0,0 +1,140 @@
+import base64
+import json
+import struct
+from typing import List, NamedTuple, Optional
+from qrcode.image.svg import SvgPathImage
+
+# Output formats by file extension, with the media type each is served as.
+MEDIA_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+    "bin": "application/vnd.qrcode.matrix",
+    "json": "application/vnd.qrcode.matrix+json",
+}
+
+# Formats describing the module matrix rather than an image.
+MATRIX_FORMATS = {"bin", "json"}
+
+# Generic media types also accepted for a format, after the specific ones.
+_MEDIA_TYPE_ALIASES = {
+    "image/*": "png",
+    "application/octet-stream": "bin",
+    "application/json": "json",
+}
+
+MATRIX_MAGIC = b"QRMX"
+MATRIX_FORMAT_REVISION = 2
+# magic, format revision, QR version, border, error correction level, mask pattern, modules per side
+_MATRIX_HEADER = struct.Struct(">4sBBBcBH")
+
+
+class ColoredSvgPathImage(SvgPathImage):
+    """
+    ``SvgPathImage`` (all dark modules in a single ``<path>``) with
+    configurable fill and background colors.
+    """
+
+    def new_image(self, fill_color="black", back_color="white", **kwargs):
+        self.background = back_color
+        self.QR_PATH_STYLE = {**SvgPathImage.QR_PATH_STYLE, "fill": fill_color}
+        return super().new_image(**kwargs)
+
+
+class Matrix(NamedTuple):
+    version: int
+    border: int
+    error_correction: str
+    mask_pattern: int
+    modules: List[List[bool]]
+
+
+def pack_matrix(modules: List[List[bool]], version: int, border: int, error_correction: str,
+                mask_pattern: int) -> bytes:
+    """
+    Encodes a module matrix (without its quiet zone) as a small header followed
+    by one bit per module, each row padded to a whole byte, most significant
+    bit first. This is also the form QR codes are stored in: every image
+    variant can be drawn from it without encoding the data again.
+
+    Parameters:
+    - modules (List[List[bool]]): Square module matrix, True for dark modules.
+    - version (int): QR version (1-40).
+    - border (int): Width of the quiet zone, in modules, to draw around the matrix.
+    - error_correction (str): Error correction level, one of L, M, Q or H.
+    - mask_pattern (int): Mask pattern (0-7) applied to the data modules.
+    """
+    rows = []
+    for row in modules:
+        bits = "".join("1" if module else "0" for module in row)
+        bits += "0" * (-len(bits) % 8)
+        rows.append(int(bits, 2).to_bytes(len(bits) // 8, "big"))
+    header = _MATRIX_HEADER.pack(MATRIX_MAGIC, MATRIX_FORMAT_REVISION, version, border,
+                                 error_correction.encode("ascii"), mask_pattern, len(modules))
+    return header + b"".join(rows)
+
+
+def unpack_matrix(data: bytes) -> Matrix:
+    """
+    Decodes the output of ``pack_matrix``.
+
+    Raises:
+    - ValueError: If the data is not a packed matrix.
+    """
+    if len(data) < _MATRIX_HEADER.size:
+        raise ValueError("Packed matrix is truncated.")
+    magic, revision, version, border, error_correction, mask_pattern, count = _MATRIX_HEADER.unpack_from(data)
+    row_bytes = (count + 7) // 8
+    if magic != MATRIX_MAGIC or revision != MATRIX_FORMAT_REVISION:
+        raise ValueError("Not a packed QR code matrix.")
+    if len(data) != _MATRIX_HEADER.size + count * row_bytes:
+        raise ValueError("Packed matrix is truncated.")
+    modules = []
+    for offset in range(_MATRIX_HEADER.size, len(data), row_bytes):
+        bits = bin(int.from_bytes(data[offset:offset + row_bytes], "big"))[2:].zfill(row_bytes * 8)
+        modules.append([bit == "1" for bit in bits[:count]])
+    return Matrix(version, border, error_correction.decode("ascii"), mask_pattern, modules)
+
+
+def matrix_json(packed: bytes) -> bytes:
+    """
+    Wraps a packed matrix in JSON: its metadata plus the packed rows in base64.
+    """
+    _, _, version, border, error_correction, mask_pattern, count = _MATRIX_HEADER.unpack_from(packed)
+    return json.dumps({
+        "version": version,
+        "border": border,
+        "error_correction": error_correction.decode("ascii"),
+        "mask_pattern": mask_pattern,
+        "modules": count,
+        "row_bytes": (count + 7) // 8,
+        "data": base64.b64encode(packed[_MATRIX_HEADER.size:]).decode("ascii"),
+    }, separators=(",", ":")).encode("utf-8")
+
+
+def negotiate_format(accept: Optional[str], default: str = "png") -> Optional[str]:
+    """
+    Picks the output format best matching an Accept header, preferring higher
+    quality values and then earlier entries. Returns ``default`` for
+    a missing header or ``*/*``, and None if no format is acceptable.
+    """
+    if not accept:
+        return default
+    by_media_type = {media_type: name for name, media_type in MEDIA_TYPES.items()}
+    best, best_quality = None, 0.0
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.lower()
+        name = by_media_type.get(media_type) or _MEDIA_TYPE_ALIASES.get(media_type)
+        if name is None and media_type == "*/*":
+            name = default
+        if name is not None and quality > best_quality:
+            best, best_quality = name, quality
+    return best
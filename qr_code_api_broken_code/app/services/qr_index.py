@@ -0,0 +1,354 @@
+import argparse
+import base64
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from app.config import QR_DIRECTORY, QR_INDEX_PATH
+from app.services.storage import FileSystemStorage, Storage, get_storage, stored_url
+from app.utils.common import STORED_SUFFIXES
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS qr_codes (
+    filename TEXT PRIMARY KEY,
+    url TEXT,
+    size INTEGER,
+    created_at REAL NOT NULL,
+    expires_at REAL,
+    version TEXT,
+    stored_files INTEGER,
+    stored_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS qr_codes_created ON qr_codes (created_at, filename);
+CREATE INDEX IF NOT EXISTS qr_codes_url ON qr_codes (url);
+"""
+
+# Columns added after the first release, added to older indexes on open.
+# Entries indexed before storage usage was recorded count for nothing in
+# ``usage`` until the index is rebuilt.
+_ADDED_COLUMNS = {"expires_at": "REAL", "version": "TEXT", "stored_files": "INTEGER", "stored_bytes": "INTEGER"}
+
+# Created separately: indexes from before expiry need the column added first.
+_EXPIRY_INDEX = "CREATE INDEX IF NOT EXISTS qr_codes_expires ON qr_codes (expires_at) WHERE expires_at IS NOT NULL"
+
+
+class IndexEntry(NamedTuple):
+    filename: str
+    url: Optional[str]
+    size: Optional[int]
+    created_at: float
+    # Content hash of the stored PNG image, if one is stored.
+    version: Optional[str] = None
+
+
+def encode_cursor(entry: IndexEntry) -> str:
+    """
+    Returns an opaque cursor pointing just after ``entry``.
+    """
+    return base64.urlsafe_b64encode(json.dumps([entry.created_at, entry.filename]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        created_at, filename = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(created_at), str(filename)
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    # Smallest string greater than every string starting with ``prefix``.
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class QRIndex:
+    """
+    SQLite index of stored QR codes (filename, original URL, size, creation
+    and expiry time, image version, storage usage), kept in sync by the create
+    and delete paths so that listing, expiry and metrics never have to scan
+    the QR code directory.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(qr_codes)")}
+        for column, column_type in _ADDED_COLUMNS.items():
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE qr_codes ADD COLUMN {column} {column_type}")
+        self._conn.execute(_EXPIRY_INDEX)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, filename: str, url: Optional[str], size: Optional[int], created_at: Optional[float] = None,
+            expires_at: Optional[float] = None, version: Optional[str] = None, stored_files: Optional[int] = None,
+            stored_bytes: Optional[int] = None):
+        """
+        Records a stored QR code, replacing any previous entry with that
+        filename. ``stored_files`` and ``stored_bytes`` are the number and
+        total size of the matrix and image stored for it.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO qr_codes "
+                "(filename, url, size, created_at, expires_at, version, stored_files, stored_bytes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (filename, url, size, time.time() if created_at is None else created_at, expires_at, version,
+                 stored_files, stored_bytes),
+            )
+
+    def get(self, filename: str) -> Optional[IndexEntry]:
+        """
+        Returns the entry of a stored QR code, or None if it is not indexed or has expired.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT filename, url, size, created_at, version FROM qr_codes "
+                "WHERE filename = ? AND (expires_at IS NULL OR expires_at > ?)", (filename, time.time())).fetchone()
+        return IndexEntry(*row) if row else None
+
+    def is_expired(self, filename: str, now: Optional[float] = None) -> bool:
+        """
+        Returns whether a QR code is indexed with an expiry time that has passed,
+        that is, whether it is awaiting the sweeper.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM qr_codes WHERE filename = ? AND expires_at <= ?",
+                                     (filename, time.time() if now is None else now)).fetchone()
+        return row is not None
+
+    def remove(self, filename: str) -> bool:
+        """
+        Removes a QR code from the index. Returns whether it was indexed.
+        """
+        with self._lock:
+            return self._conn.execute("DELETE FROM qr_codes WHERE filename = ?", (filename,)).rowcount > 0
+
+    def remove_many(self, filenames: List[str]) -> int:
+        """
+        Removes QR codes from the index in one transaction. Returns how many were indexed.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                removed = self._conn.executemany(
+                    "DELETE FROM qr_codes WHERE filename = ?", [(filename,) for filename in filenames]).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return removed
+
+    def expired(self, limit: int, now: Optional[float] = None) -> List[str]:
+        """
+        Returns the filenames of up to ``limit`` QR codes expired by ``now``
+        (default: the current time), earliest expiry first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename FROM qr_codes WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                (time.time() if now is None else now, limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def rename(self, filename: str, new_filename: str) -> bool:
+        """
+        Changes the filename of an indexed QR code, keeping its other fields.
+        Returns whether it was indexed.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE qr_codes SET filename = ? WHERE filename = ?", (new_filename, filename)).rowcount > 0
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM qr_codes").fetchone()[0]
+
+    def usage(self) -> Tuple[int, int]:
+        """
+        Returns the number and total size of the stored matrices and images,
+        as recorded by ``add``, without touching storage.
+        """
+        with self._lock:
+            files, size = self._conn.execute(
+                "SELECT TOTAL(stored_files), TOTAL(stored_bytes) FROM qr_codes").fetchone()
+        return int(files), int(size)
+
+    def page(self, limit: int, cursor: Optional[str] = None, descending: bool = False,
+             prefix: Optional[str] = None, until: Optional[str] = None) -> Tuple[List[IndexEntry], Optional[str]]:
+        """
+        Returns up to ``limit`` entries ordered by creation time, and the cursor
+        for the next page (None on the last page). Expired entries are left out
+        even before the sweeper has deleted them.
+
+        Parameters:
+        - limit (int): Maximum number of entries to return.
+        - cursor (str): Cursor returned with the previous page.
+        - descending (bool): Newest first instead of oldest first.
+        - prefix (str): Only include QR codes whose original URL starts with it.
+        - until (str): Only include entries up to and including the one this
+          cursor points just after.
+
+        Raises:
+        - ValueError: If a cursor is invalid.
+        """
+        where, params, direction = self._filter(cursor, descending, prefix, until)
+        query = (f"SELECT filename, url, size, created_at, version FROM qr_codes {where} "
+                 f"ORDER BY created_at {direction}, filename {direction} LIMIT ?")
+        with self._lock:
+            rows = self._conn.execute(query, (*params, limit + 1)).fetchall()
+        entries = [IndexEntry(*row) for row in rows[:limit]]
+        next_cursor = encode_cursor(entries[-1]) if len(rows) > limit else None
+        return entries, next_cursor
+
+    def next_cursor(self, limit: int, cursor: Optional[str] = None, descending: bool = False,
+                    prefix: Optional[str] = None) -> Optional[str]:
+        """
+        Returns the cursor ``page`` would return with the same arguments, by
+        walking the creation time index only, without loading the entries.
+
+        Raises:
+        - ValueError: If the cursor is invalid.
+        """
+        where, params, direction = self._filter(cursor, descending, prefix)
+        query = (f"SELECT created_at, filename FROM qr_codes {where} "
+                 f"ORDER BY created_at {direction}, filename {direction} LIMIT 2 OFFSET ?")
+        with self._lock:
+            rows = self._conn.execute(query, (*params, limit - 1)).fetchall()
+        if len(rows) < 2:
+            return None
+        created_at, filename = rows[0]
+        return encode_cursor(IndexEntry(filename, None, None, created_at))
+
+    def iter_pages(self, limit: int, cursor: Optional[str] = None, descending: bool = False,
+                   prefix: Optional[str] = None, page_size: int = 500,
+                   until: Optional[str] = None) -> Iterator[List[IndexEntry]]:
+        """
+        Yields the entries ``page(limit, ...)`` would return, ``page_size`` at
+        a time, so that large pages never have to be held in memory at once.
+        With ``until`` (the cursor ``next_cursor`` returned for the page), it
+        yields every entry up to that cursor instead, however many: a page
+        read while entries are added or removed then ends exactly where the
+        next one starts.
+        """
+        while until is not None or limit > 0:
+            entries, cursor = self.page(page_size if until else min(limit, page_size), cursor, descending, prefix,
+                                        until)
+            if entries:
+                yield entries
+            if cursor is None:
+                return
+            limit -= len(entries)
+
+    @staticmethod
+    def _filter(cursor: Optional[str], descending: bool, prefix: Optional[str],
+                until: Optional[str] = None) -> Tuple[str, list, str]:
+        clauses, params = ["(expires_at IS NULL OR expires_at > ?)"], [time.time()]
+        if cursor:
+            created_at, filename = decode_cursor(cursor)
+            op = "<" if descending else ">"
+            clauses.append(f"(created_at {op} ? OR (created_at = ? AND filename {op} ?))")
+            params += [created_at, created_at, filename]
+        if until:
+            created_at, filename = decode_cursor(until)
+            op = ">" if descending else "<"
+            clauses.append(f"(created_at {op} ? OR (created_at = ? AND filename {op}= ?))")
+            params += [created_at, created_at, filename]
+        if prefix:
+            clauses.append("url >= ? AND url < ?")
+            params += [prefix, _prefix_upper_bound(prefix)]
+        where = f"WHERE {' AND '.join(clauses)}"
+        return where, params, "DESC" if descending else "ASC"
+
+    def rebuild(self, storage: Storage) -> int:
+        """
+        Replaces the index contents with the QR codes found in storage, whether
+        stored as a packed matrix, a PNG image or both. Creation times come
+        from modification times and storage usage from the stored objects;
+        sizes are unknown. Expiry times and image
+        versions are not stored with the QR codes, so those already in the
+        index are kept.
+
+        Returns:
+        - Number of indexed QR codes.
+        """
+        found, usage = {}, {}
+        for stored in storage.iter_objects():
+            if not stored.key.endswith(STORED_SUFFIXES):
+                continue
+            qr_id = stored.key.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+            files, size = usage.get(qr_id, (0, 0))
+            usage[qr_id] = (files + 1, size + stored.size)
+            if qr_id in found:
+                continue
+            try:
+                url = stored_url(storage, qr_id)
+            except ValueError:
+                url = None
+            found[qr_id] = (f"{qr_id}.png", url, None, stored.modified)
+        with self._lock:
+            kept = {row[0]: row[1:] for row in self._conn.execute(
+                "SELECT filename, expires_at, version FROM qr_codes WHERE expires_at IS NOT NULL OR version IS NOT NULL")}
+            entries = [(*entry, *kept.get(entry[0], (None, None)), *usage[qr_id]) for qr_id, entry in found.items()]
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM qr_codes")
+                self._conn.executemany(
+                    "INSERT INTO qr_codes (filename, url, size, created_at, expires_at, version, stored_files, "
+                    "stored_bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        logging.info("Rebuilt QR code index with %s entries from %s", len(entries), type(storage).__name__)
+        return len(entries)
+
+
+_index: Optional[QRIndex] = None
+_index_lock = threading.Lock()
+
+
+def load_qr_index() -> QRIndex:
+    """
+    Returns the process-wide QR code index, creating it on first use. A newly
+    created index is filled from the QR code storage, so the first call may block.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            is_new = not QR_INDEX_PATH.exists()
+            _index = QRIndex(QR_INDEX_PATH)
+            if is_new:
+                _index.rebuild(get_storage())
+        return _index
+
+
+async def get_qr_index() -> QRIndex:
+    """
+    ``load_qr_index`` as a FastAPI dependency; a coroutine so that FastAPI does
+    not resolve it in the threadpool on every request. Only the first call,
+    which may rebuild the index, runs in the threadpool.
+    """
+    return _index if _index is not None else await run_in_threadpool(load_qr_index)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the QR code listing index from the QR code directory.")
+    parser.add_argument("--directory", type=Path, default=QR_DIRECTORY, help="QR code directory to scan.")
+    parser.add_argument("--index", type=Path, default=QR_INDEX_PATH, help="Index database to rebuild.")
+    args = parser.parse_args(argv)
+    count = QRIndex(args.index).rebuild(FileSystemStorage(args.directory))
+    print(f"Indexed {count} QR code(s) from {args.directory} into {args.index}")
+
+
+if __name__ == "__main__":
+    main()
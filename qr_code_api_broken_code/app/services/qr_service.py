@@ -1,76 +1,296 @@
-import os
-from typing import List
+import io
+import time
+from typing import List, Optional, Tuple
 import qrcode
 import logging
+from qrcode import util
 from pathlib import Path
-from app.config import SERVER_BASE_URL, SERVER_DOWNLOAD_FOLDER
+from starlette.concurrency import run_in_threadpool
+from app.config import SERVER_BASE_URL, SERVER_DOWNLOAD_FOLDER, QR_ERROR_CORRECTION
+from app.services.matrix_engine import FastMaskQRCode
+from app.services.png_image import PackedPNGImage
+from app.services.qr_formats import MATRIX_FORMATS, ColoredSvgPathImage, matrix_json, pack_matrix, unpack_matrix
+from app.services.render_cache import RenderCache, RenderKey, render_key
+from app.services.render_engine import RenderEngine
+from app.services.storage import Storage, qr_keys, url_key
+from app.utils.metrics import STAGE_SECONDS
 
-# Set up logging for the module
-logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
+ERROR_CORRECTION_LEVELS = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H,
+}
 
-def list_qr_codes(directory_path: Path) -> List[str]:
+def render_qr_code(data: str, fill_color: str = 'red', back_color: str = 'white', size: int = 10,
+                   error_correction: str = QR_ERROR_CORRECTION) -> bytes:
     """
-    Lists all QR code images in the specified directory by returning their filenames.
-    
-    Parameters:
-    - directory_path (Path): The filesystem path to the directory containing QR code images.
+    Renders a QR code for the provided data and returns the encoded PNG image.
 
-    Returns:
-    - List of filenames (str) for QR codes found in the directory.
-    """
-    try:
-        # List all files ending with '.png' in the specified directory.
-        qr_files = [f for f in os.listdir(directory_path) if f.endswith('.png')]
-        logging.info(f"Found {len(qr_files)} QR code(s) in {directory_path}")
-        return qr_files
-    except FileNotFoundError:
-        logging.error(f"Directory not found: {directory_path}")
-        raise
-    except OSError as e:
-        logging.error(f"An OS error occurred while listing QR codes in {directory_path}: {e}")
-        raise
+    This is a pure, CPU-bound function with picklable arguments, so it can run
+    inside a render engine worker process.
 
-def generate_qr_code(data: str, path: Path, fill_color: str = 'red', back_color: str = 'white', size: int = 10):
-    """
-    Generates a QR code based on the provided data and saves it to a specified file path.
-    
     Parameters:
     - data (str): The data to encode in the QR code.
-    - path (Path): The filesystem path where the QR code image will be saved.
     - fill_color (str): Color of the QR code.
     - back_color (str): Background color of the QR code.
     - size (int): The size of each box in the QR code grid.
+    - error_correction (str): Error correction level, one of L, M, Q or H.
+
+    Returns:
+    - The PNG image as bytes.
+    """
+    return render_qr_code_timed(data, fill_color, back_color, size, error_correction)[0]
+
+def render_qr_code_timed(data: str, fill_color: str = 'red', back_color: str = 'white', size: int = 10,
+                         error_correction: str = QR_ERROR_CORRECTION,
+                         output_format: str = "png") -> Tuple[bytes, float, float]:
+    """
+    Same as ``render_qr_code``, also returning the seconds spent building the
+    module matrix (including the mask pattern search) and encoding the output,
+    so that renders in worker processes can be reported by the main process.
+
+    ``output_format`` is one of the formats in ``qr_formats.MEDIA_TYPES``:
+    a PNG image, a single-path SVG, or the packed module matrix as binary or JSON.
+    """
+    start = time.perf_counter()
+    qr = FastMaskQRCode(
+        version=1,
+        error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+        box_size=size,
+        border=5,
+        image_factory=PackedPNGImage,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix_done = time.perf_counter()
+    if output_format in MATRIX_FORMATS:
+        output = pack_matrix(qr.modules, qr.version, qr.border, error_correction, qr.applied_mask_pattern)
+        if output_format == "json":
+            output = matrix_json(output)
+    else:
+        output = _encode_image(qr, output_format, fill_color, back_color)
+    return output, matrix_done - start, time.perf_counter() - matrix_done
+
+def _encode_image(qr: qrcode.QRCode, output_format: str, fill_color: str, back_color: str) -> bytes:
+    factory = ColoredSvgPathImage if output_format == "svg" else PackedPNGImage
+    img = qr.make_image(image_factory=factory, fill_color=fill_color, back_color=back_color)
+    buffer = io.BytesIO()
+    img.save(buffer)
+    return buffer.getvalue()
+
+def rasterize_matrix(packed: bytes, output_format: str = "png", size: int = 10, fill_color: str = 'red',
+                     back_color: str = 'white') -> Tuple[bytes, float]:
+    """
+    Draws a PNG or SVG image from a packed module matrix (see
+    ``qr_formats.pack_matrix``), skipping the data encoding and mask search.
+    The output is byte for byte what ``render_qr_code_timed`` produces for the
+    same URL and options. Like it, this can run in a render engine worker.
+
+    Returns:
+    - The encoded image and the seconds spent drawing it.
+    """
+    start = time.perf_counter()
+    matrix = unpack_matrix(packed)
+    qr = qrcode.QRCode(
+        version=matrix.version,
+        error_correction=ERROR_CORRECTION_LEVELS[matrix.error_correction],
+        box_size=size,
+        border=matrix.border,
+    )
+    qr.modules = matrix.modules
+    qr.modules_count = len(matrix.modules)
+    qr.data_cache = packed  # anything but None: the matrix is already made
+    return _encode_image(qr, output_format, fill_color, back_color), time.perf_counter() - start
+
+def warm_up_versions(error_correction: str = QR_ERROR_CORRECTION, versions: range = range(1, 41)) -> int:
+    """
+    Renders one QR code of each version, filling each version's render plan
+    and the library's lookup tables. Run before forking server workers, the
+    work is shared by all of them.
+
+    Returns:
+    - The number of codes rendered.
+    """
+    level = ERROR_CORRECTION_LEVELS[error_correction]
+    for version in versions:
+        # The largest byte-mode payload of this version: mode, length field, data.
+        length_bits = util.length_in_bits(util.MODE_8BIT_BYTE, version)
+        render_qr_code("x" * ((util.BIT_LIMIT_TABLE[level][version] - 4 - length_bits) // 8),
+                       size=1, error_correction=error_correction)
+    return len(versions)
+
+async def render_qr_code_cached(url: str, engine: RenderEngine, cache: RenderCache, fill_color: str = 'red',
+                                back_color: str = 'white', size: int = 10,
+                                error_correction: str = QR_ERROR_CORRECTION, output_format: str = "png") -> bytes:
+    """
+    Returns the rendered QR code from the render cache, rendering it on the
+    render engine on a miss. Concurrent requests for the same image share a
+    single render.
+
+    Parameters:
+    - url (str): The URL to encode; it is normalized before rendering.
+    - engine (RenderEngine): Engine that runs the render off the event loop.
+    - cache (RenderCache): Cache of rendered images.
+    - fill_color, back_color, size, error_correction, output_format: As for ``render_qr_code_timed``.
+
+    Returns:
+    - The encoded output (by default a PNG image) as bytes.
+    """
+    key = render_key(url, size, fill_color, back_color, error_correction, output_format)
+    return await render_key_cached(key, engine, cache)
+
+async def render_key_cached(key: RenderKey, engine: RenderEngine, cache: RenderCache,
+                            storage: Optional[Storage] = None, qr_filename: Optional[str] = None) -> bytes:
+    """
+    Same as ``render_qr_code_cached`` for an already built render key.
+
+    Images are drawn from the URL's packed module matrix, which is cached as
+    well, so that further sizes and colors skip the encoding. For a stored QR
+    code (``qr_filename`` in ``storage``) the matrix is read from storage
+    instead of encoded again when it is not in the cache.
     """
-    logging.debug("Starting QR code generation")
+    return await cache.get_or_render(key, lambda: _render_on_engine(key, engine, cache, storage, qr_filename))
+
+async def _render_on_engine(key: RenderKey, engine: RenderEngine, cache: RenderCache,
+                            storage: Optional[Storage] = None, qr_filename: Optional[str] = None) -> bytes:
+    if key.output_format == "bin":
+        packed = await _load_matrix(key, storage, qr_filename) if storage is not None else None
+        if packed is not None:
+            return packed
+        start = time.perf_counter()
+        packed, matrix_seconds, _ = await engine.run(
+            render_qr_code_timed,
+            data=key.url,
+            error_correction=key.error_correction,
+            output_format="bin",
+        )
+        STAGE_SECONDS.observe(matrix_seconds, "matrix")
+        # Queueing for a worker and moving arguments and results between processes.
+        STAGE_SECONDS.observe(max(time.perf_counter() - start - matrix_seconds, 0.0), "render_wait")
+        return packed
+
+    packed = await render_key_cached(key.matrix_key(), engine, cache, storage, qr_filename)
+    if key.output_format == "json":
+        return matrix_json(packed)
+    start = time.perf_counter()
+    image, encode_seconds = await engine.run(
+        rasterize_matrix, packed, key.output_format, key.size, key.fill_color, key.back_color)
+    STAGE_SECONDS.observe(encode_seconds, f"{key.output_format}_encode")
+    STAGE_SECONDS.observe(max(time.perf_counter() - start - encode_seconds, 0.0), "render_wait")
+    return image
+
+async def _load_matrix(key: RenderKey, storage: Storage, qr_filename: str) -> Optional[bytes]:
+    """
+    Reads a stored packed matrix off the event loop. Returns None when there
+    is none, or when it was made with other settings than ``key`` asks for.
+    """
+    with STAGE_SECONDS.time("filesystem"):
+        packed = await run_in_threadpool(load_matrix, storage, qr_filename)
     try:
-        qr = qrcode.QRCode(version=1, box_size=size, border=5)
-        qr.add_data(data)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color=fill_color, back_color=back_color)
-        img.save(str(path))
-        logging.info(f"QR code successfully saved to {path}")
-    except Exception as e:
-        logging.error(f"Failed to generate/save QR code at {path}: {e}")
-        raise
+        if packed is not None and unpack_matrix(packed).error_correction == key.error_correction:
+            return packed
+    except ValueError as e:
+        logging.error("Ignoring unreadable QR code matrix of %s: %s", qr_filename, e)
+    return None
 
-def delete_qr_code(file_path: Path):
+def load_matrix(storage: Storage, qr_filename: str) -> Optional[bytes]:
     """
-    Deletes the specified QR code image file.
-    
+    Returns the packed module matrix stored for a QR code, or None if there is none.
+    """
+    try:
+        return storage.get(qr_keys(qr_filename)[0])
+    except FileNotFoundError:
+        return None
+
+def store_qr_code(storage: Storage, qr_filename: str, matrix: bytes, url: Optional[str] = None,
+                  image: Optional[bytes] = None):
+    """
+    Stores a QR code: its packed matrix and, optionally, the original URL (for
+    IDs that cannot be decoded back to it) and a PNG image.
+
     Parameters:
-    - file_path (Path): The filesystem path of the QR code image to delete.
+    - storage (Storage): Where QR codes are stored.
+    - qr_filename (str): Filename of the QR code.
+    - matrix (bytes): The packed module matrix.
+    - url (str): Original URL to record in a sidecar.
+    - image (bytes): Encoded PNG image to store along with the matrix.
+
+    Raises:
+    - FileExistsError: If the QR code is already stored. Of concurrent stores
+      of the same QR code exactly one succeeds.
     """
+    matrix_key, image_key = qr_keys(qr_filename)
     try:
-        if file_path.is_file():
-            file_path.unlink()  # Delete the file
-            logging.info(f"QR code {file_path.name} deleted successfully")
-        else:
-            logging.error(f"QR code file not found: {file_path.name}")
-            raise FileNotFoundError(f"QR code file {file_path.name} not found.")
+        if url is not None:
+            # Same content for every store of this ID, so it may be replaced.
+            storage.put(url_key(qr_filename), url.encode("utf-8"), exclusive=False)
+        storage.put(matrix_key, matrix)
+        if image is not None:
+            storage.put(image_key, image, exclusive=False)
+        logging.info("QR code %s successfully stored", qr_filename)
+    except FileExistsError:
+        logging.info("QR code %s already exists", qr_filename)
+        raise
     except Exception as e:
-        logging.error(f"Error deleting QR code {file_path.name}: {e}")
+        logging.error("Failed to store QR code %s: %s", qr_filename, e)
         raise
 
+def qr_code_stored(storage: Storage, qr_filename: str) -> bool:
+    """
+    Returns whether a QR code is stored, as a packed matrix or an image.
+    """
+    return any(storage.exists(key) for key in qr_keys(qr_filename))
+
+def delete_stored_qr_code(storage: Storage, qr_filename: str):
+    """
+    Deletes a stored QR code: its packed matrix, PNG image and URL sidecar,
+    whichever of them exist.
+
+    Raises:
+    - FileNotFoundError: If the QR code is not stored.
+    """
+    deleted = [storage.delete(key) for key in qr_keys(qr_filename)]
+    if not any(deleted):
+        logging.error("QR code not found: %s", qr_filename)
+        raise FileNotFoundError(f"QR code {qr_filename} not found.")
+    storage.delete(url_key(qr_filename))
+    logging.info("QR code %s deleted successfully", qr_filename)
+
+def delete_qr_codes(storage: Storage, qr_filenames: List[str]) -> List[str]:
+    """
+    Deletes many stored QR codes, skipping those that are not stored.
+
+    Returns:
+    - Filenames of the QR codes that were not found.
+    """
+    not_found = []
+    for qr_filename in qr_filenames:
+        try:
+            delete_stored_qr_code(storage, qr_filename)
+        except FileNotFoundError:
+            not_found.append(qr_filename)
+    return not_found
+
+async def store_qr_code_async(storage: Storage, qr_filename: str, matrix: bytes, url: Optional[str] = None,
+                              image: Optional[bytes] = None):
+    """
+    ``store_qr_code`` run on a worker thread, off the event loop.
+    """
+    await run_in_threadpool(store_qr_code, storage, qr_filename, matrix, url, image)
+
+async def delete_stored_qr_code_async(storage: Storage, qr_filename: str):
+    """
+    ``delete_stored_qr_code`` run on a worker thread, off the event loop.
+    """
+    await run_in_threadpool(delete_stored_qr_code, storage, qr_filename)
+
+async def qr_code_stored_async(storage: Storage, qr_filename: str) -> bool:
+    """
+    ``qr_code_stored`` run on a worker thread, off the event loop.
+    """
+    return await run_in_threadpool(qr_code_stored, storage, qr_filename)
+
 def create_directory(directory_path: Path):
     """
     Creates a directory at the specified path if it doesn't already exist.
@@ -78,13 +298,13 @@ def create_directory(directory_path: Path):
     Parameters:
     - directory_path (Path): The filesystem path of the directory to create.
     """
-    logging.debug(f"Attempting to create directory: {directory_path}")
+    logging.debug("Attempting to create directory: %s", directory_path)
     try:
         directory_path.mkdir(parents=True, exist_ok=True)  # Create the directory and any parent directories
-        logging.info(f"Directory {directory_path} created or already exists.")
+        logging.info("Directory %s created or already exists.", directory_path)
     except PermissionError as e:
-        logging.error(f"Permission denied when trying to create directory {directory_path}: {e}")
+        logging.error("Permission denied when trying to create directory %s: %s", directory_path, e)
         raise
     except Exception as e:
-        logging.error(f"Unexpected error creating directory {directory_path}: {e}")
+        logging.error("Unexpected error creating directory %s: %s", directory_path, e)
         raise
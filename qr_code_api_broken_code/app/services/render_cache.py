@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+from app.config import RENDER_CACHE_MAX_BYTES
+from app.services.qr_formats import MATRIX_FORMATS
+from app.utils.colors import parse_color
+from app.utils.common import normalize_url
+
+# Bump whenever the renderer's output for a given key changes, so clients
+# holding images under old ETags fetch the new ones.
+RENDERER_VERSION = "2"
+
+
+class RenderKey(NamedTuple):
+    """
+    Everything that determines the rendered image, so equal keys mean equal bytes.
+    """
+    url: str
+    size: int
+    fill_color: str
+    back_color: str
+    error_correction: str
+    output_format: str = "png"
+
+    def matrix_key(self) -> "RenderKey":
+        """
+        Key of the packed module matrix the image for this key is drawn from.
+        """
+        return self._replace(size=1, fill_color="#000000", back_color="#ffffff", output_format="bin")
+
+    @property
+    def etag(self) -> str:
+        """
+        Strong entity tag for the image this key renders to.
+        """
+        digest = hashlib.sha256("\0".join([RENDERER_VERSION, *map(str, self)]).encode("utf-8"))
+        return f'"{digest.hexdigest()[:32]}"'
+
+
+def render_key(url, size: int, fill_color: str, back_color: str, error_correction: str,
+               output_format: str = "png") -> RenderKey:
+    """
+    Builds a cache key with the URL and colors in canonical form, so that for
+    example ``red`` and ``#FF0000`` share an entry. Module matrix formats do
+    not depend on size or colors, so those are dropped from their keys.
+    """
+    if output_format in MATRIX_FORMATS:
+        size, fill_color, back_color = 1, "black", "white"
+    return RenderKey(
+        url=normalize_url(url),
+        size=int(size),
+        fill_color="#%02x%02x%02x" % parse_color(fill_color),
+        back_color="#%02x%02x%02x" % parse_color(back_color),
+        error_correction=error_correction.upper(),
+        output_format=output_format,
+    )
+
+
+class RenderCache:
+    """
+    In-memory LRU cache of rendered images bounded by their total size in bytes.
+
+    ``get_or_render`` also coalesces concurrent misses for the same key, so N
+    identical requests arriving together trigger exactly one render.
+    """
+
+    def __init__(self, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self._entries: "OrderedDict[RenderKey, bytes]" = OrderedDict()
+        self._inflight: Dict[RenderKey, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: RenderKey) -> Optional[bytes]:
+        """
+        Returns the cached image for ``key`` and marks it most recently used.
+        """
+        image = self._entries.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def put(self, key: RenderKey, image: bytes):
+        """
+        Stores an image, evicting least recently used entries to stay within
+        ``max_bytes``. Images larger than the whole cache are not stored.
+        """
+        if len(image) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.current_bytes -= len(previous)
+        self._entries[key] = image
+        self.current_bytes += len(image)
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+
+    async def get_or_render(self, key: RenderKey, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        """
+        Returns the cached image for ``key``, or renders it with ``render()``.
+
+        The render runs as its own task: a caller that is cancelled stops
+        waiting, but the render still completes for the other waiters and
+        its result is cached.
+        """
+        image = self.get(key)
+        if image is not None:
+            return image
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(render())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: RenderKey, task: asyncio.Future):
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            logging.debug("Render for %s failed, not caching: %s", key.url, error)
+            return
+        self.put(key, task.result())
+
+
+_cache: Optional[RenderCache] = None
+
+
+def get_render_cache() -> RenderCache:
+    """
+    Returns the process-wide render cache, creating it on first use.
+    Usable as a FastAPI dependency.
+    """
+    global _cache
+    if _cache is None:
+        _cache = RenderCache()
+    return _cache
@@ -0,0 +1,154 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import BrokenExecutor, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+from app.config import RENDER_WORKERS, RENDER_QUEUE_DEPTH
+
+
+class RenderQueueFull(Exception):
+    """
+    Raised when every render worker is busy and the submission queue is full.
+    """
+
+
+def warm_up_worker():
+    """
+    Process pool initializer: renders one small QR code so that imports and the
+    library's lookup tables are loaded before the worker takes real traffic,
+    and builds the render plans of the versions typical URLs encode to.
+    """
+    from app.services.matrix_engine import prepare
+    from app.services.qr_service import ERROR_CORRECTION_LEVELS, QR_ERROR_CORRECTION, render_qr_code
+
+    render_qr_code("https://example.com", size=1)
+    prepare(ERROR_CORRECTION_LEVELS[QR_ERROR_CORRECTION], range(1, 11))
+
+
+class RenderEngine:
+    """
+    Runs CPU-bound QR rendering off the event loop on a pool of worker
+    processes, with a bounded number of pending submissions.
+
+    A submission holds its slot until the worker has actually finished with it,
+    so cancelled requests whose render already started still count against the
+    capacity. Renders that have not started yet are dropped when the awaiting
+    request is cancelled (for example because the client disconnected).
+    """
+
+    def __init__(self, workers: int = RENDER_WORKERS, queue_depth: int = RENDER_QUEUE_DEPTH):
+        if workers < 0 or queue_depth < 0:
+            raise ValueError("Render workers and queue depth must not be negative.")
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.capacity = max(workers, 1) + queue_depth
+        self._pending = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of submissions that are queued or being rendered.
+        """
+        return self._pending
+
+    def start(self) -> Executor:
+        """
+        Creates the worker pool if it does not exist yet and returns it.
+        """
+        with self._lock:
+            if self._executor is None:
+                if self.workers > 0:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up_worker)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qr-render")
+                logging.info("Render engine started with %s worker process(es), queue depth %s", self.workers, self.queue_depth)
+            return self._executor
+
+    def shutdown(self, wait: bool = True, drain: bool = False):
+        """
+        Stops the worker pool. With ``wait`` the call blocks until in-flight
+        renders have completed; queued renders that have not started are
+        cancelled, unless ``drain`` is set to render them first.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            if drain and self._pending:
+                logging.info("Draining %s pending render(s)", self._pending)
+            executor.shutdown(wait=wait, cancel_futures=not drain)
+            logging.info("Render engine stopped")
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.capacity:
+                self.rejected += 1
+                raise RenderQueueFull(f"Render queue is full ({self._pending} pending).")
+            self._pending += 1
+
+    def _release(self, _future: Optional[Future] = None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs ``func(*args, **kwargs)`` on the worker pool and returns its result.
+
+        ``func`` and its arguments must be picklable when the engine uses
+        worker processes.
+
+        Raises:
+        - RenderQueueFull: If the engine is already at capacity.
+        """
+        self._acquire()
+        executor = None
+        try:
+            executor = self.start()
+            future = executor.submit(functools.partial(func, *args, **kwargs))
+        except BaseException as e:
+            self._release()
+            if isinstance(e, BrokenExecutor) and executor is not None:
+                self._reset(executor)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenExecutor:
+            self._reset(executor)
+            raise
+
+    def _reset(self, broken: Executor):
+        # A worker process died; replace the pool so later renders can proceed.
+        # Every render of the broken pool fails, so only the first failure
+        # drops it: the pool current by then may already be its healthy successor.
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+        logging.error("Render pool is broken, restarting it")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+
+_engine: Optional[RenderEngine] = None
+
+
+def set_render_engine(engine: RenderEngine):
+    """
+    Replaces the process-wide render engine, e.g. to size it before forking server workers.
+    """
+    global _engine
+    _engine = engine
+
+
+def get_render_engine() -> RenderEngine:
+    """
+    Returns the process-wide render engine, creating it on first use.
+    Usable as a FastAPI dependency.
+    """
+    global _engine
+    if _engine is None:
+        _engine = RenderEngine()
+    return _engine
@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import List, Optional, Tuple
+from app.config import METRICS_DIRECTORY_SCAN_INTERVAL
+from app.services.admission import AdmissionController
+from app.services.qr_index import QRIndex, load_qr_index
+from app.services.render_cache import RenderCache
+from app.services.render_engine import RenderEngine
+from app.utils.metrics import REGISTRY, Counter, Gauge, Metric
+from app.utils.token_cache import TokenCache
+
+
+class DirectoryStats:
+    """
+    Number and total size of the stored QR code matrices and images, summed
+    from the QR index rather than by walking storage, and recounted at most
+    once every ``interval`` seconds so that scraping stays cheap.
+    """
+
+    def __init__(self, index: QRIndex, interval: float = METRICS_DIRECTORY_SCAN_INTERVAL):
+        self.index = index
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._scanned_at: Optional[float] = None
+        self._result = (0, 0)
+
+    def get(self) -> Tuple[int, int]:
+        now = time.monotonic()
+        with self._lock:
+            if self._scanned_at is not None and now - self._scanned_at < self.interval:
+                return self._result
+            # Concurrent scrapes until the count is in reuse the previous one.
+            self._scanned_at = now
+        result = self.index.usage()
+        with self._lock:
+            self._result = result
+        return result
+
+
+_directory_stats: Optional[DirectoryStats] = None
+
+
+def get_directory_stats() -> DirectoryStats:
+    """
+    Returns the process-wide QR code storage statistics. Usable as a FastAPI dependency.
+    """
+    global _directory_stats
+    if _directory_stats is None:
+        _directory_stats = DirectoryStats(load_qr_index())
+    return _directory_stats
+
+
+def _counter(name: str, documentation: str, value: float) -> Counter:
+    metric = Counter(name, documentation)
+    metric.inc(amount=value)
+    return metric
+
+
+def _gauge(name: str, documentation: str, value: float) -> Gauge:
+    metric = Gauge(name, documentation)
+    metric.set(value)
+    return metric
+
+
+def render_metrics(engine: RenderEngine, cache: RenderCache, token_cache: TokenCache, index: QRIndex,
+                   directory_stats: DirectoryStats, admission: AdmissionController) -> str:
+    """
+    Renders the request metrics together with the current state of the render
+    engine, admission control, caches, index and QR code directory in the Prometheus text format.
+    Blocks on the index, so call it off the event loop.
+    """
+    cache_stats = cache.stats()
+    token_stats = token_cache.stats()
+    files, size = directory_stats.get()
+    snapshot: List[Metric] = [
+        _gauge("qr_render_workers", "Render engine worker processes.", engine.workers),
+        _gauge("qr_render_capacity", "Renders that can be running or queued at once.", engine.capacity),
+        _gauge("qr_render_pending", "Renders currently queued or running.", engine.pending),
+        _counter("qr_render_rejected_total", "Renders rejected because the queue was full.", engine.rejected),
+        _gauge("qr_admission_capacity", "Render cost units that can be in flight at once.", admission.capacity),
+        _gauge("qr_admission_in_flight", "Render cost units currently in flight.", admission.backend.in_flight()),
+        _counter("qr_admission_rate_limited_total", "Requests rejected by the per-subject rate limit.",
+                 admission.rate_limited),
+        _counter("qr_admission_over_capacity_total", "Renders rejected because the render capacity was in use.",
+                 admission.over_capacity),
+        _gauge("qr_render_cache_entries", "Images in the render cache.", cache_stats["entries"]),
+        _gauge("qr_render_cache_bytes", "Bytes of images in the render cache.", cache_stats["bytes"]),
+        _gauge("qr_render_cache_max_bytes", "Render cache capacity in bytes.", cache_stats["max_bytes"]),
+        _gauge("qr_render_cache_inflight", "Renders in progress that requests are waiting on.", cache_stats["inflight"]),
+        _counter("qr_render_cache_hits_total", "Render cache hits.", cache_stats["hits"]),
+        _counter("qr_render_cache_misses_total", "Render cache misses.", cache_stats["misses"]),
+        _counter("qr_render_cache_evictions_total", "Images evicted from the render cache.", cache_stats["evictions"]),
+        _counter("qr_render_cache_coalesced_total", "Requests that joined an in-progress render.", cache_stats["coalesced"]),
+        _gauge("qr_token_cache_entries", "Verified tokens in the token cache.", token_stats["entries"]),
+        _counter("qr_token_cache_hits_total", "Token cache hits.", token_stats["hits"]),
+        _counter("qr_token_cache_misses_total", "Token cache misses.", token_stats["misses"]),
+        _gauge("qr_index_entries", "QR codes in the listing index.", index.count()),
+        _gauge("qr_directory_files", "Stored QR code matrices and images.", files),
+        _gauge("qr_directory_bytes", "Total size of the stored QR code matrices and images.", size),
+    ]
+    return REGISTRY.render(snapshot)
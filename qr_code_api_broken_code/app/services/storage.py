@@ -0,0 +1,523 @@
+import abc
+import argparse
+import bisect
+import errno
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from app.config import (QR_BLOB_BATCH_SIZE, QR_BLOB_PATH, QR_BLOB_POOL_SIZE, QR_DIRECTORY, QR_FSYNC,
+                        QR_STORAGE_BACKEND)
+from app.utils.common import MATRIX_SUFFIX, STORED_SUFFIXES, decode_filename_to_url, is_hashed_qr_id, qr_relative_path
+
+# Size of the chunks ``Storage.stream`` yields.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Incremental blob I/O (Connection.blobopen) needs Python 3.11; before that
+# SQLiteBlobStorage.stream reads values whole.
+_BLOB_IO = hasattr(sqlite3.Connection, "blobopen")
+
+
+class StoredObject(NamedTuple):
+    key: str
+    size: int
+    modified: float
+
+
+def qr_keys(qr_filename: str) -> Tuple[str, str]:
+    """
+    Returns the storage keys of a QR code's packed matrix and PNG image.
+    """
+    image_key = qr_relative_path(qr_filename)
+    return f"{image_key.rsplit('.', 1)[0]}{MATRIX_SUFFIX}", image_key
+
+
+def url_key(qr_filename: str) -> str:
+    """
+    Returns the storage key of the sidecar holding a QR code's original URL.
+    """
+    return f"{qr_relative_path(qr_filename).rsplit('.', 1)[0]}.url"
+
+
+def stored_url(storage: "Storage", qr_id: str) -> str:
+    """
+    Returns the URL of a QR code ID: decoded from base64 IDs, read from the
+    stored sidecar for hashed IDs.
+
+    Raises:
+    - ValueError: If the ID is invalid or unknown.
+    """
+    if not is_hashed_qr_id(qr_id):
+        return decode_filename_to_url(qr_id)
+    try:
+        return storage.get(url_key(f"{qr_id}.png")).decode("utf-8").strip()
+    except FileNotFoundError:
+        logging.error("No URL sidecar for QR code %s", qr_id)
+        raise ValueError("Unknown QR code ID provided.")
+
+
+class Storage(abc.ABC):
+    """
+    Blob storage for QR codes, addressed by keys of the form
+    ``[ab/cd/]<qr id>.<suffix>`` (see ``qr_keys``). Methods block, so call them
+    off the event loop.
+    """
+
+    @abc.abstractmethod
+    def put(self, key: str, data: bytes, exclusive: bool = True):
+        """
+        Stores ``data`` under ``key``. Readers see either the previous or the
+        complete new value, never a partial one.
+
+        Raises:
+        - FileExistsError: If ``exclusive`` and the key is already stored. Of
+          concurrent exclusive puts to the same key exactly one succeeds.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes:
+        """
+        Raises:
+        - FileNotFoundError: If nothing is stored under ``key``.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Yields the value stored under ``key`` in chunks.
+
+        Raises:
+        - FileNotFoundError: If nothing is stored under ``key``, when iteration starts.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def stat(self, key: str) -> Optional[StoredObject]:
+        """
+        Returns the size and modification time of a key, or None if it is not stored.
+        """
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> bool:
+        """
+        Deletes a key. Returns whether it was stored.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list(self, limit: int, cursor: Optional[str] = None,
+             prefix: Optional[str] = None) -> Tuple[List[StoredObject], Optional[str]]:
+        """
+        Returns up to ``limit`` stored objects in key order, starting after
+        ``cursor``, and the cursor for the next page (None on the last page).
+        """
+        raise NotImplementedError
+
+    def iter_objects(self, prefix: Optional[str] = None, page_size: int = 1000) -> Iterator[StoredObject]:
+        """
+        Yields every stored object; the order depends on the backend.
+        """
+        cursor = None
+        while True:
+            objects, cursor = self.list(page_size, cursor, prefix)
+            yield from objects
+            if cursor is None:
+                return
+
+    @abc.abstractmethod
+    def usage(self) -> Tuple[int, int]:
+        """
+        Returns the number and total size of the stored matrices and images.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+def _fsync_directory(directory: Path):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(data: bytes, path: Path, exclusive: bool, fsync: bool):
+    """
+    Writes ``data`` to a temporary file next to ``path`` and moves it into
+    place, so readers only ever see a missing or a complete file.
+
+    With ``exclusive`` the file is hard-linked into place, which fails with
+    FileExistsError if ``path`` exists, like opening it with O_EXCL; otherwise
+    it replaces any existing file. On filesystems without hard links the name
+    is first claimed by creating an empty file, which is briefly visible:
+    readers must treat an empty file as missing (as FileSystemStorage does).
+    """
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+            if fsync:
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+        if not exclusive:
+            os.replace(temp_name, path)
+        else:
+            try:
+                os.link(temp_name, path)
+            except OSError as e:
+                if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EXDEV):
+                    raise
+                # No hard links on this filesystem: claim the name exclusively, then replace it.
+                os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+                os.replace(temp_name, path)
+        if fsync:
+            _fsync_directory(path.parent)
+    finally:
+        Path(temp_name).unlink(missing_ok=True)
+
+
+class FileSystemStorage(Storage):
+    """
+    One file per key under a directory, shard prefixes being subdirectories.
+    Files are written atomically (see ``_write_atomic``) and can be served
+    directly from the directory. Empty files are read as missing: they are
+    names claimed by writes in progress, stored values are never empty.
+    """
+
+    def __init__(self, directory_path: Path, fsync: bool = QR_FSYNC):
+        self.directory_path = Path(directory_path)
+        self.fsync = fsync
+
+    def path(self, key: str) -> Path:
+        return self.directory_path / key
+
+    def put(self, key: str, data: bytes, exclusive: bool = True):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomic(data, path, exclusive=exclusive, fsync=self.fsync)
+
+    def get(self, key: str) -> bytes:
+        data = self.path(key).read_bytes()
+        if not data:
+            raise FileNotFoundError(errno.ENOENT, "Write in progress", str(self.path(key)))
+        return data
+
+    def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        with open(self.path(key), "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                raise FileNotFoundError(errno.ENOENT, "Write in progress", str(self.path(key)))
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def stat(self, key: str) -> Optional[StoredObject]:
+        try:
+            result = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        if not result.st_size:
+            return None
+        return StoredObject(key, result.st_size, result.st_mtime)
+
+    def delete(self, key: str) -> bool:
+        try:
+            self.path(key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _keys(self, directory_path: Path, prefix: str = "") -> Iterator[str]:
+        try:
+            entries = list(os.scandir(directory_path))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue  # temporary files of writes in progress
+            if entry.is_dir():
+                yield from self._keys(Path(entry.path), f"{prefix}{entry.name}/")
+            elif entry.is_file():
+                yield f"{prefix}{entry.name}"
+
+    def list(self, limit: int, cursor: Optional[str] = None,
+             prefix: Optional[str] = None) -> Tuple[List[StoredObject], Optional[str]]:
+        # The directory tree is walked on every call; fine for maintenance
+        # tasks, which is all that lists storage (requests use the QR index).
+        keys = sorted(key for key in self._keys(self.directory_path) if not prefix or key.startswith(prefix))
+        start = bisect.bisect_right(keys, cursor) if cursor else 0
+        objects = [stored for stored in map(self.stat, keys[start:start + limit]) if stored is not None]
+        next_cursor = keys[start + limit - 1] if len(keys) > start + limit else None
+        return objects, next_cursor
+
+    def iter_objects(self, prefix: Optional[str] = None, page_size: int = 1000) -> Iterator[StoredObject]:
+        # One walk of the tree, in no particular order.
+        for key in self._keys(self.directory_path):
+            if not prefix or key.startswith(prefix):
+                stored = self.stat(key)
+                if stored is not None:
+                    yield stored
+
+    def usage(self) -> Tuple[int, int]:
+        files = size = 0
+        for root, _dirs, names in os.walk(self.directory_path):
+            for name in names:
+                if name.endswith(STORED_SUFFIXES):
+                    try:
+                        file_size = os.stat(os.path.join(root, name)).st_size
+                    except FileNotFoundError:
+                        continue  # deleted while scanning
+                    if file_size:
+                        files += 1
+                        size += file_size
+        return files, size
+
+
+_BLOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    modified REAL NOT NULL
+);
+"""
+
+
+class _Write(NamedTuple):
+    key: str
+    data: Optional[bytes]  # None deletes the key
+    exclusive: bool
+    future: Future
+
+
+class SQLiteBlobStorage(Storage):
+    """
+    Keys packed as rows of a single SQLite database in WAL mode, which saves
+    an inode and a page cache entry per QR code and backs up as one file.
+
+    Reads use a pool of up to ``pool_size`` connections. Writes are queued to
+    a single writer thread, which commits whatever has queued up while the
+    previous transaction was committing (up to ``batch_size`` writes) in one
+    transaction, so concurrent writers share the cost of the commit.
+    """
+
+    def __init__(self, path: Path, pool_size: int = QR_BLOB_POOL_SIZE, batch_size: int = QR_BLOB_BATCH_SIZE,
+                 fsync: bool = QR_FSYNC):
+        if pool_size < 1 or batch_size < 1:
+            raise ValueError("Blob store pool size and batch size must be positive.")
+        self.path = Path(path)
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.commits = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        writer = self._connect()
+        writer.execute("PRAGMA journal_mode=WAL")
+        writer.executescript(_BLOB_SCHEMA)
+        self._readers: queue.LifoQueue = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._writes: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, args=(writer,), name="blob-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        conn.execute(f"PRAGMA synchronous={'FULL' if self.fsync else 'NORMAL'}")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    @contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        with self._reader_lock:
+            if self._readers.empty() and self._reader_count < self.pool_size:
+                self._reader_count += 1
+                self._readers.put(self._connect())
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def _write(self, key: str, data: Optional[bytes], exclusive: bool = False):
+        if not self._writer.is_alive():
+            raise RuntimeError("Blob store is closed.")
+        future: Future = Future()
+        self._writes.put(_Write(key, data, exclusive, future))
+        return future.result()
+
+    def _write_loop(self, conn: sqlite3.Connection):
+        stopping = False
+        while not stopping:
+            batch = [self._writes.get()]
+            while len(batch) < self.batch_size and not self._writes.empty():
+                batch.append(self._writes.get_nowait())
+            stopping = None in batch
+            batch = [write for write in batch if write is not None]
+            if batch:
+                self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[_Write]):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            for write in batch:
+                if write.data is None:
+                    results.append(conn.execute("DELETE FROM blobs WHERE key = ?", (write.key,)).rowcount > 0)
+                elif write.exclusive:
+                    inserted = conn.execute("INSERT OR IGNORE INTO blobs (key, data, modified) VALUES (?, ?, ?)",
+                                            (write.key, write.data, now)).rowcount > 0
+                    results.append(None if inserted else FileExistsError(f"{write.key} already exists."))
+                else:
+                    conn.execute("INSERT OR REPLACE INTO blobs (key, data, modified) VALUES (?, ?, ?)",
+                                 (write.key, write.data, now))
+                    results.append(None)
+            conn.execute("COMMIT")
+            self.commits += 1
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logging.error("Blob store commit of %s writes failed: %s", len(batch), e)
+            for write in batch:
+                write.future.set_exception(e)
+            return
+        for write, result in zip(batch, results):
+            if isinstance(result, Exception):
+                write.future.set_exception(result)
+            else:
+                write.future.set_result(result)
+
+    def put(self, key: str, data: bytes, exclusive: bool = True):
+        self._write(key, data, exclusive)
+
+    def delete(self, key: str) -> bool:
+        return self._write(key, None)
+
+    def get(self, key: str) -> bytes:
+        with self._reader() as conn:
+            row = conn.execute("SELECT data FROM blobs WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"{key} is not stored.")
+        return row[0]
+
+    def stream(self, key: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        if not _BLOB_IO:
+            data = self.get(key)
+            for start in range(0, len(data), chunk_size):
+                yield data[start:start + chunk_size]
+            return
+        with self._reader() as conn:
+            row = conn.execute("SELECT rowid FROM blobs WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                raise FileNotFoundError(f"{key} is not stored.")
+            with conn.blobopen("blobs", "data", row[0], readonly=True) as blob:
+                while chunk := blob.read(chunk_size):
+                    yield chunk
+
+    def stat(self, key: str) -> Optional[StoredObject]:
+        with self._reader() as conn:
+            row = conn.execute("SELECT key, length(data), modified FROM blobs WHERE key = ?", (key,)).fetchone()
+        return StoredObject(*row) if row else None
+
+    def list(self, limit: int, cursor: Optional[str] = None,
+             prefix: Optional[str] = None) -> Tuple[List[StoredObject], Optional[str]]:
+        clauses, params = [], []
+        if cursor:
+            clauses.append("key > ?")
+            params.append(cursor)
+        if prefix:
+            clauses.append("key >= ? AND key < ?")
+            params += [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._reader() as conn:
+            rows = conn.execute(f"SELECT key, length(data), modified FROM blobs {where} ORDER BY key LIMIT ?",
+                                (*params, limit + 1)).fetchall()
+        objects = [StoredObject(*row) for row in rows[:limit]]
+        return objects, objects[-1].key if len(rows) > limit else None
+
+    def usage(self) -> Tuple[int, int]:
+        clauses = " OR ".join("key LIKE ?" for _ in STORED_SUFFIXES)
+        with self._reader() as conn:
+            files, size = conn.execute(f"SELECT COUNT(*), COALESCE(SUM(length(data)), 0) FROM blobs WHERE {clauses}",
+                                       [f"%{suffix}" for suffix in STORED_SUFFIXES]).fetchone()
+        return files, size
+
+    def close(self):
+        """
+        Commits the queued writes and closes the database.
+        """
+        if self._writer.is_alive():
+            self._writes.put(None)
+            self._writer.join()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+
+
+def create_storage(backend: str = QR_STORAGE_BACKEND) -> Storage:
+    if backend == "sqlite":
+        return SQLiteBlobStorage(QR_BLOB_PATH)
+    return FileSystemStorage(QR_DIRECTORY)
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """
+    Returns the process-wide QR code storage, as selected by
+    QR_STORAGE_BACKEND. Usable as a FastAPI dependency.
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = create_storage()
+        return _storage
+
+
+def copy_storage(source: Storage, target: Storage) -> int:
+    """
+    Copies every key of ``source`` that ``target`` does not have yet.
+
+    Returns:
+    - Number of copied keys.
+    """
+    copied = 0
+    for stored in source.iter_objects():
+        try:
+            target.put(stored.key, source.get(stored.key))
+            copied += 1
+        except FileExistsError:
+            pass
+    return copied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy stored QR codes from a QR code directory into a blob store.")
+    parser.add_argument("--directory", type=Path, default=QR_DIRECTORY, help="QR code directory to copy from.")
+    parser.add_argument("--database", type=Path, default=QR_BLOB_PATH, help="Blob store database to copy into.")
+    args = parser.parse_args(argv)
+    target = SQLiteBlobStorage(args.database)
+    try:
+        count = copy_storage(FileSystemStorage(args.directory), target)
+    finally:
+        target.close()
+    print(f"Copied {count} file(s) from {args.directory} into {args.database}")
+
+
+if __name__ == "__main__":
+    main()
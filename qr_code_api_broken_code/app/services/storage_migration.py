@@ -0,0 +1,69 @@
+import argparse
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+from app.config import QR_DIRECTORY, QR_INDEX_PATH
+from app.services.qr_index import QRIndex
+from app.utils.common import STORED_SUFFIXES, decode_filename_to_url, hash_url_to_qr_id, qr_relative_path, url_sidecar_path
+
+
+def migrate_to_sharded(directory_path: Path, index: Optional[QRIndex] = None, dry_run: bool = False) -> int:
+    """
+    Moves base64-named QR codes stored directly in a directory to the sharded
+    layout: each file (packed matrix or PNG image) is renamed to its
+    content-hash ID inside prefix directories and a .url sidecar records the
+    original URL. Files that are not base64 IDs are left alone.
+
+    Parameters:
+    - directory_path (Path): The QR code directory.
+    - index (QRIndex): Listing index to update with the new filenames.
+    - dry_run (bool): Only report what would be moved.
+
+    Returns:
+    - Number of migrated QR codes.
+    """
+    migrated = 0
+    flat_files = {}
+    with os.scandir(directory_path) as it:
+        for entry in it:
+            if entry.name.endswith(STORED_SUFFIXES) and entry.is_file():
+                flat_files.setdefault(entry.name.rsplit('.', 1)[0], []).append(entry.name)
+    for qr_id, names in flat_files.items():
+        filename = f"{qr_id}.png"
+        try:
+            url = decode_filename_to_url(qr_id)
+            # Hashing normalizes the URL, rejecting names that decode to other text.
+            new_filename = f"{hash_url_to_qr_id(url)}.png"
+        except ValueError:
+            logging.warning("Skipping %s: not a base64 QR code ID", filename)
+            continue
+        target = directory_path / qr_relative_path(new_filename)
+        logging.info("Migrating %s -> %s", filename, target.relative_to(directory_path))
+        migrated += 1
+        if dry_run:
+            continue
+        target.parent.mkdir(parents=True, exist_ok=True)
+        url_sidecar_path(target).write_text(url, encoding='utf-8')
+        stored_bytes = sum((directory_path / name).stat().st_size for name in names)
+        for name in names:
+            os.replace(directory_path / name, target.with_suffix(Path(name).suffix))
+        if index is not None and not index.rename(filename, new_filename):
+            index.add(new_filename, url, None, stored_files=len(names), stored_bytes=stored_bytes)
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migrate a flat QR code directory to the hash-sharded layout.")
+    parser.add_argument("--directory", type=Path, default=QR_DIRECTORY, help="QR code directory to migrate.")
+    parser.add_argument("--index", type=Path, default=QR_INDEX_PATH, help="Index database to update.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the files that would be moved.")
+    args = parser.parse_args(argv)
+    index = None if args.dry_run else QRIndex(args.index)
+    count = migrate_to_sharded(args.directory, index, dry_run=args.dry_run)
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {count} QR code(s) in {args.directory}")
+    print("Set QR_STORAGE_LAYOUT=sharded before restarting the service.")
+
+
+if __name__ == "__main__":
+    main()
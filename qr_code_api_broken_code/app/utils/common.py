@@ -1,36 +1,48 @@
 import logging.config
 import os
+import re
 import base64
+import hashlib
+from pathlib import Path
 from typing import List, Optional, Any
-from dotenv import load_dotenv
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
 from fastapi import HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
-from app.config import ADMIN_PASSWORD, ADMIN_USER, ALGORITHM, SECRET_KEY
-from urllib.parse import urlparse
+from starlette.concurrency import run_in_threadpool
+from app.config import (ADMIN_PASSWORD, ADMIN_USER, ALGORITHM, SECRET_KEY, LOG_FORMAT, QR_DIRECTORY, QR_STORAGE_LAYOUT,
+                        SERVER_DOWNLOAD_FOLDER)
+from urllib.parse import urlparse, urlsplit, urlunsplit
 from pydantic import AnyUrl
+from app.services.qr_formats import MEDIA_TYPES
+from app.utils.log_pipeline import start_queue_logging
+from app.utils.metrics import stage
+from app.utils.token_cache import TokenCache, get_token_cache
 
-# Load environment variables from .env file
-load_dotenv()
-
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
+# For endpoints where a missing bearer token is not an error by itself.
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token", auto_error=False)
 
 
 def setup_logging():
+    """
+    Configures logging from logging.conf, then moves the root handlers behind
+    a queue drained on a background thread (see app.utils.log_pipeline).
+    """
     logging_config_path = os.path.join(os.path.dirname(__file__), '..', '..', 'logging.conf')
     normalized_path = os.path.normpath(logging_config_path)
     if not os.path.exists(normalized_path):
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-        logging.warning(f"Default logging configured; missing logging configuration file at: {normalized_path}")
+        logging.warning("Default logging configured; missing logging configuration file at: %s", normalized_path)
     else:
         logging.config.fileConfig(normalized_path, disable_existing_loggers=False)
+    start_queue_logging(logging.getLogger(), json_format=LOG_FORMAT == "json")
 
 
 def authenticate_user(username: str, password: str) -> Optional[dict]:
     if username == ADMIN_USER and password == ADMIN_PASSWORD:
         return {"username": username}
-    logging.warning(f"Authentication failed for user: {username}")
+    logging.warning("Authentication failed for user: %s", username)
     return None
 
 
@@ -41,7 +53,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
     to_encode.update({"exp": expire})
-    logging.info(f"Token created with expiration: {expire}")
+    logging.info("Token created with expiration: %s", expire)
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -57,16 +69,36 @@ def validate_and_sanitize_url(url_str: Any) -> Optional[str]:
     try:
         parsed_url = urlparse(url_str)
         if parsed_url.scheme in {"http", "https"} and parsed_url.netloc:
-            logging.info(f"URL validated successfully: {url_str}")
+            logging.info("URL validated successfully: %s", url_str)
             return url_str
         else:
-            logging.error(f"Validation failed: URL must have a valid scheme and netloc - {url_str}")
+            logging.error("Validation failed: URL must have a valid scheme and netloc - %s", url_str)
             return None
     except Exception as e:
-        logging.error(f"Exception during URL validation: {e}")
+        logging.error("Exception during URL validation: %s", e)
         return None
 
 
+_DEFAULT_PORTS = {"http": ":80", "https": ":443"}
+
+
+def normalize_url(url: Any) -> str:
+    """
+    Returns the canonical form of a URL: lowercase scheme and host, no default
+    port and "/" for an empty path. Equivalent URLs normalize to the same string.
+    """
+    sanitized_url = validate_and_sanitize_url(url)
+    if sanitized_url is None:
+        raise ValueError("Invalid URL. Cannot normalize.")
+    parts = urlsplit(sanitized_url)
+    scheme = parts.scheme.lower()
+    userinfo, at, hostport = parts.netloc.rpartition("@")
+    hostport = hostport.lower()
+    if hostport.endswith(_DEFAULT_PORTS[scheme]):
+        hostport = hostport[:-len(_DEFAULT_PORTS[scheme])]
+    return urlunsplit((scheme, userinfo + at + hostport, parts.path or "/", parts.query, parts.fragment))
+
+
 def encode_url_to_filename(url: Any) -> str:
     """
     Encodes a URL into a safe filename using base64 encoding.
@@ -76,53 +108,167 @@ def encode_url_to_filename(url: Any) -> str:
         raise ValueError("Invalid URL. Cannot encode.")
     encoded_bytes = base64.urlsafe_b64encode(sanitized_url.encode('utf-8'))
     filename = encoded_bytes.decode('utf-8').rstrip('=')
-    logging.info(f"URL encoded to filename: {filename}")
+    logging.info("URL encoded to filename: %s", filename)
     return filename
 
 
-def decode_filename_to_url(encoded_str: str) -> str:
+# Content-hash QR code IDs used by the sharded storage layout. Base64 IDs of
+# http(s) URLs always start with "aHR0c", so the two forms cannot collide.
+_HASHED_QR_ID = re.compile(r"[0-9a-f]{32}")
+
+# Extensions of the files a stored QR code may consist of: its packed module
+# matrix and, optionally, a PNG image.
+MATRIX_SUFFIX = ".qrm"
+STORED_SUFFIXES = (MATRIX_SUFFIX, ".png")
+
+
+def hash_url_to_qr_id(url: Any) -> str:
+    """
+    Returns the fixed-length content hash ID of a URL used by the sharded layout.
+    """
+    return hashlib.blake2b(normalize_url(url).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def is_hashed_qr_id(qr_id: str) -> bool:
+    return _HASHED_QR_ID.fullmatch(qr_id) is not None
+
+
+def url_to_qr_id(url: Any, layout: str = QR_STORAGE_LAYOUT) -> str:
+    """
+    Returns the ID (filename without extension) of the QR code for a URL in the
+    given storage layout: base64 of the URL for "flat", a content hash for "sharded".
+    """
+    if layout == "sharded":
+        return hash_url_to_qr_id(url)
+    return encode_url_to_filename(url)
+
+
+def qr_relative_path(qr_filename: str) -> str:
+    """
+    Returns the path of a QR code file relative to the QR code directory.
+    Hashed IDs live in two levels of prefix directories (ab/cd/abcd....png),
+    base64 IDs directly in the directory.
+    """
+    qr_id = qr_filename.split('.', 1)[0]
+    if is_hashed_qr_id(qr_id):
+        return f"{qr_id[:2]}/{qr_id[2:4]}/{qr_filename}"
+    return qr_filename
+
+
+def url_sidecar_path(image_path: Path) -> Path:
+    """
+    Returns the path of the sidecar file holding the original URL of a
+    QR code stored under a hashed ID.
+    """
+    return image_path.with_suffix('.url')
+
+
+def decode_filename_to_url(encoded_str: str, directory_path: Optional[Path] = None) -> str:
+    """
+    Returns the URL for a QR code ID. Base64 IDs are decoded; hashed IDs are
+    looked up in their sidecar file under ``directory_path`` (QR_DIRECTORY by default).
+    """
+    if is_hashed_qr_id(encoded_str):
+        sidecar = url_sidecar_path((directory_path or QR_DIRECTORY) / qr_relative_path(f"{encoded_str}.png"))
+        try:
+            return sidecar.read_text(encoding='utf-8').strip()
+        except OSError as e:
+            logging.error("No URL sidecar for QR code %s: %s", encoded_str, e)
+            raise ValueError("Unknown QR code ID provided.")
     try:
-        padding_needed = 4 - (len(encoded_str) % 4)
+        padding_needed = -len(encoded_str) % 4
         if padding_needed:
             encoded_str += "=" * padding_needed
         decoded_bytes = base64.urlsafe_b64decode(encoded_str)
         url = decoded_bytes.decode('utf-8')
-        logging.info(f"Filename decoded to URL: {url}")
+        logging.info("Filename decoded to URL: %s", url)
         return url
     except (base64.binascii.Error, UnicodeDecodeError) as e:
-        logging.error(f"Error decoding filename to URL: {e}")
+        logging.error("Error decoding filename to URL: %s", e)
         raise ValueError("Invalid encoded string provided.")
 
 
-def generate_links(action: str, qr_filename: str, base_api_url: str, download_url: str) -> List[dict]:
+def generate_links(action: str, qr_filename: str, base_api_url: str, download_url: Optional[str] = None) -> List[dict]:
     filename, ext = os.path.splitext(qr_filename)
     if ext != '.png':
         raise ValueError("QR filename must have a .png extension.")
-    try:
-        original_url = decode_filename_to_url(filename)
-    except ValueError:
-        logging.warning(f"Filename could not be decoded to a URL: {qr_filename}")
-        original_url = None
+    if download_url is None:
+        download_url = f"{base_api_url}/{SERVER_DOWNLOAD_FOLDER}/{qr_relative_path(qr_filename)}"
 
     links = []
     if action in ["list", "create"]:
         links.append({"rel": "view", "href": download_url, "action": "GET", "type": "image/png"})
+        for extension, media_type in MEDIA_TYPES.items():
+            href = f"{base_api_url}/qr-codes/{filename}.{extension}"
+            links.append({"rel": "alternate", "href": href, "action": "GET", "type": media_type})
     if action in ["list", "create", "delete"]:
         delete_url = f"{base_api_url}/qr-codes/{qr_filename}"
         links.append({"rel": "delete", "href": delete_url, "action": "DELETE", "type": "application/json"})
-    logging.info(f"Links generated: {links}")
+    logging.debug("Links generated: %s", links)
     return links
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Evaluates an If-None-Match header against an entity tag (weak comparison).
+    """
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag for candidate in candidates)
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme),
+                           token_cache: TokenCache = Depends(get_token_cache)) -> dict:
+    """
+    FastAPI dependency returning the user a bearer token was issued to.
+    Tokens verified before are served from ``token_cache`` until they expire,
+    on the event loop; only a cache miss decodes the token in the threadpool.
+
+    Raises:
+    - HTTPException: 401 if the token is invalid or expired.
+    """
+    with stage("auth"):
+        user = token_cache.get(token)
+        if user is None:
+            user = await run_in_threadpool(_decode_token, token, token_cache)
+        return user
+
+
+async def get_optional_user(token: Optional[str] = Depends(optional_oauth2_scheme),
+                            token_cache: TokenCache = Depends(get_token_cache)) -> Optional[dict]:
+    """
+    FastAPI dependency returning the user a bearer token was issued to, or
+    None if the request carries no token.
+
+    Raises:
+    - HTTPException: 401 if a token is given but invalid or expired.
+    """
+    return None if token is None else await get_current_user(token, token_cache)
+
+
+def verify_token(token: str, token_cache: TokenCache) -> dict:
+    """
+    Synchronous form of ``get_current_user``, for code outside a request.
+
+    Raises:
+    - HTTPException: 401 if the token is invalid or expired.
+    """
+    user = token_cache.get(token)
+    return user if user is not None else _decode_token(token, token_cache)
+
+
+def _decode_token(token: str, token_cache: TokenCache) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             logging.error("Invalid token: Missing subject field.")
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        logging.info(f"Authenticated user: {username}")
-        return {"username": username}
+        logging.info("Authenticated user: %s", username)
+        user = {"username": username}
+        token_cache.put(token, user, payload.get("exp"))
+        return user
     except JWTError as e:
-        logging.error(f"JWT decoding error: {e}")
+        logging.error("JWT decoding error: %s", e)
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
@@ -0,0 +1,124 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from typing import Optional
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Whether INFO messages of the current request are logged; None outside requests.
+_info_sampled: contextvars.ContextVar[Optional[bool]] = contextvars.ContextVar("info_sampled", default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that hands records to the listener thread unformatted, so
+    %-style arguments are only interpolated off the request path.
+
+    The stock QueueHandler formats every record in the calling thread to make
+    it safe to pickle; records here never leave the process.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class InfoSamplingFilter(logging.Filter):
+    """
+    Drops INFO (and DEBUG) records emitted while handling a request that was
+    not sampled. Warnings and errors always pass.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.INFO or _info_sampled.get() is not False
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formats records as one compact JSON object per line, with UTC timestamps.
+    """
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class LogSamplingMiddleware:
+    """
+    Decides once per HTTP request whether its INFO-level messages are logged.
+    """
+
+    def __init__(self, app: ASGIApp, rate: float = 1.0):
+        self.app = app
+        self.rate = rate
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self.rate >= 1.0:
+            await self.app(scope, receive, send)
+            return
+        token = _info_sampled.set(random.random() < self.rate)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _info_sampled.reset(token)
+
+
+def start_queue_logging(logger: logging.Logger, json_format: bool = False):
+    """
+    Moves the handlers of ``logger`` behind a queue drained by a background
+    listener thread, so logging calls on the event loop never block on I/O.
+    Optionally switches those handlers to the JSON formatter.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    handlers = [handler for handler in logger.handlers if not isinstance(handler, DeferredQueueHandler)]
+    if json_format:
+        for handler in handlers:
+            handler.setFormatter(JSONFormatter())
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(InfoSamplingFilter())
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_queue_logging)
+
+
+def _restart_listener_after_fork():
+    # Only the forking thread survives a fork; give the child its own listener
+    # for the inherited queue (pre-forked server and render worker processes).
+    global _listener
+    if _listener is not None:
+        _listener = logging.handlers.QueueListener(_listener.queue, *_listener.handlers,
+                                                   respect_handler_level=_listener.respect_handler_level)
+        _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
+
+def stop_queue_logging():
+    """
+    Flushes queued records and stops the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,124 @@
+import codecs
+import json
+from typing import Any, AsyncIterator, Tuple
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+NDJSON_CONTENT_TYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl"}
+
+# Largest single JSON value accepted from a streamed request body.
+MAX_ITEM_CHARS = 1024 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+
+async def _iter_text(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Parses a stream of newline-delimited JSON, yielding one value per
+    non-empty line as soon as the line is complete.
+
+    Raises:
+    - ValueError: If a line is not valid JSON or is longer than MAX_ITEM_CHARS.
+    """
+    buffer = ""
+    async for text in _iter_text(chunks):
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+        if len(buffer) > MAX_ITEM_CHARS:
+            raise ValueError("NDJSON line is too long.")
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Incrementally parses a stream holding one JSON array, yielding each element
+    as soon as it has been received instead of loading the whole document.
+
+    Raises:
+    - ValueError: If the stream is not a well-formed JSON array.
+    """
+    texts = _iter_text(chunks)
+    buffer, position, finished = "", 0, False
+
+    async def fill() -> bool:
+        nonlocal buffer, position, finished
+        try:
+            text = await texts.__anext__()
+        except StopAsyncIteration:
+            finished = True
+            return False
+        buffer = buffer[position:] + text
+        position = 0
+        return True
+
+    async def next_token() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in _WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not await fill():
+                raise ValueError("Unexpected end of JSON array.")
+
+    async def next_value() -> Tuple[Any, int]:
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, position)
+                # A value ending exactly at the buffer end may be a truncated number.
+                if end < len(buffer) or finished:
+                    return value, end
+            except json.JSONDecodeError:
+                if finished:
+                    raise
+            if len(buffer) - position > MAX_ITEM_CHARS:
+                raise ValueError("JSON array item is too large.")
+            await fill()
+
+    if await next_token() != "[":
+        raise ValueError("Expected a JSON array.")
+    position += 1
+    if await next_token() == "]":
+        return
+    while True:
+        await next_token()
+        value, position = await next_value()
+        yield value
+        token = await next_token()
+        position += 1
+        if token == "]":
+            break
+        if token != ",":
+            raise ValueError(f"Expected ',' or ']' in JSON array, got {token!r}.")
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streams newline-delimited JSON.
+
+    Unlike ``StreamingResponse`` it does not consume the request's receive
+    channel to watch for disconnects, so the body iterator can keep reading a
+    streamed request body while results are being sent.
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,110 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from app.config import TOKEN_CACHE_MAX_ENTRIES, TOKEN_CACHE_TTL
+
+
+def token_digest(token: str) -> bytes:
+    """
+    Key under which a token is cached, so raw bearer tokens are not kept in memory.
+    """
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class TokenCache:
+    """
+    Bounded LRU cache of already-verified access tokens.
+
+    An entry is trusted for at most ``ttl`` seconds and never past the
+    token's own ``exp`` claim, so caching cannot extend a token's lifetime.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES, ttl: float = TOKEN_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, token: str, now: Optional[float] = None) -> Optional[dict]:
+        """
+        Returns the user of a cached, unexpired token and marks it most recently used.
+        """
+        if not self.enabled:
+            return None
+        key = token_digest(token)
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if now >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user
+
+    def put(self, token: str, user: dict, exp: Optional[float] = None, now: Optional[float] = None):
+        """
+        Caches a verified token until ``exp`` (seconds since the epoch) or for
+        ``ttl`` seconds, whichever comes first.
+        """
+        if not self.enabled:
+            return
+        now = time.time() if now is None else now
+        expires_at = now + self.ttl if exp is None else min(float(exp), now + self.ttl)
+        if expires_at <= now:
+            return
+        key = token_digest(token)
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+_cache: Optional[TokenCache] = None
+
+
+async def get_token_cache() -> TokenCache:
+    """
+    Returns the process-wide verified-token cache, creating it on first use.
+    Usable as a FastAPI dependency; a coroutine so that FastAPI does not
+    resolve it in the threadpool on every authenticated request.
+    """
+    global _cache
+    if _cache is None:
+        _cache = TokenCache()
+    return _cache
@@ -0,0 +1,62 @@
+"""
+Measures authenticated requests per second with and without the
+verified-token cache.
+
+Run from the project directory:  python -m benchmarks.auth [--requests N]
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+from httpx import AsyncClient
+from main import app
+from app.services.qr_index import QRIndex, get_qr_index
+from app.utils.common import create_access_token, verify_token
+from app.utils.token_cache import TokenCache, get_token_cache
+
+
+def _dependency_rate(token: str, token_cache: TokenCache, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        verify_token(token, token_cache)
+    return count / (time.perf_counter() - start)
+
+
+async def _request_rate(token: str, token_cache: TokenCache, count: int) -> float:
+    app.dependency_overrides[get_token_cache] = lambda: token_cache
+    headers = {"Authorization": f"Bearer {token}"}
+    async with AsyncClient(app=app, base_url="http://bench") as ac:
+        await ac.get("/qr-codes/", params={"limit": 1}, headers=headers)
+        start = time.perf_counter()
+        for _ in range(count):
+            response = await ac.get("/qr-codes/", params={"limit": 1}, headers=headers)
+            assert response.status_code == 200, response.text
+        return count / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000, help="Authenticated requests sent per configuration.")
+    args = parser.parse_args(argv)
+
+    # Per-request log lines would otherwise dominate both measurements.
+    logging.disable(logging.INFO)
+    token = create_access_token({"sub": "bench"})
+    with tempfile.TemporaryDirectory() as directory:
+        index = QRIndex(Path(directory) / "index.sqlite")
+        app.dependency_overrides[get_qr_index] = lambda: index
+        print(f"{'configuration':<14} {'verify_token/s':>19} {'GET /qr-codes/ req/s':>21}")
+        for name, token_cache in (("uncached", TokenCache(ttl=0)), ("cached", TokenCache())):
+            calls = _dependency_rate(token, token_cache, args.requests * 10)
+            requests = asyncio.run(_request_rate(token, token_cache, args.requests))
+            print(f"{name:<14} {calls:>19,.0f} {requests:>21,.0f}")
+        app.dependency_overrides.clear()
+        index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,425 @@
+"""
+Drives a mix of API requests at a fixed concurrency or arrival rate and
+reports throughput, latency percentiles and error rates per endpoint.
+
+Run from the project directory, against the app in this process, a server
+started for the run, or one already running:
+
+    python -m benchmarks.loadtest [--concurrency 32 | --rate 200] [--duration 30]
+    python -m benchmarks.loadtest --server gunicorn --workers 4 --output results.json
+    python -m benchmarks.loadtest --url http://localhost:8000 --mix create=1,list=9
+
+The token comes from POST /token with ADMIN_USER and ADMIN_PASSWORD. In
+process and started servers store QR codes in a temporary directory and
+run without the per-user rate limit (unless --rate-limit), so that a single
+load user is not throttled; other settings, such as QR_STORAGE_BACKEND or
+RENDER_WORKERS, come from the environment as usual.
+
+With --concurrency, that many clients send requests back to back (closed
+loop). With --rate, requests start at random (Poisson) times at that average
+rate whether or not earlier ones have finished (open loop), and latency is
+measured from when a request was due, so time spent queued behind a slow
+server counts. Requests in the first --warmup seconds are not counted.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterator, Deque, Dict, List, Optional
+import httpx
+from app.config import ADMIN_PASSWORD, ADMIN_USER
+
+PROJECT_DIRECTORY = Path(__file__).resolve().parent.parent
+
+# Endpoint each operation is reported under.
+ENDPOINTS = {
+    "create": "POST /qr-codes/",
+    "list": "GET /qr-codes/",
+    "delete": "DELETE /qr-codes/{filename}",
+    "render": "GET /qr-codes/render.png",
+    "health": "GET /",
+}
+DEFAULT_MIX = "create=2,list=3,delete=1,render=2,health=2"
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Parses ``operation=weight,...`` into weights by operation.
+
+    Raises:
+    - ValueError: For unknown operations, or weights that are negative or all zero.
+    """
+    weights = {}
+    for item in mix.split(","):
+        operation, _, weight = item.partition("=")
+        operation = operation.strip()
+        if operation not in ENDPOINTS:
+            raise ValueError(f"Unknown operation {operation!r}; choose from {', '.join(ENDPOINTS)}.")
+        weights[operation] = float(weight or 1)
+        if weights[operation] < 0:
+            raise ValueError("Operation weights must not be negative.")
+    if not any(weights.values()):
+        raise ValueError("At least one operation needs a positive weight.")
+    return weights
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    # Nearest-rank percentile.
+    return sorted_values[max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)]
+
+
+class LoadTest:
+    """
+    Issues requests of a weighted mix of operations and records their
+    latencies and outcomes while ``recording``. Delete operations remove QR
+    codes created earlier in the run; with none left they create one instead.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, headers: Dict[str, str], mix: Dict[str, float], size: int = 5,
+                 seed: Optional[int] = None):
+        self.client = client
+        self.headers = headers
+        self.operations = list(mix)
+        self.weights = [mix[operation] for operation in self.operations]
+        self.size = size
+        self.rng = random.Random(seed)
+        self.run_id = f"{os.getpid()}-{int(time.time())}"
+        self.recording = False
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Counter] = defaultdict(Counter)
+        self.errors: Counter = Counter()
+        self.dropped = 0
+        self._created: Deque[str] = deque()
+        self._counter = itertools.count()
+
+    def _url(self) -> str:
+        return f"https://example.com/load/{self.run_id}/{next(self._counter)}"
+
+    async def _create(self) -> httpx.Response:
+        response = await self.client.post("/qr-codes/", json={"url": self._url(), "size": self.size},
+                                          headers=self.headers)
+        if response.status_code == 201:
+            self._created.append(response.json()["qr_code_url"].split("?")[0].rsplit("/", 1)[-1])
+        return response
+
+    async def _list(self) -> httpx.Response:
+        return await self.client.get("/qr-codes/", params={"limit": 100}, headers=self.headers)
+
+    async def _delete(self) -> httpx.Response:
+        return await self.client.delete(f"/qr-codes/{self._created.popleft()}", headers=self.headers)
+
+    async def _render(self) -> httpx.Response:
+        return await self.client.get("/qr-codes/render.png", params={"url": self._url(), "size": self.size})
+
+    async def _health(self) -> httpx.Response:
+        return await self.client.get("/")
+
+    async def issue(self, due: float):
+        """
+        Sends one request of a randomly chosen operation; its latency is
+        measured from ``due`` (a ``time.perf_counter`` value).
+        """
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        if operation == "delete" and not self._created:
+            operation = "create"
+        try:
+            response = await getattr(self, f"_{operation}")()
+            outcome = str(response.status_code)
+            failed = response.is_error
+        except httpx.HTTPError as e:
+            outcome, failed = type(e).__name__, True
+        latency = time.perf_counter() - due
+        if self.recording:
+            endpoint = ENDPOINTS[operation]
+            self.latencies[endpoint].append(latency)
+            self.outcomes[endpoint][outcome] += 1
+            self.errors[endpoint] += failed
+
+    async def closed_loop(self, concurrency: int, duration: float):
+        deadline = time.perf_counter() + duration
+
+        async def client():
+            while time.perf_counter() < deadline:
+                await self.issue(time.perf_counter())
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    async def open_loop(self, rate: float, duration: float, max_outstanding: int):
+        deadline = time.perf_counter() + duration
+        due = time.perf_counter()
+        outstanding = set()
+        while due < deadline:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if len(outstanding) >= max_outstanding:
+                # The server has fallen this far behind; count the request as lost.
+                self.dropped += self.recording
+            else:
+                task = asyncio.ensure_future(self.issue(due))
+                outstanding.add(task)
+                task.add_done_callback(outstanding.discard)
+            due += self.rng.expovariate(rate)
+        await asyncio.gather(*outstanding)
+
+    def report(self, elapsed: float) -> Dict[str, dict]:
+        """
+        Returns throughput, latency (in milliseconds) and errors per endpoint,
+        plus their totals under "all".
+        """
+        report = {endpoint: self._summary(self.latencies[endpoint], self.errors[endpoint],
+                                          self.outcomes[endpoint], elapsed) for endpoint in sorted(self.latencies)}
+        report["all"] = self._summary(list(itertools.chain(*self.latencies.values())), sum(self.errors.values()),
+                                      sum(self.outcomes.values(), Counter()), elapsed)
+        report["all"]["dropped"] = self.dropped
+        return report
+
+    @staticmethod
+    def _summary(latencies: List[float], errors: int, outcomes: Counter, elapsed: float) -> dict:
+        latencies = sorted(latencies)
+        count = len(latencies)
+        summary = {
+            "requests": count,
+            "errors": errors,
+            "error_rate": errors / count if count else 0.0,
+            "requests_per_second": count / elapsed if elapsed else 0.0,
+            "statuses": dict(sorted(outcomes.items())),
+        }
+        if latencies:
+            summary["latency_ms"] = {
+                **{f"p{p}": percentile(latencies, p) * 1000 for p in PERCENTILES},
+                "max": latencies[-1] * 1000,
+                "mean": sum(latencies) / count * 1000,
+            }
+        return summary
+
+
+def format_table(report: Dict[str, dict]) -> str:
+    header = (f"{'endpoint':<30} {'requests':>9} {'errors':>7} {'err %':>6} {'req/s':>9} "
+              + " ".join(f"{f'p{p} ms':>8}" for p in PERCENTILES) + f" {'max ms':>8}")
+    lines = [header, "-" * len(header)]
+    for endpoint, summary in report.items():
+        latency = summary.get("latency_ms", {})
+        lines.append(f"{endpoint:<30} {summary['requests']:>9} {summary['errors']:>7} "
+                     f"{summary['error_rate'] * 100:>6.2f} {summary['requests_per_second']:>9.1f} "
+                     + " ".join(f"{latency.get(f'p{p}', 0):>8.1f}" for p in PERCENTILES)
+                     + f" {latency.get('max', 0):>8.1f}")
+    return "\n".join(lines)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _isolated_environment(workdir: Path, rate_limit: bool) -> Dict[str, str]:
+    environment = {
+        "QR_DIRECTORY": str(workdir / "qr_codes"),
+        "QR_INDEX_PATH": str(workdir / "index.sqlite"),
+        "QR_BLOB_PATH": str(workdir / "blobs.sqlite"),
+        "QR_JOB_PATH": str(workdir / "jobs.sqlite"),
+    }
+    if not rate_limit:
+        environment["ADMISSION_RATE"] = "0"
+    return environment
+
+
+@asynccontextmanager
+async def started_server(server: str, workers: int, workdir: Path, rate_limit: bool,
+                         timeout: float = 60.0) -> AsyncIterator[str]:
+    """
+    Starts uvicorn or the gunicorn server (serve.py) with ``workers`` worker
+    processes on a free local port, yields its base URL once it answers, and
+    stops it afterwards. Its output goes to ``workdir``/server.log.
+    """
+    port = _free_port()
+    environment = {**os.environ, **_isolated_environment(workdir, rate_limit), "SERVER_HOST": "127.0.0.1",
+                   "SERVER_PORT": str(port), "SERVER_WORKERS": str(workers)}
+    if server == "uvicorn":
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(workers), "--no-access-log"]
+    else:
+        command = [sys.executable, "serve.py"]
+    log_path = workdir / "server.log"
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen(command, cwd=PROJECT_DIRECTORY, env=environment, stdout=log,
+                                   stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            deadline = time.monotonic() + timeout
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"{server} exited with status {process.returncode}; see {log_path}")
+                try:
+                    if (await client.get("/")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{server} did not start within {timeout:.0f} s; see {log_path}")
+                await asyncio.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+@asynccontextmanager
+async def in_process_app(workdir: Path, rate_limit: bool) -> AsyncIterator[httpx.ASGITransport]:
+    """
+    Yields a transport calling the application in this process, with its
+    storage and index in ``workdir``.
+    """
+    from main import app
+    from app.config import QR_STORAGE_BACKEND
+    from app.services.admission import AdmissionController, get_admission_controller
+    from app.services.qr_index import QRIndex, get_qr_index
+    from app.services.render_engine import get_render_engine, warm_up_worker
+    from app.services.storage import FileSystemStorage, SQLiteBlobStorage, get_storage
+
+    paths = _isolated_environment(workdir, rate_limit)
+    if QR_STORAGE_BACKEND == "sqlite":
+        storage = SQLiteBlobStorage(Path(paths["QR_BLOB_PATH"]))
+    else:
+        storage = FileSystemStorage(Path(paths["QR_DIRECTORY"]))
+    index = QRIndex(Path(paths["QR_INDEX_PATH"]))
+    app.dependency_overrides[get_storage] = lambda: storage
+    app.dependency_overrides[get_qr_index] = lambda: index
+    if not rate_limit:
+        admission = AdmissionController(rate=0)
+        app.dependency_overrides[get_admission_controller] = lambda: admission
+    engine = get_render_engine()
+    await engine.run(warm_up_worker)
+    try:
+        yield httpx.ASGITransport(app=app)
+    finally:
+        app.dependency_overrides.clear()
+        engine.shutdown(wait=True)
+        storage.close()
+        index.close()
+
+
+@asynccontextmanager
+async def client_options(args: argparse.Namespace, workdir: Path) -> AsyncIterator[dict]:
+    """
+    Yields the options of an httpx client reaching the target of the run.
+    """
+    if args.url:
+        yield {"base_url": args.url}
+    elif args.server:
+        async with started_server(args.server, args.workers, workdir, args.rate_limit) as base_url:
+            yield {"base_url": base_url}
+    else:
+        async with in_process_app(workdir, args.rate_limit) as transport:
+            yield {"base_url": "http://loadtest", "transport": transport}
+
+
+async def run(args: argparse.Namespace, mix: Dict[str, float], workdir: Path) -> Dict[str, dict]:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with client_options(args, workdir) as options:
+        async with httpx.AsyncClient(limits=limits, timeout=args.timeout, **options) as client:
+            token = await client.post("/token", data={"username": args.username, "password": args.password})
+            token.raise_for_status()
+            headers = {"Authorization": f"Bearer {token.json()['access_token']}"}
+            test = LoadTest(client, headers, mix, size=args.size, seed=args.seed)
+
+            async def phase(duration: float):
+                if args.rate:
+                    await test.open_loop(args.rate, duration, args.max_outstanding)
+                else:
+                    await test.closed_loop(args.concurrency, duration)
+
+            if args.warmup:
+                await phase(args.warmup)
+            test.recording = True
+            start = time.perf_counter()
+            await phase(args.duration)
+            return test.report(time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Base URL of a running server (default: the app in this process).")
+    target.add_argument("--server", choices=("uvicorn", "gunicorn"),
+                        help="Start this server for the run: uvicorn, or gunicorn as configured by serve.py.")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of a started server.")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=None, help="Clients sending back to back (default 16).")
+    load.add_argument("--rate", type=float, help="Average requests started per second (open loop).")
+    parser.add_argument("--max-outstanding", type=int, default=1000,
+                        help="With --rate, requests in flight beyond which new ones are dropped.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of measured load.")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of load before measuring.")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help=f"Weights of the operations {', '.join(ENDPOINTS)} (default {DEFAULT_MIX}).")
+    parser.add_argument("--size", type=int, default=5, help="Box size of created and rendered QR codes.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds before a request counts as failed.")
+    parser.add_argument("--rate-limit", action="store_true",
+                        help="Keep the per-user rate limit of in-process and started servers.")
+    parser.add_argument("--seed", type=int, help="Seed of the operation mix and arrival times.")
+    parser.add_argument("--username", default=ADMIN_USER, help="User to get the token for (default ADMIN_USER).")
+    parser.add_argument("--password", default=ADMIN_PASSWORD, help="Its password (default ADMIN_PASSWORD).")
+    parser.add_argument("--output", type=Path, help="Also write the results as JSON to this file ('-' for stdout).")
+    args = parser.parse_args(argv)
+    if args.rate is None and args.concurrency is None:
+        args.concurrency = 16
+    if (args.rate is not None and args.rate <= 0) or (args.concurrency is not None and args.concurrency < 1):
+        parser.error("--rate and --concurrency must be positive.")
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # In process, per-request log lines would otherwise cost as much as the requests.
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        report = asyncio.run(run(args, mix, Path(tmp)))
+
+    print(format_table(report))
+    if report["all"]["dropped"]:
+        print(f"{report['all']['dropped']} request(s) dropped with {args.max_outstanding} in flight")
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "target": args.url or args.server or "in-process",
+        "workers": args.workers if args.server else None,
+        "storage_backend": os.getenv("QR_STORAGE_BACKEND", "filesystem"),
+        "load": {"rate": args.rate} if args.rate else {"concurrency": args.concurrency},
+        "duration": args.duration,
+        "mix": mix,
+        "results": report,
+    }
+    if args.output:
+        text = json.dumps(results, indent=2) + "\n"
+        if str(args.output) == "-":
+            sys.stdout.write(text)
+        else:
+            args.output.write_text(text)
+    return 1 if report["all"]["requests"] == 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Compares qrcode's pure-Python mask search with the NumPy matrix engine for
+every QR version.
+
+Run from the project directory:  python -m benchmarks.mask_scoring [--repeat N]
+"""
+import argparse
+import sys
+import timeit
+import qrcode
+from app.services.matrix_engine import FastMaskQRCode, numpy_available
+
+
+def _prepared(qr_class, version: int):
+    qr = qr_class(version=version, error_correction=qrcode.constants.ERROR_CORRECT_M)
+    qr.add_data("https://qr.io")  # short enough for version 1
+    qr.best_mask_pattern()  # builds data_cache and per-version tables
+    return qr
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="Mask searches timed per version (best is reported).")
+    args = parser.parse_args(argv)
+
+    if not numpy_available():
+        print("NumPy is not installed; nothing to compare.", file=sys.stderr)
+        return 1
+
+    print(f"{'version':>7} {'modules':>7} {'qrcode ms':>10} {'numpy ms':>9} {'speedup':>8}")
+    for version in range(1, 41):
+        reference = _prepared(qrcode.QRCode, version)
+        fast = _prepared(FastMaskQRCode, version)
+        assert reference.best_mask_pattern() == fast.best_mask_pattern()
+
+        reference_time = min(timeit.repeat(reference.best_mask_pattern, number=1, repeat=args.repeat))
+        fast_time = min(timeit.repeat(fast.best_mask_pattern, number=1, repeat=args.repeat))
+        print(f"{version:>7} {version * 4 + 17:>7} {reference_time * 1000:>10.2f} {fast_time * 1000:>9.2f} {reference_time / fast_time:>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+Times the service hot paths offline and compares them with stored baselines.
+
+Run from the project directory:
+
+    python -m benchmarks.suite [--quick] [--output results.json]
+    python -m benchmarks.suite --update-baseline
+
+Each benchmark reports the best time per operation over several repeats. The
+run fails (exit status 1) when any benchmark is slower than its baseline by
+more than the regression threshold. Timings are machine specific, so record
+the baselines (benchmarks/baseline.json and baseline-quick.json) on the
+machine that runs the gate and commit them from there.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Tuple
+from httpx import AsyncClient
+from main import app
+from app.services.admission import AdmissionController, get_admission_controller
+from app.services.qr_index import QRIndex, get_qr_index
+from app.services.qr_service import rasterize_matrix, render_qr_code_timed, store_qr_code
+from app.services.render_engine import get_render_engine, warm_up_worker
+from app.services.storage import FileSystemStorage, get_storage
+from app.utils.common import (MATRIX_SUFFIX, create_access_token, decode_filename_to_url, encode_url_to_filename,
+                              hash_url_to_qr_id, verify_token)
+from app.utils.token_cache import TokenCache
+
+BENCHMARK_DIRECTORY = Path(__file__).resolve().parent
+# Quick runs use smaller workloads, so they are compared with their own baseline.
+BASELINES = {False: BENCHMARK_DIRECTORY / "baseline.json", True: BENCHMARK_DIRECTORY / "baseline-quick.json"}
+DEFAULT_THRESHOLD = 0.5
+
+
+class Benchmark(NamedTuple):
+    name: str
+    # Builds the fixtures of the benchmark, only once it is selected, and
+    # returns a function running the operation ``number`` times and returning
+    # the elapsed seconds.
+    setup: Callable[[], Callable[[int], float]]
+    number: int
+
+
+def _timed(func: Callable[[], object]) -> Callable[[int], float]:
+    def run(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - start
+    return run
+
+
+def _url(length: int, salt: str = "") -> str:
+    base = f"https://example.com/{salt}"
+    return base + "x" * max(length - len(base), 0)
+
+
+def _qr_code_benchmarks(workdir: Path, quick: bool) -> List[Benchmark]:
+    benchmarks = []
+    # URL lengths chosen to land on small, medium and large QR versions.
+    for length in (20, 200, 1000):
+        # What creating a QR code does: encode its matrix and store it, under a
+        # new ID each time (sharded layout, as long URLs make base64 names too long).
+        def store(length=length):
+            storage = FileSystemStorage(workdir / f"store-{length}", fsync=False)
+            counter = iter(range(10 ** 9))
+
+            def encode_and_store():
+                url = _url(length, f"{next(counter)}/")
+                matrix = render_qr_code_timed(url, output_format="bin")[0]
+                store_qr_code(storage, f"{hash_url_to_qr_id(url)}.png", matrix, url=url)
+            return _timed(encode_and_store)
+        benchmarks.append(Benchmark(f"store_qr_code[url={length}]", store, number=5 if quick or length == 1000 else 20))
+
+        # Variants drawn from the stored matrix, skipping the encoding.
+        def rasterize(length=length):
+            packed = render_qr_code_timed(_url(length), output_format="bin")[0]
+            return _timed(lambda: rasterize_matrix(packed, "png", 10))
+        benchmarks.append(Benchmark(f"rasterize_matrix[url={length},size=10]", rasterize, number=20 if quick else 100))
+    return benchmarks
+
+
+def _codec_benchmarks() -> List[Benchmark]:
+    url = _url(200)
+    encoded = encode_url_to_filename(url)
+    return [
+        Benchmark("encode_url_to_filename", lambda: _timed(lambda: encode_url_to_filename(url)), number=20000),
+        Benchmark("decode_filename_to_url", lambda: _timed(lambda: decode_filename_to_url(encoded)), number=20000),
+    ]
+
+
+def _auth_benchmarks() -> List[Benchmark]:
+    token = create_access_token({"sub": "bench"})
+    uncached, cached = TokenCache(ttl=0), TokenCache()
+    return [
+        Benchmark("create_access_token", lambda: _timed(lambda: create_access_token({"sub": "bench"})), number=3000),
+        Benchmark("verify_token[uncached]", lambda: _timed(lambda: verify_token(token, uncached)), number=3000),
+        Benchmark("verify_token[cached]", lambda: _timed(lambda: verify_token(token, cached)), number=50000),
+    ]
+
+
+def _listing_benchmarks(workdir: Path, quick: bool) -> List[Benchmark]:
+    @functools.lru_cache(maxsize=None)
+    def fixture(count: int) -> Tuple[FileSystemStorage, QRIndex]:
+        directory = workdir / f"listing-{count}"
+        directory.mkdir()
+        index = QRIndex(workdir / f"listing-{count}.sqlite")
+        for i in range(count):
+            url = f"https://example.com/listing/{i}"
+            qr_id = encode_url_to_filename(url)
+            (directory / f"{qr_id}{MATRIX_SUFFIX}").write_bytes(b"\0")
+            index.add(f"{qr_id}.png", url, 10, created_at=float(i))
+        return FileSystemStorage(directory, fsync=False), index
+
+    benchmarks = []
+    for count in ((1000,) if quick else (1000, 100000)):
+        # Listing the storage walks the whole directory tree; requests list from the index.
+        benchmarks.append(Benchmark(f"storage.list[files={count},limit=100]",
+                                    lambda count=count: _timed(functools.partial(fixture(count)[0].list, 100)),
+                                    number=20 if count < 100000 else 3))
+        benchmarks.append(Benchmark(f"qr_index.page[files={count},limit=100]",
+                                    lambda count=count: _timed(functools.partial(fixture(count)[1].page, 100)),
+                                    number=1000))
+    return benchmarks
+
+
+def _request_benchmarks(workdir: Path, loop: asyncio.AbstractEventLoop, quick: bool) -> List[Benchmark]:
+    counter = iter(range(10 ** 9))
+
+    @functools.lru_cache(maxsize=None)
+    def client() -> Tuple[AsyncClient, dict]:
+        directory = workdir / "requests"
+        directory.mkdir()
+        index = QRIndex(workdir / "requests.sqlite")
+        # A full first page for the list benchmark, however many codes are created.
+        for i in range(100):
+            url = f"https://example.com/indexed/{i}"
+            index.add(f"{encode_url_to_filename(url)}.png", url, 5, created_at=float(i))
+        storage = FileSystemStorage(directory)
+        app.dependency_overrides[get_storage] = lambda: storage
+        app.dependency_overrides[get_qr_index] = lambda: index
+        # Requests are issued back to back; keep the capacity check but not the rate limit.
+        admission = AdmissionController(rate=0)
+        app.dependency_overrides[get_admission_controller] = lambda: admission
+        loop.run_until_complete(get_render_engine().run(warm_up_worker))
+        token = create_access_token({"sub": "bench"})
+        return AsyncClient(app=app, base_url="http://bench"), {"Authorization": f"Bearer {token}"}
+
+    async def create() -> str:
+        ac, headers = client()
+        response = await ac.post("/qr-codes/", json={"url": _url(40, f"{next(counter)}/"), "size": 5}, headers=headers)
+        assert response.status_code == 201, response.text
+        return response.json()["qr_code_url"].rsplit("/", 1)[-1]
+
+    async def listing():
+        ac, headers = client()
+        response = await ac.get("/qr-codes/", params={"limit": 100}, headers=headers)
+        assert response.status_code == 200, response.text
+
+    def repeated(func):
+        async def repeat(number: int) -> float:
+            start = time.perf_counter()
+            for _ in range(number):
+                await func()
+            return time.perf_counter() - start
+        return repeat
+
+    def on_loop(timed):
+        client()  # set up outside the event loop, as it warms up the render engine on it
+        return lambda number: loop.run_until_complete(timed(number))
+
+    async def delete(number: int) -> float:
+        # Each run deletes QR codes of its own, created before the clock starts.
+        ac, headers = client()
+        filenames = [await create() for _ in range(number)]
+        start = time.perf_counter()
+        for filename in filenames:
+            response = await ac.delete(f"/qr-codes/{filename}", headers=headers)
+            assert response.status_code == 204, response.text
+        return time.perf_counter() - start
+
+    number = 20 if quick else 100
+    return [
+        Benchmark("POST /qr-codes/", lambda: on_loop(repeated(create)), number=number),
+        Benchmark("GET /qr-codes/", lambda: on_loop(repeated(listing)), number=number),
+        Benchmark("DELETE /qr-codes/{filename}", lambda: on_loop(delete), number=number),
+    ]
+
+
+def run_benchmarks(benchmarks: List[Benchmark], repeat: int) -> Dict[str, dict]:
+    results = {}
+    for benchmark in benchmarks:
+        run = benchmark.setup()
+        run(1)  # warm up caches and lazily initialised state
+        seconds = min(run(benchmark.number) for _ in range(repeat)) / benchmark.number
+        results[benchmark.name] = {"seconds_per_op": seconds, "ops_per_second": 1 / seconds if seconds else None}
+        print(f"{benchmark.name:<45} {seconds * 1e6:>12.1f} us/op", flush=True)
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    """
+    Returns a description of every benchmark slower than its baseline by more
+    than ``threshold`` (a fraction, 0.5 meaning 50%).
+    """
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        ratio = result["seconds_per_op"] / reference["seconds_per_op"]
+        if ratio > 1 + threshold:
+            regressions.append(f"{name}: {ratio:.2f}x the baseline time")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs and fewer iterations (skips 100k files).")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeats per benchmark; the best is reported.")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this text.")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", type=Path,
+                        help="Baseline JSON file to compare against (default benchmarks/baseline[-quick].json).")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("BENCHMARK_THRESHOLD", DEFAULT_THRESHOLD)),
+                        help="Allowed slowdown over the baseline as a fraction (default 0.5, or $BENCHMARK_THRESHOLD).")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline.")
+    args = parser.parse_args(argv)
+    args.baseline = args.baseline or BASELINES[args.quick]
+
+    # Logging would otherwise dominate the cheaper benchmarks.
+    logging.disable(logging.INFO)
+    loop = asyncio.new_event_loop()
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        benchmarks = (_qr_code_benchmarks(workdir, args.quick) + _codec_benchmarks() + _auth_benchmarks()
+                      + _listing_benchmarks(workdir, args.quick) + _request_benchmarks(workdir, loop, args.quick))
+        benchmarks = [benchmark for benchmark in benchmarks if args.filter in benchmark.name]
+        try:
+            results = run_benchmarks(benchmarks, args.repeat)
+        finally:
+            app.dependency_overrides.clear()
+            get_render_engine().shutdown(wait=True)
+            loop.close()
+
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2) + "\n")
+    if args.update_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {"results": {}}
+        baseline.update({key: value for key, value in report.items() if key != "results"})
+        baseline["results"].update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return 0
+    regressions = compare(results, json.loads(args.baseline.read_text())["results"], args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,56 @@
-from fastapi import FastAPI
-from dotenv import load_dotenv
-from app.config import QR_DIRECTORY
-from app.routers import qr_code, oauth
+import logging
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Response
+from starlette.concurrency import run_in_threadpool
+from app.config import LOG_INFO_SAMPLE_RATE, QR_DIRECTORY, QR_STORAGE_BACKEND, SERVER_DOWNLOAD_FOLDER
+from app.routers import downloads, qr_code, oauth
+from app.services.admission import AdmissionController, get_admission_controller
+from app.services.expiry import ExpirySweeper
+from app.services.jobs import get_job_runner
+from app.services.qr_index import QRIndex, get_qr_index
 from app.services.qr_service import create_directory
+from app.services.render_cache import RenderCache, get_render_cache
+from app.services.render_engine import RenderEngine, get_render_engine, warm_up_worker
+from app.services.service_metrics import DirectoryStats, get_directory_stats, render_metrics
+from app.services.storage import get_storage
 from app.utils.common import setup_logging
+from app.utils.log_pipeline import LogSamplingMiddleware
+from app.utils.metrics import CONTENT_TYPE, MetricsMiddleware, record_startup
+from app.utils.token_cache import TokenCache, get_token_cache
 
-# Load environment variables
-load_dotenv()
-
-# Set up logging
+# Set up logging (environment variables are loaded by app.config)
 setup_logging()
 
 # Ensure QR code directory exists
-create_directory(QR_DIRECTORY)
+if QR_STORAGE_BACKEND == "filesystem":
+    create_directory(QR_DIRECTORY)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the render workers up front so their warmup happens before traffic
+    engine = get_render_engine()
+    await engine.run(warm_up_worker)
+    logging.info("Worker ready %.2f s after start", record_startup("worker"))
+    index = await get_qr_index()
+    sweeper = ExpirySweeper(index, get_storage())
+    sweeper.start()
+    jobs = get_job_runner()
+    jobs.start(qr_code.job_handler(engine, get_render_cache(), index, get_storage(),
+                                   get_admission_controller()))
+    yield
+    # Jobs being rendered go back to the queue for the next start.
+    await jobs.stop()
+    await sweeper.stop()
+    # Commit writes still queued in the storage backend.
+    get_storage().close()
+    # The server has stopped taking requests; let accepted renders finish.
+    engine.shutdown(wait=True, drain=True)
+
 
 # Create FastAPI app
 app = FastAPI(
+    lifespan=lifespan,
     title="QR Code Manager",
     description="An API for creating, listing, and deleting QR codes with secure access.",
     version="1.0.0",
@@ -31,11 +66,31 @@ app = FastAPI(
     },
 )
 
+# Sample INFO-level request logging
+app.add_middleware(LogSamplingMiddleware, rate=LOG_INFO_SAMPLE_RATE)
+
+# Request latency, status and in-flight metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(qr_code.router, prefix="/qr-codes", tags=["QR Code Management"])
 app.include_router(oauth.router, prefix="", tags=["Authentication"])  # Includes /token at root
+app.include_router(downloads.router, prefix=f"/{SERVER_DOWNLOAD_FOLDER}", tags=["QR Code Downloads"])
 
 # Health check endpoint
 @app.get("/", tags=["Health"])
 def health_check():
     return {"status": "ok", "message": "API is running"}
+
+# Prometheus metrics endpoint
+@app.get("/metrics", tags=["Health"], response_class=Response)
+async def metrics(
+    engine: RenderEngine = Depends(get_render_engine),
+    cache: RenderCache = Depends(get_render_cache),
+    token_cache: TokenCache = Depends(get_token_cache),
+    index: QRIndex = Depends(get_qr_index),
+    directory_stats: DirectoryStats = Depends(get_directory_stats),
+    admission: AdmissionController = Depends(get_admission_controller),
+):
+    body = await run_in_threadpool(render_metrics, engine, cache, token_cache, index, directory_stats, admission)
+    return Response(content=body, media_type=CONTENT_TYPE)
@@ -0,0 +1,75 @@
+"""
+Production server: gunicorn with uvicorn workers.
+
+Run from the project directory:
+
+    python serve.py
+
+The application is imported (and, with SERVER_WARMUP, one QR code of every
+version rendered) once in the master process before the workers are forked,
+so they share the loaded code and lookup tables copy-on-write and start
+serving without a cold start. Workers are replaced after SERVER_MAX_REQUESTS
+requests to bound memory growth, and on shutdown finish their in-flight
+requests and renders within SERVER_GRACEFUL_TIMEOUT seconds. Startup times
+are logged and exported as qr_startup_duration_seconds.
+"""
+import logging
+import os
+from gunicorn.app.base import BaseApplication
+from app.config import (FORWARDED_ALLOW_IPS, SERVER_GRACEFUL_TIMEOUT, SERVER_HOST, SERVER_MAX_REQUESTS,
+                        SERVER_MAX_REQUESTS_JITTER, SERVER_PORT, SERVER_WARMUP, SERVER_WORKERS)
+from app.services.render_engine import RenderEngine, set_render_engine
+from app.utils.metrics import mark_process_start, record_startup
+
+
+def post_fork(server, worker):
+    mark_process_start()
+
+
+class Server(BaseApplication):
+    """
+    Gunicorn application serving ``main:app`` with the options from app.config.
+    """
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from main import app
+        from app.services.qr_service import warm_up_versions
+
+        if "RENDER_WORKERS" not in os.environ:
+            # Share the CPUs between the render engines of all workers.
+            set_render_engine(RenderEngine(workers=max((os.cpu_count() or 1) // SERVER_WORKERS, 1)))
+        if SERVER_WARMUP:
+            logging.info("Warmed up %s QR code versions", warm_up_versions())
+        logging.info("Application loaded %.2f s after start", record_startup("preload"))
+        return app
+
+
+def options() -> dict:
+    return {
+        "bind": f"{SERVER_HOST}:{SERVER_PORT}",
+        "workers": SERVER_WORKERS,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "max_requests": SERVER_MAX_REQUESTS,
+        "max_requests_jitter": SERVER_MAX_REQUESTS_JITTER,
+        "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+        # Client addresses behind the proxy, for per-client rate limits.
+        "forwarded_allow_ips": FORWARDED_ALLOW_IPS,
+        "post_fork": post_fork,
+    }
+
+
+def main():
+    Server(options()).run()
+
+
+if __name__ == "__main__":
+    main()
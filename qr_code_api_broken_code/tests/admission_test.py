@@ -0,0 +1,81 @@
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.services.admission import (AdmissionController, InMemoryAdmissionBackend, OverCapacity, RateLimited,
+                                    estimate_cost)
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+def test_token_bucket_per_subject():
+    controller = AdmissionController(rate=0.5, burst=2, capacity=0)
+    controller.check_rate("user:a")
+    controller.check_rate("user:a")
+    with pytest.raises(RateLimited) as rejected:
+        controller.check_rate("user:a")
+    assert rejected.value.retry_after == 2
+    controller.check_rate("user:b")
+    assert controller.rate_limited == 1
+
+
+def test_buckets_are_bounded_by_recent_use():
+    backend = InMemoryAdmissionBackend(max_subjects=2)
+    backend.take_token("user:a", 0.001, 1)
+    backend.take_token("user:b", 0.001, 1)
+    assert backend.take_token("user:a", 0.001, 1) > 0
+    # Active subjects over the cap evict the least recently used bucket.
+    backend.take_token("user:c", 0.001, 1)
+    assert list(backend._buckets) == ["user:a", "user:c"]
+    assert backend.take_token("user:a", 0.001, 1) > 0
+
+
+def test_weighted_capacity():
+    controller = AdmissionController(rate=0, capacity=100)
+    with controller.reserve(60):
+        with pytest.raises(OverCapacity):
+            with controller.reserve(60):
+                pass
+        with controller.reserve(40):
+            assert controller.backend.in_flight() == 100
+    # A render costlier than the whole capacity still runs on its own.
+    with controller.reserve(1000):
+        pass
+    assert controller.backend.in_flight() == 0
+    assert controller.over_capacity == 1
+
+
+def test_cost_grows_with_version_and_box_size():
+    short, long = "https://example.com", "https://example.com/" + "x" * 1000
+    assert estimate_cost(short, 1) < estimate_cost(short, 10) < estimate_cost(long, 10)
+    assert estimate_cost(long, 40, "bin") == estimate_cost(long, 1, "png")
+    assert estimate_cost("https://example.com/" + "x" * 5000, 2) == 80
+
+
+@pytest.mark.asyncio
+async def test_requests_over_the_limits_are_rejected(isolated_storage, admission):
+    admission.rate, admission.burst = 0.5, 2
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        statuses = []
+        for i in range(3):
+            response = await ac.post("/qr-codes/", json={"url": f"https://example.com/limited/{i}", "size": 1},
+                                     headers=headers)
+            statuses.append(response.status_code)
+        assert statuses == [201, 201, 429]
+        assert response.headers["retry-after"] == "2"
+
+        # With the capacity in use, renders are turned away instead of queued.
+        admission.rate = 0
+        with admission.reserve(admission.capacity):
+            busy = await ac.get("/qr-codes/render.png", params={"url": "https://example.com/busy"})
+        assert busy.status_code == 503
+        assert "retry-after" in busy.headers
+        rendered = await ac.get("/qr-codes/render.png", params={"url": "https://example.com/busy"})
+        assert rendered.status_code == 200
+
+        metrics = (await ac.get("/metrics")).text
+    assert "qr_admission_rate_limited_total 1" in metrics
+    assert "qr_admission_over_capacity_total 1" in metrics
@@ -0,0 +1,54 @@
+import json
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+def _results(response):
+    return sorted((json.loads(line) for line in response.text.splitlines()), key=lambda result: result["index"])
+
+
+@pytest.mark.asyncio
+async def test_batch_json_array(isolated_storage):
+    items = [
+        {"url": "https://example.com/batch/1", "size": 2},
+        {"url": "not a url"},
+        {"url": "https://example.com/batch/2", "size": 2},
+    ]
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/qr-codes/batch", json=items, headers=await _auth_headers(ac))
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = _results(response)
+    assert [result["status"] for result in results] == [201, 422, 201]
+    assert results[0]["url"] == items[0]["url"]
+    assert results[2]["qr_code_url"].endswith(".png?size=2")
+    assert len(list(isolated_storage.rglob("*.qrm"))) == 2
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/qr-codes/batch", json=items[:1], headers=await _auth_headers(ac))
+    assert _results(response)[0]["status"] == 409
+
+
+@pytest.mark.asyncio
+async def test_batch_ndjson_and_malformed_body(isolated_storage):
+    body = "\n".join(json.dumps({"url": f"https://example.com/ndjson/{i}", "size": 1}) for i in range(5)) + "\n{oops\n"
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/qr-codes/batch", content=body, headers={
+            **await _auth_headers(ac), "Content-Type": "application/x-ndjson"})
+
+    results = _results(response)
+    assert [result["status"] for result in results] == [201] * 5 + [400]
+
+
+@pytest.mark.asyncio
+async def test_batch_requires_authentication():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.post("/qr-codes/batch", json=[{"url": "https://example.com"}])
+    assert response.status_code == 401
@@ -13,3 +13,35 @@ async def get_access_token_for_test(client):
     form_data = {"username": "admin", "password": "secret"}
     response = await client.post("/token", data=form_data)
     return response.json()["access_token"]
+
+@pytest.fixture
+def isolated_storage(tmp_path):
+    """
+    Points the QR code router at an empty temporary directory and index.
+    """
+    from app.services.qr_index import QRIndex, get_qr_index
+    from app.services.storage import FileSystemStorage, get_storage
+
+    directory = tmp_path / "qr_codes"
+    directory.mkdir()
+    index = QRIndex(tmp_path / "index.sqlite")
+    storage = FileSystemStorage(directory, fsync=False)
+    app.dependency_overrides[get_qr_index] = lambda: index
+    app.dependency_overrides[get_storage] = lambda: storage
+    yield directory
+    app.dependency_overrides.pop(get_qr_index, None)
+    app.dependency_overrides.pop(get_storage, None)
+    index.close()
+
+@pytest.fixture(autouse=True)
+def admission():
+    """
+    Gives every test its own admission controller, so that rate limits do not
+    carry over between tests.
+    """
+    from app.services.admission import AdmissionController, get_admission_controller
+
+    controller = AdmissionController()
+    app.dependency_overrides[get_admission_controller] = lambda: controller
+    yield controller
+    app.dependency_overrides.pop(get_admission_controller, None)
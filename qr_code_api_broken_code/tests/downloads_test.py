@@ -0,0 +1,98 @@
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.routers import downloads, qr_code
+from app.services.downloads import content_version, sign_download, verify_download
+from app.services.qr_service import render_qr_code_timed
+from app.services.storage import SQLiteBlobStorage, get_storage
+
+URL = "https://example.com/downloads"
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+def test_signatures_bind_key_and_expiry():
+    params = sign_download("ab/cd/one.png", ttl=60, now=1000)
+    assert params["expires"] == "1060"
+    assert verify_download("ab/cd/one.png", 1060, params["signature"], now=1059)
+    assert not verify_download("ab/cd/one.png", 1060, params["signature"], now=1061)
+    assert not verify_download("ab/cd/two.png", 1060, params["signature"], now=1000)
+    assert not verify_download("ab/cd/one.png", 2000, params["signature"], now=1000)
+    assert not verify_download("ab/cd/one.png", 1060, "é", now=1000)
+
+
+@pytest.fixture
+def stored_images(isolated_storage, monkeypatch):
+    monkeypatch.setattr(qr_code, "QR_STORE_IMAGES", True)
+    return isolated_storage
+
+
+@pytest.mark.asyncio
+async def test_versioned_download_with_token_or_signed_url(stored_images):
+    image = render_qr_code_timed(URL, "red", "white", 3)[0]
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        created = await ac.post("/qr-codes/", json={"url": URL, "size": 3}, headers=headers)
+        qr_code_url = created.json()["qr_code_url"]
+        assert qr_code_url.endswith(f"?v={content_version(image)}")
+        path = qr_code_url.split("/", 3)[-1]
+
+        anonymous = await ac.get(path)
+        versioned = await ac.get(path, headers=headers)
+        unversioned = await ac.get(path.split("?")[0], headers=headers)
+        revalidated = await ac.get(path, headers={**headers, "If-None-Match": versioned.headers["etag"]})
+
+        qr_id = path.split("/")[-1].split(".")[0]
+        signed = (await ac.get(f"/qr-codes/{qr_id}/download-url", headers=headers)).json()
+        by_signature = await ac.get(signed["url"].split("/", 3)[-1])
+        tampered = await ac.get(signed["url"].split("/", 3)[-1].replace("signature=", "signature=x"))
+        non_ascii = await ac.get(signed["url"].split("/", 3)[-1].split("&signature=")[0], params={"signature": "é"})
+        traversal = await ac.get("/downloads/..%2F..%2Fmain.py", headers=headers)
+
+        await ac.delete(f"/qr-codes/{qr_id}.png", headers=headers)
+        deleted = await ac.get(path, headers=headers)
+        no_url = await ac.get(f"/qr-codes/{qr_id}/download-url", headers=headers)
+
+    assert anonymous.status_code == 401
+    assert versioned.status_code == 200 and versioned.content == image
+    assert versioned.headers["content-type"] == "image/png"
+    assert versioned.headers["cache-control"] == "private, max-age=31536000, immutable"
+    assert unversioned.headers["cache-control"] == "private, no-cache"
+    assert revalidated.status_code == 304
+    assert by_signature.status_code == 200 and by_signature.content == image
+    assert tampered.status_code == non_ascii.status_code == 403
+    assert traversal.status_code == 404
+    assert deleted.status_code == 404
+    assert no_url.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_download_is_handed_to_nginx(stored_images, monkeypatch):
+    monkeypatch.setattr(downloads, "DOWNLOAD_ACCEL_REDIRECT", "/protected-downloads/")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        created = await ac.post("/qr-codes/", json={"url": URL, "size": 3}, headers=headers)
+        path = created.json()["qr_code_url"].split("/", 3)[-1]
+        response = await ac.get(path, headers=headers)
+
+    filename = path.split("?")[0].split("/")[-1]
+    assert response.headers["x-accel-redirect"] == f"/protected-downloads/{filename}"
+    assert response.content == b""
+
+
+@pytest.mark.asyncio
+async def test_download_streams_from_blob_store(stored_images, tmp_path):
+    blobs = SQLiteBlobStorage(tmp_path / "blobs.sqlite")
+    app.dependency_overrides[get_storage] = lambda: blobs
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        created = await ac.post("/qr-codes/", json={"url": URL, "size": 3}, headers=headers)
+        response = await ac.get(created.json()["qr_code_url"].split("/", 3)[-1], headers=headers)
+    blobs.close()
+
+    assert response.status_code == 200
+    assert response.content == render_qr_code_timed(URL, "red", "white", 3)[0]
+    assert "x-accel-redirect" not in response.headers
@@ -0,0 +1,114 @@
+import asyncio
+import sqlite3
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.services.expiry import ExpirySweeper
+from app.services.qr_index import QRIndex, get_qr_index
+from app.services.storage import FileSystemStorage
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+def test_expiry_order_and_schema_upgrade(tmp_path):
+    path = tmp_path / "index.sqlite"
+    conn = sqlite3.connect(str(path))
+    conn.execute("CREATE TABLE qr_codes (filename TEXT PRIMARY KEY, url TEXT, size INTEGER, created_at REAL NOT NULL)")
+    conn.execute("INSERT INTO qr_codes VALUES ('old.png', 'https://example.com/old', 1, 1.0)")
+    conn.commit()
+    conn.close()
+
+    index = QRIndex(path)
+    index.add("late.png", "https://example.com/late", 1, expires_at=300.0)
+    index.add("early.png", "https://example.com/early", 1, expires_at=100.0)
+    assert index.expired(10, now=50.0) == []
+    assert index.expired(10, now=1000.0) == ["early.png", "late.png"]
+    assert index.expired(1, now=1000.0) == ["early.png"]
+    assert index.is_expired("early.png", now=1000.0) and not index.is_expired("early.png", now=50.0)
+    assert not index.is_expired("old.png", now=1000.0)
+    # Expired entries are no longer listed; the others are.
+    assert [entry.filename for entry in index.page(10)[0]] == ["old.png"]
+    assert index.remove_many(["early.png", "late.png", "missing.png"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_sweeper_deletes_expired_codes(isolated_storage):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        for i in range(5):
+            await ac.post("/qr-codes/", json={"url": f"https://example.com/ttl/{i}", "size": 1, "ttl": 60},
+                          headers=headers)
+        await ac.post("/qr-codes/", json={"url": "https://example.com/kept", "size": 1}, headers=headers)
+
+    index = app.dependency_overrides[get_qr_index]()
+    sweeper = ExpirySweeper(index, FileSystemStorage(isolated_storage), batch_size=2)
+    assert sweeper.sweep_batch() == 0
+    future = index.expired(10, now=float("inf"))
+    assert len(future) == 5
+    assert [sweeper.sweep_batch(now=float("inf")) for _ in range(4)] == [2, 2, 1, 0]
+    assert sweeper.deleted == 5
+    assert index.count() == 1
+    assert len(list(isolated_storage.rglob("*.qrm"))) == 1
+
+    # The background task works off a backlog without waiting for the interval.
+    index.add("gone.png", "https://example.com/gone", 1, expires_at=0.0)
+    sweeper = ExpirySweeper(index, FileSystemStorage(isolated_storage), interval=3600, batch_size=1, rate=1000)
+    sweeper.start()
+    for _ in range(100):
+        if index.expired(10) == []:
+            break
+        await asyncio.sleep(0.01)
+    await sweeper.stop()
+    assert index.expired(10) == []
+
+
+@pytest.mark.asyncio
+async def test_bulk_delete_by_filenames_and_prefix(isolated_storage):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        filenames = []
+        for campaign in ("spring", "autumn"):
+            for i in range(3):
+                response = await ac.post("/qr-codes/", json={"url": f"https://example.com/{campaign}/{i}", "size": 1},
+                                         headers=headers)
+                filenames.append(response.json()["qr_code_url"].split("/")[-1].split(".")[0] + ".png")
+
+        by_name = await ac.post("/qr-codes/bulk-delete", json={"filenames": [filenames[0], "bm90LXN0b3JlZA.png"]},
+                                headers=headers)
+        by_prefix = await ac.post("/qr-codes/bulk-delete", json={"prefix": "https://example.com/autumn/"},
+                                  headers=headers)
+        remaining = await ac.get("/qr-codes/", headers=headers)
+        both = await ac.post("/qr-codes/bulk-delete", json={"filenames": [], "prefix": "https://"}, headers=headers)
+        traversal = await ac.post("/qr-codes/bulk-delete", json={"filenames": ["../secret.png"]}, headers=headers)
+        unauthenticated = await ac.post("/qr-codes/bulk-delete", json={"prefix": "https://"})
+
+    assert by_name.json() == {"deleted": 1, "not_found": ["bm90LXN0b3JlZA.png"]}
+    assert by_prefix.json() == {"deleted": 3, "not_found": []}
+    assert len(remaining.json()) == 2
+    assert len(list(isolated_storage.rglob("*.qrm"))) == 2
+    assert both.status_code == traversal.status_code == 422
+    assert unauthenticated.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_stored_codes_are_revalidated_and_gone_once_expired(isolated_storage):
+    url = "https://example.com/ttl/read"
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        created = await ac.post("/qr-codes/", json={"url": url, "size": 1, "ttl": 60}, headers=headers)
+        qr_id = created.json()["qr_code_url"].split("/")[-1].split(".")[0]
+        stored = await ac.get(f"/qr-codes/{qr_id}.png", headers=headers)
+        revalidated = await ac.get(f"/qr-codes/{qr_id}.png", headers={**headers, "If-None-Match": stored.headers["etag"]})
+
+        # Expired but not swept yet.
+        app.dependency_overrides[get_qr_index]().add(f"{qr_id}.png", url, 1, expires_at=0.0)
+        expired = await ac.get(f"/qr-codes/{qr_id}.png", headers=headers)
+        negotiated = await ac.get(f"/qr-codes/{qr_id}", headers=headers)
+
+    assert stored.status_code == 200
+    assert stored.headers["cache-control"] == "private, no-cache"
+    assert revalidated.status_code == 304
+    assert expired.status_code == negotiated.status_code == 404
@@ -0,0 +1,100 @@
+import base64
+import json
+import pytest
+import qrcode
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.services.qr_formats import matrix_json, negotiate_format, pack_matrix, unpack_matrix
+from app.services.qr_service import render_qr_code_timed
+from app.utils.common import encode_url_to_filename
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+def test_negotiate_format():
+    assert negotiate_format(None) == "png"
+    assert negotiate_format("*/*") == "png"
+    assert negotiate_format("image/svg+xml") == "svg"
+    assert negotiate_format("image/png;q=0.5, image/svg+xml;q=0.9") == "svg"
+    assert negotiate_format("text/html, application/json;q=0.8") == "json"
+    assert negotiate_format("application/octet-stream") == "bin"
+    assert negotiate_format("text/html") is None
+    assert negotiate_format("image/svg+xml;q=0") is None
+
+
+def test_packed_matrix_round_trip():
+    qr = qrcode.QRCode(border=4)
+    qr.add_data("https://example.com/matrix")
+    qr.make(fit=True)
+    packed = pack_matrix(qr.modules, qr.version, qr.border, "M", 3)
+    matrix = unpack_matrix(packed)
+    assert matrix.modules == qr.modules
+    assert (matrix.version, matrix.border, matrix.error_correction, matrix.mask_pattern) == (qr.version, 4, "M", 3)
+    assert len(packed) == 11 + qr.modules_count * ((qr.modules_count + 7) // 8)
+
+    document = json.loads(matrix_json(packed))
+    assert (document["modules"], document["mask_pattern"]) == (qr.modules_count, 3)
+    assert base64.b64decode(document["data"]) == packed[11:]
+
+    with pytest.raises(ValueError):
+        unpack_matrix(packed[:-1])
+
+
+def test_svg_is_a_single_colored_path():
+    svg, _, _ = render_qr_code_timed("https://example.com", fill_color="#ff0000", back_color="#ffffff",
+                                     size=40, output_format="svg")
+    assert svg.count(b"<path") == 1
+    assert b'fill="#ff0000"' in svg
+    assert b'viewBox="0 0 140 140"' in svg
+
+    png, _, _ = render_qr_code_timed("https://example.com", size=40)
+    matrix, _, _ = render_qr_code_timed("https://example.com", size=40, output_format="bin")
+    assert len(matrix) < len(png) / 10
+
+
+@pytest.mark.asyncio
+async def test_read_paths_negotiate_representations():
+    qr_id = encode_url_to_filename("https://example.com/formats")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        svg = await ac.get(f"/qr-codes/{qr_id}.svg", params={"size": 2}, headers=headers)
+        assert svg.headers["content-type"] == "image/svg+xml"
+
+        by_accept = await ac.get(f"/qr-codes/{qr_id}", headers={**headers, "Accept": "application/json"})
+        assert by_accept.headers["content-type"] == "application/vnd.qrcode.matrix+json"
+        assert by_accept.headers["vary"] == "Accept"
+        assert by_accept.json()["border"] == 5
+
+        binary = await ac.get("/qr-codes/render", params={"url": "https://example.com/formats", "format": "bin"})
+        assert binary.headers["content-type"] == "application/vnd.qrcode.matrix"
+        assert unpack_matrix(binary.content).version >= 1
+        # Matrix representations ignore size, so they share one ETag.
+        other_size = await ac.get(f"/qr-codes/{qr_id}.bin", params={"size": 7}, headers=headers)
+        assert other_size.headers["etag"] == binary.headers["etag"]
+        assert other_size.headers["etag"] != (await ac.get(f"/qr-codes/{qr_id}.json", headers=headers)).headers["etag"]
+
+        not_acceptable = await ac.get(f"/qr-codes/{qr_id}", headers={**headers, "Accept": "text/html"})
+        assert not_acceptable.status_code == 406
+        unknown = await ac.get(f"/qr-codes/{qr_id}.gif", headers=headers)
+        assert unknown.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_create_advertises_representations(isolated_storage):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+        response = await ac.post("/qr-codes/", json={"url": "https://example.com/svg", "size": 3, "format": "svg"},
+                                 headers=headers)
+    assert response.status_code == 201
+    body = response.json()
+    qr_id = encode_url_to_filename("https://example.com/svg")
+    assert body["qr_code_url"].endswith(f"/qr-codes/{qr_id}.svg?size=3")
+    alternates = {link["type"]: link["href"] for link in body["links"] if link["rel"] == "alternate"}
+    assert set(alternates) == {"image/png", "image/svg+xml", "application/vnd.qrcode.matrix",
+                               "application/vnd.qrcode.matrix+json"}
+    assert alternates["application/vnd.qrcode.matrix"].endswith(f"/qr-codes/{qr_id}.bin")
+    assert [path.suffix for path in isolated_storage.iterdir()] == [".qrm"]
@@ -0,0 +1,134 @@
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.routers.qr_code import job_handler
+from app.services.jobs import Job, JobFailed, JobQueue, JobRunner, get_job_runner
+from app.services.qr_index import get_qr_index
+from app.services.render_cache import get_render_cache
+from app.services.render_engine import get_render_engine
+from app.services.storage import get_storage
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+def test_queue_order_leases_and_restarts(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite", lease=10, max_attempts=2)
+    low = queue.submit("alice", {"url": "https://example.com/low"})
+    high = queue.submit("alice", {"url": "https://example.com/high"}, priority=5)
+    later = queue.submit("bob", {"url": "https://example.com/later"}, priority=5)
+    queue.close()
+
+    # Queued jobs survive a restart and are taken by priority, then age.
+    queue = JobQueue(tmp_path / "jobs.sqlite", lease=10, max_attempts=2)
+    assert [queue.take(now=1000.0).id for _ in range(3)] == [high.id, later.id, low.id]
+    assert queue.take(now=1000.0) is None
+    assert queue.finish(high.id, 1, result={"qr_code_url": "https://example.com/qr.png"})
+    assert queue.release(later.id, 1)
+
+    # The lease of a job whose worker died lapses; it is retried until out of attempts.
+    retried = queue.take(now=1000.0)
+    assert retried.id == later.id and retried.attempts == 1
+    assert [queue.take(now=1011.0).attempts for _ in range(2)] == [2, 2]
+    assert queue.take(now=1022.0) is None
+    for job in (later, low):
+        failed = queue.get(job.id)
+        assert failed.status == "failed" and failed.error == "Rendering did not finish."
+    assert queue.get(high.id).result == {"qr_code_url": "https://example.com/qr.png"}
+    assert queue.prune(before=float("inf")) == 3
+    queue.close()
+
+
+def test_lapsed_attempt_cannot_record_outcome(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite", lease=10, max_attempts=3)
+    job = queue.submit("alice", {"url": "https://example.com/slow"})
+    lapsed = queue.take(now=1000.0)
+    current = queue.take(now=1011.0)
+    assert (lapsed.attempts, current.attempts) == (1, 2)
+
+    # The first worker finishing late must not overwrite the attempt now running.
+    assert not queue.finish(job.id, lapsed.attempts, error="late")
+    assert not queue.release(job.id, lapsed.attempts)
+    running = queue.get(job.id)
+    assert running.status == "running" and running.attempts == 2
+    assert queue.finish(job.id, current.attempts, result={"qr_code_url": "https://example.com/qr.png"})
+    assert queue.get(job.id).status == "succeeded"
+    queue.close()
+
+
+@pytest_asyncio.fixture
+async def jobs(isolated_storage, admission, tmp_path):
+    runner = JobRunner(JobQueue(tmp_path / "jobs.sqlite"), workers=2, poll_interval=0.05)
+    app.dependency_overrides[get_job_runner] = lambda: runner
+    runner.start(job_handler(get_render_engine(), get_render_cache(), app.dependency_overrides[get_qr_index](),
+                             app.dependency_overrides[get_storage](), admission))
+    yield runner
+    await runner.stop()
+    app.dependency_overrides.pop(get_job_runner, None)
+    runner.queue.close()
+
+
+@pytest.mark.asyncio
+async def test_job_is_rendered_in_background(jobs):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        accepted = await ac.post("/qr-codes/jobs", json={"url": "https://example.com/job", "size": 30, "priority": 9},
+                                 headers=headers)
+        assert accepted.status_code == 202
+        assert accepted.json()["status"] in ("queued", "running")
+        location = accepted.headers["location"]
+        assert accepted.json()["links"][0] == {"rel": "self", "href": location, "action": "GET",
+                                               "type": "application/json"}
+
+        done = await ac.get(location.split("/", 3)[-1], params={"wait": 10}, headers=headers)
+        assert done.json()["status"] == "succeeded"
+        qr_code_url = done.json()["qr_code_url"]
+        assert done.json()["links"][-1]["rel"] == "result"
+        image = await ac.get(qr_code_url.split("/", 3)[-1], headers=headers)
+        assert image.status_code == 200 and image.content.startswith(b"\x89PNG")
+
+        duplicate = await ac.post("/qr-codes/jobs", json={"url": "https://example.com/job"}, headers=headers)
+        failed = await ac.get(f"/qr-codes/jobs/{duplicate.json()['job_id']}", params={"wait": 10}, headers=headers)
+        assert failed.json()["status"] == "failed"
+        assert failed.json()["error"] == "QR code already exists."
+
+        others = jobs.queue.submit("someone-else", {"url": "https://example.com/other"})
+        not_yours = await ac.get(f"/qr-codes/jobs/{others.id}", headers=headers)
+        unauthenticated = await ac.post("/qr-codes/jobs", json={"url": "https://example.com/anonymous"})
+        too_long = await ac.get(location.split("/", 3)[-1], params={"wait": 3600}, headers=headers)
+
+    assert not_yours.status_code == 404
+    assert unauthenticated.status_code == 401
+    assert too_long.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_retried_job_succeeds_with_the_code_it_stored(isolated_storage, admission):
+    handle = job_handler(get_render_engine(), get_render_cache(), app.dependency_overrides[get_qr_index](),
+                         app.dependency_overrides[get_storage](), admission)
+    job = Job("retried", "admin", 0, {"url": "https://example.com/retried"}, "running", 1, 1000.0, 1000.0,
+              None, None, None)
+    stored = await handle(job)
+
+    # The attempt that stored the code was released or lapsed; the next one finds it.
+    assert await handle(job) == stored
+    assert await handle(job._replace(attempts=2)) == stored
+    with pytest.raises(JobFailed):
+        await handle(job._replace(id="later", created_at=float("inf")))
+
+
+@pytest.mark.asyncio
+async def test_jobs_wait_for_render_capacity(jobs, admission):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        with admission.reserve(admission.capacity):
+            accepted = await ac.post("/qr-codes/jobs", json={"url": "https://example.com/deferred"}, headers=headers)
+            status_url = accepted.headers["location"].split("/", 3)[-1]
+            pending = await ac.get(status_url, params={"wait": 0.2}, headers=headers)
+        done = await ac.get(status_url, params={"wait": 10}, headers=headers)
+
+    assert pending.json()["status"] in ("queued", "running")
+    assert done.json()["status"] == "succeeded"
@@ -0,0 +1,86 @@
+import io
+import json
+import logging
+import sys
+import pytest
+from httpx import AsyncClient
+from app.utils import log_pipeline
+from app.utils.log_pipeline import (DeferredQueueHandler, InfoSamplingFilter, JSONFormatter, LogSamplingMiddleware,
+                                    start_queue_logging, stop_queue_logging)
+
+
+class _Lazy:
+    formatted = 0
+
+    def __str__(self):
+        _Lazy.formatted += 1
+        return "lazy"
+
+
+@pytest.fixture
+def isolated_logger(monkeypatch):
+    monkeypatch.setattr(log_pipeline, "_listener", None)
+    logger = logging.getLogger("log_pipeline_test")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    stream = io.StringIO()
+    logger.handlers = [logging.StreamHandler(stream)]
+    yield logger, stream
+    stop_queue_logging()
+    logger.handlers = []
+
+
+def test_records_are_formatted_on_the_listener(isolated_logger):
+    logger, stream = isolated_logger
+    start_queue_logging(logger, json_format=True)
+    assert [type(handler) for handler in logger.handlers] == [DeferredQueueHandler]
+
+    _Lazy.formatted = 0
+    logger.info("value: %s", _Lazy())
+    stop_queue_logging()
+
+    record = json.loads(stream.getvalue().splitlines()[0])
+    assert record["message"] == "value: lazy"
+    assert record["level"] == "INFO"
+    assert record["time"].endswith("Z")
+    assert _Lazy.formatted == 1
+
+
+def test_sampling_filter_keeps_warnings():
+    sampling_filter = InfoSamplingFilter()
+    info = logging.LogRecord("x", logging.INFO, __file__, 1, "info", None, None)
+    warning = logging.LogRecord("x", logging.WARNING, __file__, 1, "warning", None, None)
+    assert sampling_filter.filter(info)
+    token = log_pipeline._info_sampled.set(False)
+    try:
+        assert not sampling_filter.filter(info)
+        assert sampling_filter.filter(warning)
+    finally:
+        log_pipeline._info_sampled.reset(token)
+
+
+@pytest.mark.asyncio
+async def test_middleware_sets_sampling_per_request():
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(log_pipeline._info_sampled.get())
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    async with AsyncClient(app=LogSamplingMiddleware(app, rate=0.0), base_url="http://test") as ac:
+        await ac.get("/")
+    async with AsyncClient(app=LogSamplingMiddleware(app, rate=1.0), base_url="http://test") as ac:
+        await ac.get("/")
+    assert seen == [False, None]
+    assert log_pipeline._info_sampled.get() is None
+
+
+def test_json_formatter_includes_exceptions():
+    try:
+        raise RuntimeError("boom")
+    except RuntimeError:
+        record = logging.LogRecord("x", logging.ERROR, __file__, 1, "failed %s", ("here",), sys.exc_info())
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["message"] == "failed here"
+    assert "RuntimeError: boom" in entry["exc_info"]
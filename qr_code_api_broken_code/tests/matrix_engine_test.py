@@ -0,0 +1,80 @@
+import pytest
+import qrcode
+from qrcode import util
+from app.services import matrix_engine
+from app.services.matrix_engine import FastMaskQRCode
+
+
+def _make(qr_class, data, version, error_correction):
+    qr = qr_class(version=version, error_correction=error_correction)
+    qr.add_data(data)
+    qr.make(fit=False)
+    return qr
+
+
+@pytest.mark.parametrize("version", [1, 2, 6, 7, 14, 27, 40])
+@pytest.mark.parametrize("error_correction", [qrcode.constants.ERROR_CORRECT_L, qrcode.constants.ERROR_CORRECT_H])
+def test_same_mask_and_matrix_as_qrcode(version, error_correction):
+    pytest.importorskip("numpy")
+    data = "QR CODE " * version  # fits the lowest capacity at every version
+    expected = _make(qrcode.QRCode, data, version, error_correction)
+    actual = _make(FastMaskQRCode, data, version, error_correction)
+    assert actual.modules == expected.modules
+    assert actual.best_mask_pattern() == expected.best_mask_pattern()
+
+
+def test_lost_points_match_qrcode_scoring():
+    np = pytest.importorskip("numpy")
+    qr = qrcode.QRCode(version=5)
+    qr.add_data("https://example.com/campaign?id=42")
+    matrices, expected = [], []
+    for mask_pattern in range(8):
+        qr.makeImpl(True, mask_pattern)
+        matrices.append(np.array(qr.modules, dtype=bool))
+        expected.append(util.lost_point(qr.modules))
+    assert matrix_engine.lost_points(np.stack(matrices)).tolist() == expected
+
+
+def test_falls_back_without_numpy(monkeypatch):
+    monkeypatch.setattr(matrix_engine, "np", None)
+    expected = _make(qrcode.QRCode, "https://example.com", 3, qrcode.constants.ERROR_CORRECT_M)
+    actual = _make(FastMaskQRCode, "https://example.com", 3, qrcode.constants.ERROR_CORRECT_M)
+    assert actual.modules == expected.modules
+
+
+@pytest.mark.parametrize("data", [
+    "1234567890" * 30,
+    "HTTPS://EXAMPLE.COM/" + "A1" * 150,
+    "https://example.com/" + "é" * 120,
+    "https://example.com/path?query=1&x=" + "7" * 400,
+])
+@pytest.mark.parametrize("error_correction", range(4))
+def test_planned_render_matches_qrcode(data, error_correction):
+    expected = qrcode.QRCode(version=1, error_correction=error_correction)
+    actual = FastMaskQRCode(version=1, error_correction=error_correction)
+    for qr in (expected, actual):
+        qr.add_data(data)
+        qr.make(fit=True)
+    assert actual.version == expected.version
+    assert actual.modules == expected.modules
+
+
+@pytest.mark.parametrize("version", range(1, 41))
+def test_template_and_placement_match_map_data(version):
+    data = "QR CODE " * version
+    for mask_pattern in (0, 5):
+        expected = _make(qrcode.QRCode, data, version, qrcode.constants.ERROR_CORRECT_L)
+        actual = _make(FastMaskQRCode, data, version, qrcode.constants.ERROR_CORRECT_L)
+        expected.makeImpl(False, mask_pattern)
+        actual.makeImpl(False, mask_pattern)
+        assert actual.modules == expected.modules
+
+
+def test_fit_version_crosses_length_field_boundary():
+    # Byte mode length fields grow from 8 to 16 bits at version 10: estimated
+    # with 8 bits this payload needs version 10, which then no longer fits it.
+    qr = qrcode.QRCode(version=1)
+    qr.add_data("x" * 214)
+    qr.make(fit=True)
+    assert qr.version == 11
+    assert matrix_engine.fit_version(qr.error_correction, ((util.MODE_8BIT_BYTE, 214),)) == 11
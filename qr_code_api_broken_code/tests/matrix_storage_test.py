@@ -0,0 +1,67 @@
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.routers import qr_code
+from app.services.qr_service import rasterize_matrix, render_qr_code_timed
+from app.services.render_cache import RenderCache, get_render_cache
+from app.utils.common import encode_url_to_filename
+from app.utils.metrics import STAGE_SECONDS
+
+URL = "https://example.com/variants"
+
+
+@pytest.mark.parametrize("output_format", ["png", "svg"])
+@pytest.mark.parametrize("size, fill_color, back_color", [(1, "black", "white"), (7, "#ff0000", "#00ff00"), (40, "navy", "ivory")])
+def test_rasterized_variants_match_direct_render(output_format, size, fill_color, back_color):
+    packed, _, _ = render_qr_code_timed(URL, output_format="bin")
+    expected, _, _ = render_qr_code_timed(URL, fill_color, back_color, size, output_format=output_format)
+    image, _ = rasterize_matrix(packed, output_format, size, fill_color, back_color)
+    assert image == expected
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+@pytest.mark.asyncio
+async def test_variants_are_drawn_from_stored_matrix(isolated_storage):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        created = await ac.post("/qr-codes/", json={"url": URL, "size": 3}, headers=headers)
+        assert created.status_code == 201
+        [stored] = isolated_storage.iterdir()
+        assert stored.suffix == ".qrm" and stored.stat().st_size < 500
+
+        conflict = await ac.post("/qr-codes/", json={"url": URL, "size": 8}, headers=headers)
+        assert conflict.status_code == 409
+        qr_id = encode_url_to_filename(URL)
+        assert conflict.json()["qr_code_url"].endswith(f"/qr-codes/{qr_id}.png?size=8")
+
+        # A cold cache must read the stored matrix rather than encode the URL again.
+        app.dependency_overrides[get_render_cache] = RenderCache
+        try:
+            encodes = STAGE_SECONDS.count("matrix")
+            for size in (2, 8, 20):
+                variant = await ac.get(f"/qr-codes/{qr_id}.png", params={"size": size, "fill_color": "blue"},
+                                       headers=headers)
+                assert variant.status_code == 200
+                assert variant.content == render_qr_code_timed(URL, "blue", "white", size)[0]
+            assert STAGE_SECONDS.count("matrix") == encodes
+        finally:
+            app.dependency_overrides.pop(get_render_cache)
+
+
+@pytest.mark.asyncio
+async def test_store_images_keeps_png_for_downloads(isolated_storage, monkeypatch):
+    monkeypatch.setattr(qr_code, "QR_STORE_IMAGES", True)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        created = await ac.post("/qr-codes/", json={"url": URL, "size": 3}, headers=headers)
+        filename = created.json()["qr_code_url"].split("?")[0].split("/")[-1]
+        assert sorted(path.suffix for path in isolated_storage.iterdir()) == [".png", ".qrm"]
+        assert (isolated_storage / filename).read_bytes() == render_qr_code_timed(URL, "red", "white", 3)[0]
+
+        deleted = await ac.delete(f"/qr-codes/{filename}", headers=headers)
+        assert deleted.status_code == 204
+    assert not list(isolated_storage.iterdir())
@@ -0,0 +1,50 @@
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.services.service_metrics import DirectoryStats, get_directory_stats
+from app.services.qr_index import get_qr_index
+from app.utils.metrics import STAGE_SECONDS, Histogram, Registry
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, 'a "b"')
+    lines = Registry().render([histogram]).splitlines()
+    assert lines[:2] == ["# HELP test_seconds Test.", "# TYPE test_seconds histogram"]
+    assert lines[2:] == [
+        'test_seconds_bucket{stage="a \\"b\\"",le="0.1"} 1',
+        'test_seconds_bucket{stage="a \\"b\\"",le="1.0"} 2',
+        'test_seconds_bucket{stage="a \\"b\\"",le="+Inf"} 3',
+        'test_seconds_sum{stage="a \\"b\\""} 5.55',
+        'test_seconds_count{stage="a \\"b\\""} 3',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_stages_and_state(isolated_storage):
+    app.dependency_overrides[get_directory_stats] = lambda: DirectoryStats(app.dependency_overrides[get_qr_index](),
+                                                                           interval=0)
+    auth_before = STAGE_SECONDS.count("auth")
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+            headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+            created = await ac.post("/qr-codes/", json={"url": "https://example.com/metrics", "size": 2}, headers=headers)
+            assert created.status_code == 201
+            response = await ac.get("/metrics")
+    finally:
+        app.dependency_overrides.pop(get_directory_stats, None)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert STAGE_SECONDS.count("auth") == auth_before + 1
+    for stage in ("auth", "encode", "filesystem", "index"):
+        assert f'qr_stage_duration_seconds_count{{stage="{stage}"}}' in body
+    assert 'qr_http_requests_total{method="POST",route="/qr-codes/",status="201"}' in body
+    assert 'qr_http_request_duration_seconds_bucket{method="POST",route="/qr-codes/",le="+Inf"}' in body
+    assert "qr_http_requests_in_flight 1" in body  # the scrape itself
+    assert "qr_index_entries 1" in body
+    assert "qr_directory_files 1" in body
+    assert f"qr_directory_bytes {sum(path.stat().st_size for path in isolated_storage.rglob('*.qrm'))}" in body
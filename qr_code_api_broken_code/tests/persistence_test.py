@@ -0,0 +1,65 @@
+import errno
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.services.storage import FileSystemStorage
+
+
+def test_exclusive_put_leaves_no_temporary_files(tmp_path):
+    storage = FileSystemStorage(tmp_path, fsync=True)
+
+    def put(i):
+        try:
+            storage.put("ab/code.qrm", f"matrix {i}".encode())
+            return True
+        except FileExistsError:
+            return False
+
+    with ThreadPoolExecutor(8) as pool:
+        outcomes = list(pool.map(put, range(32)))
+    storage.put("ab/code.url", b"https://example.com", exclusive=False)
+    storage.put("ab/code.url", b"https://example.com", exclusive=False)
+    assert outcomes.count(True) == 1
+    assert storage.get("ab/code.qrm") == f"matrix {outcomes.index(True)}".encode()
+    # Only the matrix and its sidecar; no temporary files left behind.
+    assert sorted(p.name for p in (tmp_path / "ab").iterdir()) == ["code.qrm", "code.url"]
+
+
+def test_exclusive_put_without_hard_links(tmp_path, monkeypatch):
+    def no_link(src, dst):
+        raise OSError(errno.EPERM, "Operation not permitted")
+
+    monkeypatch.setattr(os, "link", no_link)
+    storage = FileSystemStorage(tmp_path, fsync=False)
+    storage.put("code.qrm", b"matrix")
+    with pytest.raises(FileExistsError):
+        storage.put("code.qrm", b"other")
+    assert storage.get("code.qrm") == b"matrix"
+
+    # The empty file claiming the name of a write in progress reads as missing.
+    (tmp_path / "claimed.qrm").touch()
+    assert storage.stat("claimed.qrm") is None and not storage.exists("claimed.qrm")
+    with pytest.raises(FileNotFoundError):
+        storage.get("claimed.qrm")
+    with pytest.raises(FileNotFoundError):
+        list(storage.stream("claimed.qrm"))
+    assert [stored.key for stored in storage.list(10)[0]] == ["code.qrm"]
+    assert storage.usage() == (1, len(b"matrix"))
+
+
+@pytest.mark.asyncio
+async def test_duplicate_urls_in_one_batch_conflict(isolated_storage):
+    items = [{"url": "https://example.com/same", "size": 1}] * 6
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+        response = await ac.post("/qr-codes/batch", json=items, headers=headers)
+        listing = await ac.get("/qr-codes/", headers=headers)
+
+    statuses = sorted(json.loads(line)["status"] for line in response.text.splitlines())
+    assert statuses == [201] + [409] * 5
+    assert len(listing.json()) == 1
+    assert len(list(isolated_storage.rglob("*"))) == 1
@@ -0,0 +1,47 @@
+import io
+import png
+import pytest
+import qrcode
+from qrcode.image.pure import PyPNGImage
+from app.services.png_image import PackedPNGImage
+from app.utils.colors import parse_color
+
+
+def _render(data, image_factory, box_size, **kwargs):
+    qr = qrcode.QRCode(version=1, box_size=box_size, border=5, image_factory=image_factory)
+    qr.add_data(data)
+    qr.make(fit=True)
+    buffer = io.BytesIO()
+    qr.make_image(**kwargs).save(buffer)
+    return buffer.getvalue()
+
+
+def _decode_rgb(image):
+    width, height, rows, _ = png.Reader(bytes=image).asRGB8()
+    return width, height, [bytes(row) for row in rows]
+
+
+@pytest.mark.parametrize("data, box_size", [
+    ("https://example.com", 1),
+    ("https://example.com", 10),
+    ("https://example.com/" + "campaign/" * 60, 3),
+])
+def test_decodes_identically_to_pypng_output(data, box_size):
+    expected = _decode_rgb(_render(data, PyPNGImage, box_size))
+    actual = _decode_rgb(_render(data, PackedPNGImage, box_size, fill_color="black", back_color="white"))
+    assert actual == expected
+
+
+def test_palette_uses_fill_and_back_color():
+    reference = _decode_rgb(_render("https://example.com", PyPNGImage, 2))
+    width, height, rows = _decode_rgb(_render("https://example.com", PackedPNGImage, 2, fill_color="red", back_color="#00f"))
+
+    assert (width, height) == reference[:2]
+    colors = {b"\x00\x00\x00": bytes(parse_color("red")), b"\xff\xff\xff": bytes(parse_color("#00f"))}
+    for expected_row, row in zip(reference[2], rows):
+        assert row == b"".join(colors[expected_row[i:i + 3]] for i in range(0, len(expected_row), 3))
+
+
+def test_unknown_color_is_rejected():
+    with pytest.raises(ValueError):
+        _render("https://example.com", PackedPNGImage, 1, fill_color="not-a-color")
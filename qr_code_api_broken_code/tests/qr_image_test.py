@@ -0,0 +1,91 @@
+import pytest
+from urllib.parse import urlsplit
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.routers import qr_code
+from app.utils.common import encode_url_to_filename
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+@pytest.mark.asyncio
+async def test_get_image_by_id_with_etag_and_304():
+    qr_id = encode_url_to_filename("https://example.com/read-path")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        response = await ac.get(f"/qr-codes/{qr_id}.png", params={"size": 2}, headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "image/png"
+        assert response.content.startswith(b"\x89PNG")
+        assert response.headers["cache-control"] == qr_code.IMAGE_CACHE_CONTROL
+        etag = response.headers["etag"]
+
+        not_modified = await ac.get(f"/qr-codes/{qr_id}.png", params={"size": 2}, headers={**headers, "If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+        assert not_modified.headers["etag"] == etag
+
+        other_size = await ac.get(f"/qr-codes/{qr_id}.png", params={"size": 3}, headers={**headers, "If-None-Match": etag})
+        assert other_size.status_code == 200
+        assert other_size.headers["etag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_query_variant_matches_id_variant():
+    url = "https://example.com/read-path"
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        by_id = await ac.get(f"/qr-codes/{encode_url_to_filename(url)}.png", headers=await _auth_headers(ac))
+        by_query = await ac.get("/qr-codes/render.png", params={"url": url})
+        invalid_color = await ac.get("/qr-codes/render.png", params={"url": url, "fill_color": "nope"})
+    assert by_query.status_code == 200
+    assert by_query.headers["etag"] == by_id.headers["etag"]
+    assert by_query.content == by_id.content
+    assert invalid_color.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_unknown_id_is_not_found():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        response = await ac.get("/qr-codes/not-a-url.png", headers=await _auth_headers(ac))
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_stored_codes_need_credentials(isolated_storage):
+    url = "https://example.com/stored-read"
+    qr_id = encode_url_to_filename(url)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        # Unstored IDs only encode their URL, so they are as public as /render.
+        unstored = await ac.get(f"/qr-codes/{qr_id}.png")
+        headers = await _auth_headers(ac)
+        await ac.post("/qr-codes/", json={"url": url, "size": 2}, headers=headers)
+        by_extension = await ac.get(f"/qr-codes/{qr_id}.png")
+        negotiated = await ac.get(f"/qr-codes/{qr_id}")
+        invalid_token = await ac.get(f"/qr-codes/{qr_id}.png", headers={"Authorization": "Bearer nope"})
+        authenticated = await ac.get(f"/qr-codes/{qr_id}.png", headers=headers)
+    assert unstored.status_code == 200
+    assert unstored.headers["cache-control"] == qr_code.IMAGE_CACHE_CONTROL
+    assert by_extension.status_code == negotiated.status_code == invalid_token.status_code == 401
+    assert authenticated.status_code == 200
+    assert authenticated.headers["cache-control"] == qr_code.STORED_IMAGE_CACHE_CONTROL
+
+
+@pytest.mark.asyncio
+async def test_create_without_persistence_links_to_render_endpoint(monkeypatch, isolated_storage):
+    monkeypatch.setattr(qr_code, "QR_PERSIST", False)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        qr_request = {"url": "https://example.com/not-persisted", "size": 2}
+        first = await ac.post("/qr-codes/", json=qr_request, headers=headers)
+        second = await ac.post("/qr-codes/", json=qr_request, headers=headers)
+
+        assert first.status_code == second.status_code == 201
+        qr_code_url = first.json()["qr_code_url"]
+        assert "/qr-codes/" in qr_code_url and qr_code_url.endswith(".png?size=2")
+        parts = urlsplit(qr_code_url)
+        image = await ac.get(f"{parts.path}?{parts.query}", headers=headers)
+    assert image.status_code == 200
+    assert list(isolated_storage.iterdir()) == []
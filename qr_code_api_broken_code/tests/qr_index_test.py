@@ -0,0 +1,132 @@
+import json
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.services.qr_index import QRIndex
+from app.services.storage import FileSystemStorage
+from app.utils.common import encode_url_to_filename
+
+
+def _fill(index, count):
+    for i in range(count):
+        url = f"https://{'a' if i % 2 else 'b'}.example.com/{i}"
+        index.add(f"{encode_url_to_filename(url)}.png", url, 10, created_at=1000.0 + i // 2)
+
+
+def test_cursor_pagination_visits_every_entry_once(tmp_path):
+    index = QRIndex(tmp_path / "index.sqlite")
+    _fill(index, 25)
+
+    for descending in (False, True):
+        seen, cursor = [], None
+        while True:
+            entries, cursor = index.page(10, cursor=cursor, descending=descending)
+            seen += entries
+            if cursor is None:
+                break
+        assert len(seen) == 25 == len({entry.filename for entry in seen})
+        keys = [(entry.created_at, entry.filename) for entry in seen]
+        assert keys == sorted(keys, reverse=descending)
+
+
+def test_prefix_filter_and_rebuild(tmp_path):
+    index = QRIndex(tmp_path / "index.sqlite")
+    _fill(index, 10)
+    entries, cursor = index.page(100, prefix="https://a.example.com/")
+    assert cursor is None
+    assert {entry.url for entry in entries} == {f"https://a.example.com/{i}" for i in range(1, 10, 2)}
+
+    directory = tmp_path / "qr_codes"
+    directory.mkdir()
+    (directory / f"{encode_url_to_filename('https://example.com/on-disk')}.png").write_bytes(b"png")
+    (directory / "notes.txt").write_text("ignored")
+    assert index.rebuild(FileSystemStorage(directory)) == 1
+    entries, _ = index.page(100)
+    assert [entry.url for entry in entries] == ["https://example.com/on-disk"]
+    assert index.usage() == (1, 3)
+
+    with pytest.raises(ValueError):
+        index.page(10, cursor="garbage")
+
+
+def test_chunked_pages_match_page(tmp_path):
+    index = QRIndex(tmp_path / "index.sqlite")
+    _fill(index, 25)
+
+    for limit in (1, 7, 10, 25, 30):
+        for descending in (False, True):
+            entries, cursor = index.page(limit, descending=descending)
+            assert index.next_cursor(limit, descending=descending) == cursor
+            chunks = list(index.iter_pages(limit, descending=descending, page_size=4))
+            assert [entry for chunk in chunks for entry in chunk] == entries
+            assert all(len(chunk) <= 4 for chunk in chunks)
+    _, cursor = index.page(10)
+    assert index.next_cursor(10, cursor=cursor) == index.page(10, cursor=cursor)[1]
+
+
+def test_page_read_up_to_its_cursor_ends_where_the_next_starts(tmp_path):
+    for descending in (False, True):
+        index = QRIndex(tmp_path / f"index-{descending}.sqlite")
+        _fill(index, 10)
+        cursor = index.next_cursor(5, descending=descending)
+        first, _ = index.page(5, descending=descending)
+
+        # Entries removed from and added to the page after its cursor was sent.
+        index.remove(first[0].filename)
+        added_at = (first[1].created_at + first[2].created_at) / 2
+        index.add("added.png", "https://example.com/added", 10, created_at=added_at)
+        streamed = [entry for chunk in index.iter_pages(5, descending=descending, page_size=2, until=cursor)
+                    for entry in chunk]
+        rest, _ = index.page(100, cursor=cursor, descending=descending)
+        filenames = [entry.filename for entry in streamed + rest]
+        assert len(filenames) == len(set(filenames)) == 10
+        assert "added.png" in filenames[:5] and first[0].filename not in filenames
+        index.close()
+
+
+@pytest.mark.asyncio
+async def test_list_endpoint_pages_through_created_codes(isolated_storage):
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+        for i in range(3):
+            await ac.post("/qr-codes/", json={"url": f"https://example.com/list/{i}", "size": 1}, headers=headers)
+
+        first = await ac.get("/qr-codes/", params={"limit": 2}, headers=headers)
+        assert len(first.json()) == 2
+        assert 'rel="next"' in first.headers["link"]
+        second = await ac.get("/qr-codes/", params={"limit": 2, "cursor": first.headers["x-next-cursor"]}, headers=headers)
+        assert len(second.json()) == 1
+        assert "x-next-cursor" not in second.headers
+
+        bad_cursor = await ac.get("/qr-codes/", params={"cursor": "garbage"}, headers=headers)
+        assert bad_cursor.status_code == 400
+
+        filename = first.json()[0]["qr_code_url"].split("/")[-1]
+        await ac.delete(f"/qr-codes/{filename}", headers=headers)
+        remaining = await ac.get("/qr-codes/", headers=headers)
+    assert len(remaining.json()) == 2
+
+
+@pytest.mark.asyncio
+async def test_list_endpoint_streams_json_array_and_ndjson(isolated_storage, monkeypatch):
+    monkeypatch.setattr("app.routers.qr_code.LIST_CHUNK_SIZE", 2)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+        for i in range(5):
+            await ac.post("/qr-codes/", json={"url": f"https://example.com/stream/{i}", "size": 1}, headers=headers)
+
+        array = await ac.get("/qr-codes/", params={"limit": 4}, headers=headers)
+        ndjson = await ac.get("/qr-codes/", params={"limit": 4},
+                              headers={**headers, "Accept": "application/x-ndjson"})
+        empty = await ac.get("/qr-codes/", params={"prefix": "https://nowhere.example/"}, headers=headers)
+
+    assert array.headers["content-type"] == "application/json"
+    assert ndjson.headers["content-type"] == "application/x-ndjson"
+    assert array.headers["x-next-cursor"] == ndjson.headers["x-next-cursor"]
+    items = array.json()
+    assert len(items) == 4
+    assert [json.loads(line) for line in ndjson.text.splitlines()] == items
+    assert {link["rel"] for link in items[0]["links"]} == {"view", "alternate", "delete"}
+    assert empty.json() == []
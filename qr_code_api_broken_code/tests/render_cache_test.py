@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from app.services.qr_service import render_qr_code_cached
+from app.services.render_cache import RenderCache, render_key
+from app.services.render_engine import RenderEngine
+
+
+def _key(path: str):
+    return render_key(f"https://example.com/{path}", 10, "black", "white", "M")
+
+
+def test_render_key_is_canonical():
+    assert render_key("HTTPS://Example.COM:443", 10, "red", "white", "m") == \
+        render_key("https://example.com/", 10, "#FF0000", "rgb(255, 255, 255)", "M")
+    assert render_key("https://example.com/A", 10, "red", "white", "M") != \
+        render_key("https://example.com/a", 10, "red", "white", "M")
+
+
+def test_lru_eviction_by_bytes():
+    cache = RenderCache(max_bytes=10)
+    cache.put(_key("a"), b"aaaa")
+    cache.put(_key("b"), b"bbbb")
+    assert cache.get(_key("a")) == b"aaaa"  # "a" becomes most recently used
+    cache.put(_key("c"), b"cccc")
+    cache.put(_key("huge"), b"x" * 11)  # larger than the whole cache, never stored
+
+    assert cache.get(_key("b")) is None
+    assert cache.get(_key("huge")) is None
+    assert cache.get(_key("a")) == b"aaaa"
+    assert cache.stats() == {
+        "entries": 2, "bytes": 8, "max_bytes": 10,
+        "hits": 2, "misses": 2, "evictions": 1, "coalesced": 0, "inflight": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_render_once():
+    cache = RenderCache(max_bytes=1024)
+    renders = 0
+
+    async def render():
+        nonlocal renders
+        renders += 1
+        await asyncio.sleep(0.01)
+        return b"png"
+
+    results = await asyncio.gather(*(cache.get_or_render(_key("same"), render) for _ in range(10)))
+    assert results == [b"png"] * 10
+    assert renders == 1
+    assert cache.coalesced == 9
+    assert await cache.get_or_render(_key("same"), render) == b"png"
+    assert renders == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_render_is_not_cached():
+    cache = RenderCache(max_bytes=1024)
+
+    async def render():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_render(_key("fails"), render)
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_render_qr_code_cached_uses_engine_once():
+    engine = RenderEngine(workers=0, queue_depth=4)
+    cache = RenderCache(max_bytes=1024 * 1024)
+    try:
+        first = await render_qr_code_cached("https://example.com/cached", engine=engine, cache=cache, size=2)
+        second = await render_qr_code_cached("https://EXAMPLE.com/cached", engine=engine, cache=cache, size=2)
+    finally:
+        engine.shutdown()
+    assert first is second
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.services.qr_service import render_qr_code
+from app.services.render_engine import RenderEngine, RenderQueueFull, get_render_engine
+from app.config import RENDER_RETRY_AFTER
+
+
+@pytest.mark.asyncio
+async def test_render_in_worker_process():
+    engine = RenderEngine(workers=1, queue_depth=0)
+    try:
+        image = await engine.run(render_qr_code, "https://example.com", size=2)
+    finally:
+        engine.shutdown()
+    assert image.startswith(b"\x89PNG")
+    assert engine.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_and_cancel_releases_slot():
+    engine = RenderEngine(workers=0, queue_depth=1)
+    gate = threading.Event()
+    try:
+        running = asyncio.ensure_future(engine.run(gate.wait))
+        queued = asyncio.ensure_future(engine.run(gate.wait))
+        await asyncio.sleep(0.05)
+        assert engine.pending == 2
+        with pytest.raises(RenderQueueFull):
+            await engine.run(gate.wait)
+
+        # Cancelling a render that has not started frees its slot right away.
+        queued.cancel()
+        await asyncio.sleep(0.05)
+        assert engine.pending == 1
+
+        gate.set()
+        assert await running is True
+    finally:
+        gate.set()
+        engine.shutdown()
+    assert engine.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_create_qr_code_busy_returns_503():
+    full_engine = RenderEngine(workers=0, queue_depth=0)
+    full_engine._pending = full_engine.capacity
+    app.dependency_overrides[get_render_engine] = lambda: full_engine
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+            headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+            response = await ac.post("/qr-codes/", json={"url": "https://busy.example.com"}, headers=headers)
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(RENDER_RETRY_AFTER)
+
+
+@pytest.mark.asyncio
+async def test_drain_renders_queued_work_before_stopping():
+    engine = RenderEngine(workers=0, queue_depth=2)
+    gate = threading.Event()
+    running = asyncio.ensure_future(engine.run(gate.wait))
+    queued = asyncio.ensure_future(engine.run(render_qr_code, "https://example.com", size=1))
+    await asyncio.sleep(0.05)
+    stopping = asyncio.get_running_loop().run_in_executor(None, lambda: engine.shutdown(wait=True, drain=True))
+    gate.set()
+    await stopping
+    assert await running is True
+    assert (await queued).startswith(b"\x89PNG")
+
+
+@pytest.mark.asyncio
+async def test_late_broken_pool_failure_keeps_its_successor():
+    engine = RenderEngine(workers=0, queue_depth=1)
+    broken = engine.start()
+    engine._reset(broken)
+    healthy = engine.start()
+    try:
+        # A render of the broken pool failing after the restart leaves the new pool alone.
+        engine._reset(broken)
+        assert engine.start() is healthy
+        assert (await engine.run(render_qr_code, "https://example.com", size=1)).startswith(b"\x89PNG")
+    finally:
+        engine.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_failed_pool_start_releases_slot(monkeypatch):
+    engine = RenderEngine(workers=0, queue_depth=0)
+
+    def fail():
+        raise OSError("Too many open files")
+
+    monkeypatch.setattr(engine, "start", fail)
+    for _ in range(engine.capacity + 1):
+        with pytest.raises(OSError):
+            await engine.run(render_qr_code, "https://example.com", size=1)
+    assert engine.pending == 0
@@ -0,0 +1,74 @@
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.routers import qr_code
+from app.services.qr_index import QRIndex
+from app.services.storage import FileSystemStorage
+from app.services.storage_migration import migrate_to_sharded
+from app.utils.common import (decode_filename_to_url, encode_url_to_filename, hash_url_to_qr_id, qr_relative_path,
+                              url_to_qr_id)
+
+LONG_URL = "https://example.com/" + "segment/" * 60
+
+
+def test_hashed_ids_are_sharded_and_fixed_length():
+    qr_id = url_to_qr_id(LONG_URL, "sharded")
+    assert len(qr_id) == 32
+    assert qr_id == hash_url_to_qr_id("HTTPS://Example.com:443/" + "segment/" * 60)
+    assert qr_relative_path(f"{qr_id}.png") == f"{qr_id[:2]}/{qr_id[2:4]}/{qr_id}.png"
+    flat_id = url_to_qr_id("https://example.com", "flat")
+    assert qr_relative_path(f"{flat_id}.png") == f"{flat_id}.png"
+
+
+@pytest.mark.asyncio
+async def test_sharded_layout_stores_long_urls(isolated_storage, monkeypatch):
+    monkeypatch.setattr(qr_code, "QR_STORAGE_LAYOUT", "sharded")
+    assert len(encode_url_to_filename(LONG_URL)) > 255
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+        created = await ac.post("/qr-codes/", json={"url": LONG_URL, "size": 1}, headers=headers)
+        assert created.status_code == 201
+        qr_id = hash_url_to_qr_id(LONG_URL)
+        assert created.json()["qr_code_url"].endswith(f"/qr-codes/{qr_id}.png?size=1")
+        assert (isolated_storage / qr_id[:2] / qr_id[2:4] / f"{qr_id}.qrm").is_file()
+        assert decode_filename_to_url(qr_id, isolated_storage) == LONG_URL
+
+        image = await ac.get(f"/qr-codes/{qr_id}.png", params={"size": 1}, headers=headers)
+        assert image.status_code == 200
+        listed = await ac.get("/qr-codes/", headers=headers)
+        assert listed.json()[0]["qr_code_url"] == created.json()["qr_code_url"]
+
+        deleted = await ac.delete(f"/qr-codes/{qr_id}.png", headers=headers)
+        assert deleted.status_code == 204
+    assert not list(isolated_storage.rglob("*.*"))
+
+
+def test_migration_moves_flat_files(tmp_path):
+    directory = tmp_path / "qr_codes"
+    directory.mkdir()
+    index = QRIndex(tmp_path / "index.sqlite")
+    urls = [f"https://example.com/migrate/{i}" for i in range(3)]
+    for url in urls:
+        filename = f"{encode_url_to_filename(url)}.png"
+        (directory / filename).write_bytes(b"png")
+        (directory / filename).with_suffix(".qrm").write_bytes(b"matrix")
+        index.add(filename, url, 5)
+    (directory / "notes.png").write_bytes(b"not an id")
+    (directory / "dGVzdA.png").write_bytes(b"base64 of a word, not a URL")
+
+    assert migrate_to_sharded(directory, index, dry_run=True) == 3
+    assert len(list(directory.glob("*.png"))) == 5
+
+    assert migrate_to_sharded(directory, index) == 3
+    assert sorted(path.name for path in directory.glob("*.png")) == ["dGVzdA.png", "notes.png"]
+    for url in urls:
+        qr_id = hash_url_to_qr_id(url)
+        assert (directory / qr_relative_path(f"{qr_id}.png")).read_bytes() == b"png"
+        assert (directory / qr_relative_path(f"{qr_id}.qrm")).read_bytes() == b"matrix"
+        assert decode_filename_to_url(qr_id, directory) == url
+    entries, _ = index.page(10)
+    assert {(entry.filename, entry.size) for entry in entries} == {(f"{hash_url_to_qr_id(url)}.png", 5) for url in urls}
+
+    assert index.rebuild(FileSystemStorage(directory)) == 5
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.services import storage as storage_module
+from app.services.storage import FileSystemStorage, SQLiteBlobStorage, Storage, copy_storage, get_storage
+
+
+@pytest.fixture(params=["filesystem", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        storage = SQLiteBlobStorage(tmp_path / "blobs.sqlite", pool_size=2)
+    else:
+        storage = FileSystemStorage(tmp_path / "qr_codes", fsync=False)
+    yield storage
+    storage.close()
+
+
+def test_storage_contract(storage):
+    storage.put("ab/one.qrm", b"one")
+    storage.put("ab/two.png", b"two" * 50000)
+    storage.put("cd/three.url", b"https://example.com/three")
+    with pytest.raises(FileExistsError):
+        storage.put("ab/one.qrm", b"other")
+    storage.put("ab/one.qrm", b"replaced", exclusive=False)
+
+    assert storage.get("ab/one.qrm") == b"replaced"
+    assert b"".join(storage.stream("ab/two.png", chunk_size=4096)) == b"two" * 50000
+    assert storage.stat("ab/two.png").size == 150000
+    assert storage.stat("missing.qrm") is None
+    with pytest.raises(FileNotFoundError):
+        storage.get("missing.qrm")
+    # Sidecars are stored but do not count as QR codes.
+    assert storage.usage() == (2, len(b"replaced") + 150000)
+
+    first, cursor = storage.list(2)
+    rest, last = storage.list(2, cursor)
+    assert [stored.key for stored in first + rest] == ["ab/one.qrm", "ab/two.png", "cd/three.url"]
+    assert last is None
+    assert sorted(stored.key for stored in storage.iter_objects(prefix="ab/", page_size=1)) == ["ab/one.qrm", "ab/two.png"]
+
+    assert storage.delete("ab/one.qrm") is True
+    assert storage.delete("ab/one.qrm") is False
+    assert not storage.exists("ab/one.qrm")
+
+
+def test_incomplete_backend_cannot_be_created():
+    class WriteOnlyStorage(Storage):
+        def put(self, key, data, exclusive=True):
+            pass
+
+    with pytest.raises(TypeError):
+        WriteOnlyStorage()
+
+
+def test_exclusive_put_has_one_winner(storage):
+    def put(i):
+        try:
+            storage.put("race.qrm", str(i).encode())
+            return True
+        except FileExistsError:
+            return False
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(put, range(32)))
+    assert results.count(True) == 1
+    assert storage.get("race.qrm") == str(results.index(True)).encode()
+
+
+@pytest.mark.parametrize("blob_io", [True, False])
+def test_blob_store_streams_with_and_without_blob_io(tmp_path, monkeypatch, blob_io):
+    monkeypatch.setattr(storage_module, "_BLOB_IO", blob_io and storage_module._BLOB_IO)
+    blobs = SQLiteBlobStorage(tmp_path / "blobs.sqlite")
+    blobs.put("ab/big.png", bytes(range(256)) * 1000)
+    chunks = list(blobs.stream("ab/big.png", chunk_size=100000))
+    with pytest.raises(FileNotFoundError):
+        list(blobs.stream("missing.png"))
+    blobs.close()
+    assert [len(chunk) for chunk in chunks] == [100000, 100000, 56000]
+    assert b"".join(chunks) == bytes(range(256)) * 1000
+
+
+def test_blob_store_group_commits_and_copies(tmp_path):
+    source = FileSystemStorage(tmp_path / "qr_codes", fsync=False)
+    for i in range(50):
+        source.put(f"{i:02d}/code.qrm", bytes([i]) * 10)
+    target = SQLiteBlobStorage(tmp_path / "blobs.sqlite", batch_size=16)
+    assert copy_storage(source, target) == 50
+    assert copy_storage(source, target) == 0
+
+    commits = target.commits
+    with ThreadPoolExecutor(16) as executor:
+        list(executor.map(lambda i: target.put(f"extra/{i}.qrm", b"x"), range(64)))
+    # Concurrent writes share transactions instead of committing one by one.
+    assert target.commits - commits < 64
+    target.close()
+    with pytest.raises(RuntimeError):
+        target.put("closed.qrm", b"x")
+
+    reopened = SQLiteBlobStorage(tmp_path / "blobs.sqlite")
+    assert reopened.usage() == (114, 50 * 10 + 64)
+    assert reopened.get("07/code.qrm") == bytes([7]) * 10
+    reopened.close()
+
+
+async def _auth_headers(ac):
+    token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+    return {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+
+
+@pytest.mark.asyncio
+async def test_api_on_blob_store(isolated_storage, tmp_path):
+    blobs = SQLiteBlobStorage(tmp_path / "blobs.sqlite")
+    app.dependency_overrides[get_storage] = lambda: blobs
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        headers = await _auth_headers(ac)
+        created = await ac.post("/qr-codes/", json={"url": "https://example.com/blob", "size": 2}, headers=headers)
+        assert created.status_code == 201
+        qr_id = created.json()["qr_code_url"].rsplit("/", 1)[-1].split(".")[0]
+        image = await ac.get(f"/qr-codes/{qr_id}.png", headers=headers)
+        deleted = await ac.delete(f"/qr-codes/{qr_id}.png", headers=headers)
+
+    assert image.status_code == 200 and image.content.startswith(b"\x89PNG")
+    assert deleted.status_code == 204
+    assert list(isolated_storage.iterdir()) == []
+    assert blobs.usage() == (0, 0)
+    blobs.close()
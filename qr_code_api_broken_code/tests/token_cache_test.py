@@ -0,0 +1,60 @@
+import pytest
+from datetime import timedelta
+from fastapi import HTTPException
+from httpx import AsyncClient
+from qr_code_api_broken_code.main import app
+from app.utils.common import create_access_token, verify_token
+from app.utils.token_cache import TokenCache, get_token_cache
+
+
+def test_entries_expire_with_the_token():
+    cache = TokenCache(max_entries=10, ttl=300)
+    cache.put("short", {"username": "a"}, exp=1010, now=1000)
+    cache.put("long", {"username": "b"}, exp=5000, now=1000)
+    assert cache.get("short", now=1009) == {"username": "a"}
+    assert cache.get("short", now=1010) is None
+    assert cache.get("long", now=1299) == {"username": "b"}
+    assert cache.get("long", now=1300) is None
+    cache.put("expired", {"username": "c"}, exp=900, now=1000)
+    assert len(cache) == 0
+    assert cache.stats()["expirations"] == 2
+
+
+def test_size_cap_evicts_least_recently_used():
+    cache = TokenCache(max_entries=2, ttl=300)
+    cache.put("a", {"username": "a"})
+    cache.put("b", {"username": "b"})
+    cache.get("a")
+    cache.put("c", {"username": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_verify_token_caches_only_valid_tokens():
+    cache = TokenCache(max_entries=10, ttl=300)
+    token = create_access_token({"sub": "admin"}, timedelta(minutes=5))
+    assert verify_token(token, cache) == {"username": "admin"}
+    assert verify_token(token, cache) == {"username": "admin"}
+    assert cache.stats()["hits"] == 1
+
+    with pytest.raises(HTTPException):
+        verify_token(token + "x", cache)
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_protected_endpoints_use_the_cache(isolated_storage):
+    cache = TokenCache(max_entries=10, ttl=300)
+    app.dependency_overrides[get_token_cache] = lambda: cache
+    try:
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            token_response = await ac.post("/token", data={"username": "admin", "password": "secret"})
+            headers = {"Authorization": f"Bearer {token_response.json()['access_token']}"}
+            for _ in range(3):
+                assert (await ac.get("/qr-codes/", headers=headers)).status_code == 200
+            bad = await ac.get("/qr-codes/", headers={"Authorization": "Bearer nope"})
+    finally:
+        app.dependency_overrides.pop(get_token_cache, None)
+    assert bad.status_code == 401
+    assert cache.stats()["hits"] == 2